@@ -1,3 +1,6 @@
+-- Trigram similarity for fuzzy item search ("tomatos", "tamatr")
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Create the listings table if it doesn't exist
 CREATE TABLE IF NOT EXISTS listings (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(), -- Unique ID for the listing
@@ -7,6 +10,93 @@ CREATE TABLE IF NOT EXISTS listings (
     seller_name TEXT DEFAULT 'Unknown',
     seller_contact NUMERIC(10) NOT NULL,
     status VARCHAR(50) NOT NULL DEFAULT 'active', -- 'active', 'sold'
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP, -- Pages are keyed on (created_at, id)
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP, -- Set by listings_touch_updated_at; /listings/changes is keyed on (updated_at, id)
+    -- Full-text document for /search_listings; the item name weighs more than the description
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(item_name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
+);
+
+-- Keyset pagination for /get_all_listings: newest first, optionally filtered by status or seller
+CREATE INDEX IF NOT EXISTS listings_created_idx ON listings (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS listings_status_created_idx ON listings (status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS listings_seller_created_idx ON listings (seller_contact, created_at DESC, id DESC);
+
+-- /search_listings: full-text matches and trigram similarity on the name and description
+CREATE INDEX IF NOT EXISTS listings_search_vector_idx ON listings USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS listings_item_name_trgm_idx ON listings USING GIN (item_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS listings_description_trgm_idx ON listings USING GIN (description gin_trgm_ops);
+
+-- Transactional outbox for SMS notifications: rows are written in the same transaction as the
+-- change they announce and sent by notification_worker.py, so requests never wait on Twilio
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL, -- 'order_received'
+    listing_id UUID,
+    to_phone VARCHAR(20) NOT NULL, -- E.164, e.g. +919876543210
+    body TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- 'pending', 'sent', 'failed'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    provider_message_id VARCHAR(64), -- Twilio message SID
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP WITH TIME ZONE
+);
+
+-- The worker only ever reads pending rows that are due
+CREATE INDEX IF NOT EXISTS notification_outbox_due_idx ON notification_outbox (next_attempt_at) WHERE status = 'pending';
+
+-- One row per sale, written by the same statement that marks the listing sold. A retried
+-- /sell_item request with the same idempotency key finds its order instead of selling again.
+CREATE TABLE IF NOT EXISTS orders (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    idempotency_key VARCHAR(255) NOT NULL UNIQUE,
+    listing_id UUID NOT NULL, -- No foreign key: the order outlives a deleted listing
+    item_name VARCHAR(255) NOT NULL,
+    price NUMERIC(10, 2) NOT NULL,
+    seller_contact NUMERIC(10) NOT NULL,
+    buyer_contact VARCHAR(20),
+    status VARCHAR(50) NOT NULL DEFAULT 'placed', -- 'placed'
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- A listing is a single item, so it can only ever be ordered once
+CREATE UNIQUE INDEX IF NOT EXISTS orders_listing_idx ON orders (listing_id);
+
+-- /listings/changes: every insert and update stamps updated_at with the time of the write itself,
+-- so polling consumers can read just the rows changed after their cursor
+CREATE OR REPLACE FUNCTION listings_touch_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER listings_touch_updated_at
+    BEFORE INSERT OR UPDATE ON listings
+    FOR EACH ROW EXECUTE FUNCTION listings_touch_updated_at();
+
+CREATE INDEX IF NOT EXISTS listings_updated_idx ON listings (updated_at, id);
+
+-- Deleted listings leave a tombstone, so consumers of /listings/changes learn about deletions too
+CREATE TABLE IF NOT EXISTS listing_tombstones (
+    listing_id UUID PRIMARY KEY,
+    deleted_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT clock_timestamp()
+);
+
+CREATE INDEX IF NOT EXISTS listing_tombstones_deleted_idx ON listing_tombstones (deleted_at, listing_id);
+
+CREATE OR REPLACE FUNCTION listings_record_tombstone() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO listing_tombstones (listing_id) VALUES (OLD.id)
+    ON CONFLICT (listing_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER listings_record_tombstone
+    AFTER DELETE ON listings
+    FOR EACH ROW EXECUTE FUNCTION listings_record_tombstone();
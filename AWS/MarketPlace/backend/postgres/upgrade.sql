@@ -0,0 +1,20 @@
+-- Brings a database created by an older init.sql up to date. The db-upgrade service runs this and
+-- then init.sql on every start, since docker-entrypoint-initdb.d scripts only run on an empty
+-- volume; init.sql's CREATE ... IF NOT EXISTS / CREATE OR REPLACE statements then add the missing
+-- tables, indexes and triggers. Every statement is a no-op on a current schema.
+
+-- Trigram similarity for fuzzy item search, used by init.sql's trigram indexes
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Keyset pagination and /listings/changes rely on both timestamps being set
+UPDATE listings SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+UPDATE listings SET updated_at = created_at WHERE updated_at IS NULL;
+ALTER TABLE listings
+    ALTER COLUMN created_at SET NOT NULL,
+    ALTER COLUMN updated_at SET NOT NULL;
+
+-- Full-text document for /search_listings; must match the definition in init.sql
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(item_name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(description, '')), 'B')
+) STORED;
@@ -1,14 +1,18 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import uuid
-from database import get_db_connection
+from listings_cache import get_listings_cache
 import json
 import os
 import base64
 import time
 import sys
+from itertools import chain
 
-from database_logic import create_listing_in_db, remove_listing_from_db
+from database_logic import (
+	DEFAULT_PAGE_SIZE, DEFAULT_SEARCH_LIMIT, DEFAULT_SEMANTIC_K, MAX_SEMANTIC_K,
+	bulk_create_listings_in_db, create_listing_in_db, export_listings, get_listing_changes, get_listing_index, get_listings_page, place_order_in_db, remove_listing_from_db, search_listings
+)
 
 app = Flask(__name__)
 CORS(app)
@@ -40,6 +44,23 @@ def add_listing():
 	else:
 		return jsonify({"error": result.get("message")}), 500
 
+@app.route('/bulk_add_listings', methods=['POST'])
+def bulk_add_listings():
+	"""
+	API endpoint to add many listings at once, e.g. a cooperative's whole inventory.
+	Body: {"listings": [{item_name, price, seller_contact, description, seller_name}, ...]}.
+	All listings are added in one transaction, or none if any of them is invalid.
+	"""
+	data = request.get_json(silent=True) or {}
+	result = bulk_create_listings_in_db(data.get('listings'))
+
+	if result.get("status") == "success":
+		return jsonify(result), 201
+	elif result.get("status") == "invalid":
+		return jsonify(result), 400
+	else:
+		return jsonify({"error": result.get("message")}), 500
+
 @app.route('/delete_listing', methods=['POST'])
 def delete_listing():
 	"""API endpoint to delete an item listing."""
@@ -60,104 +81,177 @@ def delete_listing():
 
 @app.route('/sell_item', methods=['POST'])
 def sell_item():
-	"""API endpoint to mark an existing item listing as sold."""
+	"""
+	API endpoint to sell an active listing to a buyer. Marking it sold, recording the order and
+	queueing the seller's SMS (sent by notification_worker.py) is one database statement.
+	Send an Idempotency-Key header (or idempotency_key field) that stays the same across retries
+	of one purchase: a retry then returns the original order instead of failing as already sold.
+	"""
 	data = request.json
 	listing_id = data.get('listing_id')
-	listing_name = data.get('listing_name')
 	buyer_contact = data.get('buyer_contact')
-	seller_contact = "9876543210"
+	idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key') or str(uuid.uuid4())
 
 	if not listing_id:
 		return jsonify({"error": "listing_id is required"}), 400
 
+	result = place_order_in_db(listing_id, buyer_contact, idempotency_key)
+
+	if result.get("status") == "success":
+		return jsonify(result), 200
+	elif result.get("status") == "not_found":
+		return jsonify(result), 404
+	elif result.get("status") == "conflict":
+		return jsonify(result), 409
+	else:
+		return jsonify({"error": result.get("message")}), 500
+
+@app.route('/get_all_listings', methods=['GET'])
+def get_all_listings():
+	"""
+	API endpoint to retrieve item listings, newest first, one page at a time.
+	Query parameters: status (active, sold or all; default active), seller_contact, limit
+	(default 100), fields (comma-separated columns) and cursor (next_cursor of the previous page).
+	Pages are cached until the next change to the listings; a request whose If-None-Match holds
+	the current ETag gets a 304 without touching the database.
+	"""
+	params = {
+		'status': request.args.get('status', 'active'),
+		'seller_contact': request.args.get('seller_contact'),
+		'limit': request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+		'cursor': request.args.get('cursor'),
+		'fields': request.args.get('fields').split(',') if request.args.get('fields') else None
+	}
+	listings_cache = get_listings_cache()
+	# Read before the database, so a page is never stored under a version newer than its data
+	version = listings_cache.version() if listings_cache is not None else None
+	if version is None:
+		etag = None
+		body = None
+	else:
+		etag = listings_cache.etag(version, params)
+		if request.if_none_match.contains(etag):
+			response = Response(status=304)
+			response.set_etag(etag)
+			response.headers['Cache-Control'] = 'no-cache'
+			return response
+		body = listings_cache.get(version, params)
 	try:
-		conn = get_db_connection()
-		cur = conn.cursor()
-		query = "SELECT seller_contact FROM listings WHERE id = %s;"
-		cur.execute(query, (listing_id,))
-
-		# Fetch the result
-		result = cur.fetchone()
-
-		if result:
-			seller_contact = str(result[0])
-		else:
-			print(f"No listing found with ID: {listing_id}")
-
-		cur.execute(
-			"""
-			UPDATE listings
-			SET status = 'sold', updated_at = CURRENT_TIMESTAMP
-			WHERE id = %s AND status = 'active'
-			RETURNING id, item_name;
-			""",
-			(listing_id,)
+		if body is None:
+			body = app.json.dumps(get_listings_page(**params))
+			if etag is not None:
+				listings_cache.set(version, params, body.encode())
+		response = Response(body, status=200, mimetype='application/json')
+		if etag is not None:
+			response.set_etag(etag)
+			response.headers['Cache-Control'] = 'no-cache' # Revalidate every time; a 304 is cheap
+		return response
+	except ValueError as e:
+		return jsonify({"error": str(e)}), 400
+	except Exception as e:
+		print(f"Error fetching listings: {e}") # Log the error
+		return jsonify({"error": str(e)}), 500
+
+@app.route('/export_listings', methods=['GET'])
+def export_listings_endpoint():
+	"""
+	API endpoint to download listings in bulk, oldest first, for analytics and sync consumers.
+	Query parameters: format (ndjson, one listing per line, or json, one array; default ndjson),
+	status (active, sold or all; default all), seller_contact and fields (comma-separated columns).
+	The response is streamed while rows are read from the database, so its size is not limited
+	by memory.
+	"""
+	export_format = request.args.get('format', 'ndjson')
+	if export_format not in ('ndjson', 'json'):
+		return jsonify({"error": "format must be ndjson or json"}), 400
+	try:
+		listings = export_listings(
+			status=request.args.get('status', 'all'),
+			seller_contact=request.args.get('seller_contact'),
+			fields=request.args.get('fields').split(',') if request.args.get('fields') else None
 		)
-		updated_row = cur.fetchone()
-		conn.commit()
-		cur.close()
-		conn.close()
-
-		if updated_row:
-			return jsonify({
-				"status": "success",
-				"message": f"Listing '{listing_id}' for '{updated_row[1]}' marked as sold.",
-				"buyer_id": buyer_id # Still passing buyer_id even if not stored
-			}), 200
-		else:
-			return jsonify({
-				"status": "not_found",
-				"message": f"Listing '{listing_id}' not found or already sold."
-			}), 404
+		# Reading the first row opens the cursor, so database errors still get a proper status
+		first = next(listings, None)
+	except ValueError as e:
+		return jsonify({"error": str(e)}), 400
 	except Exception as e:
-		print(f"Error selling item: {e}")
+		print(f"Error exporting listings: {e}")
 		return jsonify({"error": str(e)}), 500
-	finally:
-		sms_message = f"🛍️ Order Received! You have received an order for '{listing_name}'. Call buyer at {buyer_contact}"
 
+	def generate():
+		rows = chain([first], listings) if first is not None else []
 		try:
-			sms = sms_client.messages.create(
-				body=sms_message,
-				from_=TWILIO_PHONE_NUMBER,
-				to="+91"+seller_contact
-			)
-			print(f"✅ SMS sent to {to_phone} (SID: {sms.sid})")
-			return {"status": "success", "message_sid": sms.sid}
+			if export_format == 'ndjson':
+				for listing in rows:
+					yield app.json.dumps(listing) + "\n"
+			else:
+				yield "["
+				for index, listing in enumerate(rows):
+					yield ("," if index else "") + app.json.dumps(listing)
+				yield "]"
 		except Exception as e:
-			print(f"❌ SMS failed: {e}")
-			return {"status": "error", "message": str(e)}
+			# The status line has been sent already; a truncated body is all that can signal this
+			print(f"Error exporting listings: {e}")
+		finally:
+			listings.close() # Returns the connection at once if the client went away
 
-@app.route('/get_all_listings', methods=['GET'])
-def get_all_listings():
-	"""API endpoint to retrieve all active item listings."""
+	mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'application/json'
+	return Response(generate(), mimetype=mimetype)
+
+@app.route('/listings/changes', methods=['GET'])
+def listing_changes():
+	"""
+	API endpoint for consumers that keep a copy of the listings: the listings inserted, updated or
+	deleted since a cursor, oldest first. Query parameters: since (next_cursor of the previous
+	call; omit it to start from the beginning) and limit (default 100). Poll again with the
+	returned next_cursor, right away while has_more is true.
+	"""
 	try:
-		conn = get_db_connection()
-		cur = conn.cursor()
-		# Fetch all columns including the new seller_name and seller_contact
-		cur.execute("SELECT * FROM listings;")
-		
-		# Get column names from the cursor description
-		columns = [col[0] for col in cur.description]
-		
-		# Fetch all rows and map them to dictionaries using column names
-		listings = [dict(zip(columns, row)) for row in cur.fetchall()]
-		
-		cur.close()
-		conn.close()
-
-		# Convert UUID objects and Decimal objects to JSON-serializable types (string and float)
-		for listing in listings:
-			if 'id' in listing:
-				listing['id'] = str(listing['id'])
-			if 'price' in listing:
-				listing['price'] = float(listing['price'])
-			# seller_contact is NUMERIC in DB, will be int or float in Python; ensure it's simple
-			if 'seller_contact' in listing and listing['seller_contact'] is not None:
-				listing['seller_contact'] = str(int(listing['seller_contact'])) # Convert to string for phone numbers
-
-		return jsonify({"status": "success", "listings": listings}), 200
+		result = get_listing_changes(
+			since=request.args.get('since'),
+			limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+		)
+		return jsonify(result), 200
+	except ValueError as e:
+		return jsonify({"error": str(e)}), 400
 	except Exception as e:
-		print(f"Error fetching listings: {e}") # Log the error
+		print(f"Error fetching listing changes: {e}")
+		return jsonify({"error": str(e)}), 500
+
+@app.route('/search_listings', methods=['GET'])
+def search_listings_endpoint():
+	"""
+	API endpoint to find active listings by an approximate item name, best match first.
+	Query parameters: q (required) and limit (default 20).
+	"""
+	try:
+		result = search_listings(request.args.get('q', ''), limit=request.args.get('limit', DEFAULT_SEARCH_LIMIT, type=int))
+		return jsonify(result), 200
+	except ValueError as e:
+		return jsonify({"error": str(e)}), 400
+	except Exception as e:
+		print(f"Error searching listings: {e}")
+		return jsonify({"error": str(e)}), 500
+
+@app.route('/semantic_search_listings', methods=['GET'])
+def semantic_search_listings():
+	"""
+	API endpoint to find active listings by meaning rather than keywords, e.g. "fresh vegetables".
+	Query parameters: q (required) and k (number of listings, default 10).
+	"""
+	query = request.args.get('q', '').strip()
+	k = request.args.get('k', DEFAULT_SEMANTIC_K, type=int)
+	if not query:
+		return jsonify({"error": "q is required"}), 400
+	if not 1 <= k <= MAX_SEMANTIC_K:
+		return jsonify({"error": f"k must be between 1 and {MAX_SEMANTIC_K}"}), 400
+	index = get_listing_index()
+	if index is None:
+		return jsonify({"error": "Semantic search is not available"}), 503
+	try:
+		return jsonify({"status": "success", "listings": index.search(query, k)}), 200
+	except Exception as e:
+		print(f"Error in semantic listing search: {e}")
 		return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
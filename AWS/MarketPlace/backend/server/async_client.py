@@ -0,0 +1,93 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+# Reuse the AWS clients, cache and gateway configuration of the Flask gateway so both stay in sync
+import client as gateway
+from pipeline import StageError
+from resilience import DEPENDENCY_TIMEOUTS
+from voice_pipeline import VoiceGateway
+
+# Blocking boto3 / Redis / embedding calls run on this pool. Transcription polling sleeps on the
+# event loop instead of a thread, so a thread is only held while a request is doing actual I/O.
+VOICE_GATEWAY_IO_THREADS = int(os.getenv('VOICE_GATEWAY_IO_THREADS', 256))
+
+io_executor = ThreadPoolExecutor(max_workers=VOICE_GATEWAY_IO_THREADS, thread_name_prefix='voice-io')
+async_llm_client = AsyncOpenAI(api_key=gateway.GEMINI_API_KEY, base_url="https://generativelanguage.googleapis.com/v1beta/openai/", timeout=DEPENDENCY_TIMEOUTS['gemini'], max_retries=1)
+
+voice_gateway = VoiceGateway(
+	**gateway.aws_clients,
+	llm_client=gateway.client,
+	async_llm_client=async_llm_client,
+	cache=gateway.cache,
+	llm_limiter=gateway.llm_limiter,
+	bucket=gateway.S3_BUCKET_NAME,
+	language_mode='identify',
+	cache_strategy='semantic',
+	poll_interval=gateway.TRANSCRIBE_POLL_INTERVAL,
+	prompt_template=gateway.LLM_PROMPT_TEMPLATE,
+	conversation=gateway.messages_all,
+	caller_profiles=gateway.caller_profiles,
+	intent_router=gateway.intent_router,
+	speculation=gateway.speculation,
+	native_cache=gateway.cache.native_enabled,
+	executor=io_executor
+)
+
+async def process_voice(request):
+	"""
+	ASGI version of /process-voice with the same request and response contract as the Flask
+	gateway. Independent stages of the shared pipeline run concurrently on the event loop.
+	"""
+	print("Received POST request for voice processing.")
+
+	try:
+		body_data = await request.json()
+	except Exception as e:
+		print(f"Error decoding request body: {e}")
+		return JSONResponse({'message': f'Failed to process request body: {str(e)}'}, status_code=500)
+
+	audio_base64 = body_data.get('audio_data')
+	if not audio_base64:
+		return JSONResponse({'message': 'Missing audio_data in request body'}, status_code=400)
+
+	try:
+		ctx = gateway.new_voice_context(voice_gateway, body_data, audio_base64)
+	except ValueError as e:
+		return JSONResponse({'message': str(e)}, status_code=400)
+
+	try:
+		ctx = await voice_gateway.run_async(ctx)
+	except StageError as e:
+		return JSONResponse({'message': e.message}, status_code=e.status)
+
+	return JSONResponse(gateway.build_voice_response(ctx), status_code=200)
+
+async def llm_metrics(request):
+	"""Exposes the LLM limiter, circuit breaker, intent router and speculation counters of this worker."""
+	return JSONResponse(gateway.gateway_metrics(), status_code=200)
+
+@asynccontextmanager
+async def lifespan(app):
+	yield
+	io_executor.shutdown(wait=False)
+
+app = Starlette(
+	routes=[
+		Route('/process-voice', process_voice, methods=['POST']),
+		Route('/llm_metrics', llm_metrics, methods=['GET'])
+	],
+	middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+	lifespan=lifespan
+)
+
+if __name__ == '__main__':
+	import uvicorn
+	uvicorn.run(app, host='0.0.0.0', port=5003)
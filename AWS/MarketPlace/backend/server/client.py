@@ -1,21 +1,27 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import uuid
-from database import get_db_connection
 import json
 import os
 import base64
 import time
-import boto3
 import sys
-from botocore.exceptions import ClientError
+from botocore.exceptions import NoRegionError
 from openai import OpenAI
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 from collections import deque
 
 from database_logic import create_listing_in_db, remove_listing_from_db
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
 from cache import RedisCache
+from caller_profile import CallerLanguageProfiles
+from intent_router import INTENT_ROUTER, IntentRouter
+from speculation import SpeculationPolicy
+from llm_limiter import LLMLimiter, TokenBucket
+from pipeline import StageError
+from resilience import DEPENDENCY_TIMEOUTS, breaker_states, bulkhead_states
+from voice_pipeline import VoiceGateway, create_aws_clients
 import marketplace_tools
 
 app = Flask(__name__)
@@ -29,13 +35,15 @@ TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# Each concurrent request may hold a connection per AWS service, so size the pools to match
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', 50))
+
+aws_clients = dict.fromkeys(('s3_client', 'transcribe_client', 'translate_client', 'polly_client'))
+client = sms_client = None # Requests fail instead of the import if initialization fails
 try:
-	sms_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-	client = OpenAI(api_key=GEMINI_API_KEY, base_url="https://generativelanguage.googleapis.com/v1beta/openai/")
-	s3_client = boto3.client('s3', region_name=AWS_REGION_EXPLICIT)
-	transcribe_client = boto3.client('transcribe', region_name=AWS_REGION_EXPLICIT)
-	translate_client = boto3.client('translate', region_name=AWS_REGION_EXPLICIT)
-	polly_client = boto3.client('polly', region_name=AWS_REGION_EXPLICIT)
+	sms_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=TwilioHttpClient(timeout=DEPENDENCY_TIMEOUTS['twilio']))
+	client = OpenAI(api_key=GEMINI_API_KEY, base_url="https://generativelanguage.googleapis.com/v1beta/openai/", timeout=DEPENDENCY_TIMEOUTS['gemini'], max_retries=1)
+	aws_clients = create_aws_clients(AWS_REGION_EXPLICIT, AWS_MAX_POOL_CONNECTIONS)
 	print(f"AWS Boto3 clients initialized for region: {AWS_REGION_EXPLICIT}")
 except NoRegionError:
 	print("ERROR: AWS_REGION environment variable is not set. Boto3 clients cannot be initialized.")
@@ -43,15 +51,16 @@ except Exception as e:
 	print(f"ERROR: Failed to initialize AWS Boto3 clients: {repr(e)}")
 
 cache = RedisCache()
+llm_limiter = LLMLimiter(bucket=TokenBucket(cache.redis))
+caller_profiles = CallerLanguageProfiles(cache.redis)
+# Simple sell commands are turned into add_listing calls locally; the classifier reuses the cache's model
+intent_router = IntentRouter(embed=cache.embedding_model.encode) if INTENT_ROUTER else None
+# LLM_SPECULATION=off|always|auto decides whether Gemini is called while the cache lookup runs
+speculation = SpeculationPolicy()
 
 # Configuration for voice processing
 S3_BUCKET_NAME = 'farmassist-voice-gateway-audio'
-TARGET_LLM_LANGUAGE = 'en'
-DEFAULT_FARMER_LANGUAGE = 'hi-IN'
-SUPPORTED_TRANSCRIBE_LANGUAGES = [
-	'en-US', 'hi-IN', 'gu-IN', 'mr-IN', 'bn-IN',
-	'ta-IN', 'te-IN', 'kn-IN', 'ml-IN', 'pa-IN',
-]
+TRANSCRIBE_POLL_INTERVAL = float(os.getenv('TRANSCRIBE_POLL_INTERVAL', 1))
 POLLY_DESCRIBE_VOICES_SUPPORTED_LANGUAGES = [
 	'en-IE', 'ar-AE', 'en-US', 'fr-BE', 'en-IN', 'es-MX', 'en-ZA', 'tr-TR', 'ru-RU',
 	'ro-RO', 'pt-PT', 'pl-PL', 'nl-NL', 'it-IT', 'is-IS', 'fr-FR', 'fi-FI', 'es-ES',
@@ -59,6 +68,9 @@ POLLY_DESCRIBE_VOICES_SUPPORTED_LANGUAGES = [
 	'nl-BE', 'cy-GB', 'cs-CZ', 'cmn-CN', 'da-DK', 'en-AU', 'pt-BR', 'nb-NO',
 	'sv-SE', 'ja-JP', 'es-US', 'ca-ES', 'fr-CA', 'en-GB', 'de-AT',
 ]
+LLM_PROMPT_TEMPLATE = (
+	"You are an agricultural assistant. Based on the following farmer's query, provide a concise and helpful response. If farmer wants to sell something, create a listing using add_listing. If you need additional data, ask for at max 2 entries at a time, also do not ask user for item description, rather create it yourself. farmer query: '{query}'. "
+)
 
 class FixedSizeArray:
     def __init__(self, size):
@@ -87,19 +99,69 @@ class FixedSizeArray:
 
 messages_all = FixedSizeArray(8)
 
+voice_gateway = VoiceGateway(
+	**aws_clients,
+	llm_client=client,
+	cache=cache,
+	llm_limiter=llm_limiter,
+	bucket=S3_BUCKET_NAME,
+	language_mode='identify',
+	cache_strategy='semantic',
+	poll_interval=TRANSCRIBE_POLL_INTERVAL,
+	prompt_template=LLM_PROMPT_TEMPLATE,
+	conversation=messages_all,
+	caller_profiles=caller_profiles,
+	intent_router=intent_router,
+	speculation=speculation,
+	native_cache=cache.native_enabled
+)
+
+def new_voice_context(gateway, body_data, audio_base64):
+	"""
+	Builds the pipeline context for a /process-voice body. mobile_number is optional; known callers
+	skip Transcribe's language identification. audio_format ('mp3', 'ogg_vorbis', 'pcm' or 'mulaw')
+	and sample_rate choose the response audio, e.g. 'mulaw' at 8000 Hz for playing into a phone call.
+	Raises ValueError for an unsupported format.
+	"""
+	return gateway.new_context(
+		base64.b64decode(audio_base64),
+		caller_number=body_data.get('mobile_number'),
+		audio_format=body_data.get('audio_format'),
+		sample_rate=body_data.get('sample_rate')
+	)
+
+def gateway_metrics():
+	metrics = {**llm_limiter.metrics(), "circuit_breakers": breaker_states(), "bulkheads": bulkhead_states(), "speculation": speculation.metrics()}
+	if intent_router is not None:
+		metrics["intent_router"] = intent_router.metrics()
+	return metrics
+
+def build_voice_response(ctx):
+	"""Builds the JSON body returned by /process-voice from a processed pipeline context."""
+	audio_stream = ctx.get('audio_stream')
+	return {
+		'message': 'Processing complete',
+		'transcribed_text': ctx['transcribed_text'],
+		'text_for_llm': ctx['text_for_llm'],
+		'llm_response': ctx['llm_response_text'],
+		'final_spoken_text': ctx['final_response_text'],
+		'audio_response_base64': base64.b64encode(audio_stream).decode('utf-8') if audio_stream else None,
+		'detected_language': ctx['detected_language'],
+		'cache_status': ctx['cache_status'],
+		'target_polly_lang': ctx['target_polly_lang'],
+		'polly_voice_id': ctx['polly_voice_id'],
+		'audio_format': ctx['audio_format'],
+		'sample_rate': ctx['sample_rate']
+	}
+
 @app.route('/process-voice', methods=['POST'])
 def process_voice():
 	"""
 	API endpoint to process voice input, transcribe it,
 	send to LLM, get a response, and convert it to speech.
-	This integrates the core logic from lambda_function.py.
+	The stages are shared with lambda_function.py through voice_pipeline.py.
 	"""
 	print("Received POST request for voice processing.")
-	audio_filename, transcription_job_name, transcript_s3_key = "", "", ""
-	detected_language = ""
-	polly_voice_id = None
-	target_polly_lang = 'hi-IN'
-	cache_status = 'miss' # Default cache status
 
 	try:
 		body_data = request.json
@@ -111,189 +173,22 @@ def process_voice():
 	if not audio_base64:
 		return jsonify({'message': 'Missing audio_data in request body'}), 400
 
-	# --- 2. Upload Audio to S3 ---
-	try:
-		audio_bytes = base64.b64decode(audio_base64)
-		unique_id = str(uuid.uuid4())
-		audio_filename = f"incoming_audio/{unique_id}.mp3"
-		s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=audio_filename, Body=audio_bytes)
-		audio_s3_uri = f"s3://{S3_BUCKET_NAME}/{audio_filename}"
-		print(f"Audio uploaded to S3: {audio_s3_uri}")
-	except ClientError as e:
-		print(f"S3 Upload Error: {e}")
-		return jsonify({'message': 'Failed to upload audio to S3'}), 500
-
-	# --- 3. Convert Voice to Text with Auto Language ID ---
-	transcription_job_name = f'voice-to-text-{unique_id}'
-	transcribed_text = ""
-	transcript_s3_key = f'transcripts/{transcription_job_name}.json'
-
-	try:
-		transcribe_client.start_transcription_job(
-			TranscriptionJobName=transcription_job_name,
-			IdentifyLanguage=True,
-			LanguageOptions=SUPPORTED_TRANSCRIBE_LANGUAGES,
-			MediaFormat='mp3',
-			Media={'MediaFileUri': audio_s3_uri},
-			OutputBucketName=S3_BUCKET_NAME,
-			OutputKey=transcript_s3_key
-		)
-		max_attempts = 120
-		for i in range(max_attempts):
-			job_status_response = transcribe_client.get_transcription_job(TranscriptionJobName=transcription_job_name)
-			status = job_status_response['TranscriptionJob']['TranscriptionJobStatus']
-			print(f"Transcription status: {status} ({i+1}/{max_attempts})")
-			if status == 'COMPLETED':
-				detected_language = job_status_response['TranscriptionJob'].get('LanguageCode', DEFAULT_FARMER_LANGUAGE)
-				transcript_response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=transcript_s3_key)
-				transcript_content = json.loads(transcript_response['Body'].read().decode('utf-8'))
-				transcribed_text = transcript_content['results']['transcripts'][0]['transcript']
-				print(f"Detected Language: {detected_language}")
-				print(f"Transcribed Text: {transcribed_text}")
-				break
-			elif status == 'FAILED':
-				raise Exception(job_status_response['TranscriptionJob'].get('FailureReason', 'Unknown reason'))
-			time.sleep(5)
-		else:
-			raise Exception("Transcription job timed out.")
-	except Exception as e:
-		print(f"Transcribe Error: {e}")
-		return jsonify({'message': f'Transcription failed: {str(e)}'}), 500
-
-	# --- 4. Translate Transcribed Text for LLM ---
-	text_for_llm = transcribed_text
-	source_language_for_translate = detected_language.split('-')[0]
-	if source_language_for_translate != TARGET_LLM_LANGUAGE:
-		print(f"Translating from {source_language_for_translate} to {TARGET_LLM_LANGUAGE} for LLM.")
-		try:
-			translate_response = translate_client.translate_text(
-				Text=transcribed_text,
-				SourceLanguageCode=source_language_for_translate,
-				TargetLanguageCode=TARGET_LLM_LANGUAGE
-			)
-			text_for_llm = translate_response['TranslatedText']
-			print(f"Translated Text for LLM: {text_for_llm}")
-		except ClientError as e:
-			print(f"Translate Error for LLM input: {e}")
-
-	# --- 5. Generate Response with LLM (Caching & Tool Calling) ---
-	llm_response_text = ""
 	try:
-		if (cached_response := cache.get_semantically(text_for_llm)):
-			print("⚡ Cache HIT!")
-			llm_response_text = cached_response
-			cache_status = 'hit'
-		else:
-			print("🔄 Cache MISS - Calling Gemini with tool support...")
-			llm_prompt = (
-				f"You are an agricultural assistant. Based on the following farmer's query, provide a concise and helpful response. If farmer wants to sell something, create a listing using add_listing. If you need additional data, ask for at max 2 entries at a time, also do not ask user for item description, rather create it yourself. farmer query: '{text_for_llm}'. "
-			)
-			messages_all.add_entry({"role": "user", "content": llm_prompt})
-			
-			# Check if marketplace_tools is available before using it
-			tools_to_use = marketplace_tools.tools
-
-			response = client.chat.completions.create(
-				model="gemini-2.0-flash",
-				messages=messages_all.get_all_entries(),
-				tools=tools_to_use,
-				tool_choice="auto"
-			)
-			
-			if marketplace_tools.process_tool_calls(response):
-				llm_response_text = "The requested task has been completed." # Placeholder for tool action
-			else:
-				llm_response_text = response.choices[0].message.content
-				cache.set(text_for_llm, llm_response_text) # Cache new responses
-
-			messages_all.add_entry({"role": "assistant", "content": llm_response_text})
-		
-		print(f"LLM Response: {llm_response_text}")
-
-	except Exception as e:
-		print(f"Error interacting with LLM: {e}")
-		llm_response_text = "I'm sorry, I could not generate an a response at this time."
+		ctx = new_voice_context(voice_gateway, body_data, audio_base64)
+	except ValueError as e:
+		return jsonify({'message': str(e)}), 400
 
-	# --- 6. Translate LLM Response Back to Farmer's Language ---
-	final_response_text = llm_response_text
-
-	# If detected language is a regional Indian one without direct Polly support, translate to Hindi or English
-	if detected_language.startswith(('gu-', 'mr-', 'bn-', 'pa-')):
-		 target_polly_lang = 'hi-IN'
-	elif detected_language.startswith(('en-', 'ta-', 'te-', 'kn-', 'ml-')):
-		 target_polly_lang = 'en-IN'
-	
-	if target_polly_lang.split('-')[0] != TARGET_LLM_LANGUAGE:
-		print(f"Translating response from {TARGET_LLM_LANGUAGE} to {target_polly_lang} for Polly.")
-		try:
-			translate_response = translate_client.translate_text(
-				Text=llm_response_text, SourceLanguageCode=TARGET_LLM_LANGUAGE, TargetLanguageCode=target_polly_lang
-			)
-			final_response_text = translate_response['TranslatedText']
-			print(f"Translated Response for Farmer: {final_response_text}")
-		except ClientError as e:
-			print(f"Translate Error for TTS output: {e}")
-	
-	# --- 7. Convert Text to Speech with Advanced Voice Selection ---
-	audio_stream = None
 	try:
-		polly_engine = 'neural' # Prefer neural voices
-		
-		# Specific high-quality voices
-		if target_polly_lang == 'hi-IN': polly_voice_id = 'Kajal'
-		elif target_polly_lang == 'en-IN': polly_voice_id = 'Kajal'
-		
-		# Find a voice if not hardcoded
-		# if not polly_voice_id:
-		#     if target_polly_lang in POLLY_DESCRIBE_VOICES_SUPPORTED_LANGUAGES:
-		#         try: # Try for a neural voice first
-		#             voices = polly_client.describe_voices(LanguageCode=target_polly_lang, Engine='neural')['Voices']
-		#             if voices: polly_voice_id = voices[0]['Id']
-		#         except ClientError: # Fallback to standard
-		#             voices = polly_client.describe_voices(LanguageCode=target_polly_lang, Engine='standard')['Voices']
-		#             if voices:
-		#                 polly_voice_id = voices[0]['Id']
-		#                 polly_engine = 'standard'
-		
-		# Final fallback to a default English voice
-		# if not polly_voice_id:
-		#     print(f"No Polly voice for '{target_polly_lang}'. Falling back to en-US.")
-		#     polly_voice_id = 'Kajal'
-		#     target_polly_lang = 'en-IN'
-		#     final_response_text = llm_response_text # Use original English text
-
-		print(f"Using Polly voice '{polly_voice_id}' ({polly_engine}) for language '{target_polly_lang}'.")
-		polly_response = polly_client.synthesize_speech(
-			Text=final_response_text, OutputFormat='mp3', VoiceId=polly_voice_id,
-			LanguageCode=target_polly_lang, Engine=polly_engine
-		)
-		audio_stream = polly_response['AudioStream'].read()
-		print("Speech synthesized with Polly.")
-	except Exception as e:
-		print(f"Polly Synthesis Error: {e}")
-		return jsonify({'message': 'Failed during speech synthesis.'}), 500
+		ctx = voice_gateway.run(ctx)
+	except StageError as e:
+		return jsonify({'message': e.message}), e.status
 
-	# --- 8. Clean up S3 files ---
-	try:
-		s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=audio_filename)
-		s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=transcript_s3_key)
-		print("Cleaned up temporary S3 files.")
-	except ClientError as e:
-		print(f"Warning: Failed to cleanup S3 objects: {e}")
+	return jsonify(build_voice_response(ctx)), 200
 
-	# --- 9. Return Synthesized Audio Response ---
-	return jsonify({
-		'message': 'Processing complete',
-		'transcribed_text': transcribed_text,
-		'text_for_llm': text_for_llm,
-		'llm_response': llm_response_text,
-		'final_spoken_text': final_response_text,
-		'audio_response_base64': base64.b64encode(audio_stream).decode('utf-8') if audio_stream else None,
-		'detected_language': detected_language,
-		'cache_status': cache_status,
-		'target_polly_lang': target_polly_lang,
-		'polly_voice_id': polly_voice_id
-	}), 200
+@app.route('/llm_metrics', methods=['GET'])
+def llm_metrics():
+	"""API endpoint exposing the LLM limiter, circuit breaker, intent router and speculation counters of this worker."""
+	return jsonify(gateway_metrics()), 200
 
 if __name__ == '__main__':
 	# Make sure your .env file is loaded correctly by database.py
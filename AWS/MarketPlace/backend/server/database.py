@@ -1,9 +1,128 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2 import sql
+from psycopg2 import extensions, sql
 import uuid # To generate UUIDs for new listings if not handled by DB automatically
 
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10)) # Per worker process
+DB_POOL_WAIT_TIMEOUT = float(os.getenv('DB_POOL_WAIT_TIMEOUT', 5)) # Seconds to wait for a free connection
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 5000))
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 5))
+# Connections idle for longer than this are checked with SELECT 1 before they are handed out
+DB_HEALTH_CHECK_AFTER = float(os.getenv('DB_HEALTH_CHECK_AFTER', 30))
+
 def get_db_connection():
     """Establishes and returns a PostgreSQL database connection."""
     conn = psycopg2.connect(os.environ.get("DATABASE_URL"))
     return conn
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the wait timeout."""
+
+class ConnectionPool:
+    """
+    Thread-safe pool of up to maxconn PostgreSQL connections, opened on demand and kept open,
+    with statement_timeout set on every session. Checkouts wait up to wait_timeout for a free
+    connection. Connections that sat idle are health-checked before reuse, and broken ones are
+    closed instead of returned.
+    """
+
+    def __init__(self, dsn: str = None, maxconn: int = DB_POOL_MAX, wait_timeout: float = DB_POOL_WAIT_TIMEOUT,
+                 statement_timeout_ms: int = DB_STATEMENT_TIMEOUT_MS, health_check_after: float = DB_HEALTH_CHECK_AFTER):
+        self.dsn = dsn or os.environ.get("DATABASE_URL")
+        self.statement_timeout_ms = statement_timeout_ms
+        self.wait_timeout = wait_timeout
+        self.health_check_after = health_check_after
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = [] # (connection, time it was returned), most recently used last
+        self._lock = threading.Lock()
+
+    def connect(self):
+        return psycopg2.connect(self.dsn, connect_timeout=DB_CONNECT_TIMEOUT, options=f"-c statement_timeout={self.statement_timeout_ms}")
+
+    def _healthy(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise PoolTimeout(f"No database connection free after {self.wait_timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    return self.connect()
+                conn, idle_since = idle
+                if self._healthy(conn, idle_since):
+                    return conn
+                print("Discarding broken database connection")
+                conn.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, discard: bool = False):
+        try:
+            if not discard and not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback() # Never hand out a connection with a transaction left open
+        except psycopg2.Error:
+            discard = True
+        try:
+            if discard or conn.closed:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """The pool of this process, created on first use so that forked workers never share sockets."""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool()
+                _pool_pid = os.getpid()
+    return _pool
+
+@contextmanager
+def db_connection():
+    """
+    Checks a pooled connection out for the duration of the block. Commit inside the block;
+    whatever is left uncommitted is rolled back, and the connection always goes back to the pool
+    (or is closed, if it broke).
+    """
+    connection_pool = get_pool()
+    conn = connection_pool.getconn()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        connection_pool.putconn(conn, discard=discard)
@@ -1,23 +1,86 @@
+import base64
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
 import psycopg2
-from database import get_db_connection # Assuming database.py contains this function
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from database import db_connection
+from listings_cache import invalidate_listings_cache
+
+try:
+	from listing_index import get_listing_index
+except ImportError:
+	print("Skipped listing_index module import")
+	def get_listing_index():
+		return None
+
+LISTING_FIELDS = ('id', 'item_name', 'price', 'description', 'seller_name', 'seller_contact', 'status', 'created_at', 'updated_at')
+LISTING_STATUSES = ('active', 'sold', 'all')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 2000)) # Rows fetched from the server-side cursor at a time
+# Rows written less than this long ago are left for the next poll: their transaction may not have
+# committed yet, and a later commit with an earlier updated_at would fall behind a consumer's cursor.
+# Writes are single short transactions, bounded by the statement timeout (DB_STATEMENT_TIMEOUT_MS).
+LISTING_CHANGES_SETTLE_SECONDS = float(os.getenv('LISTING_CHANGES_SETTLE_SECONDS', 5))
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 50
+DEFAULT_SEMANTIC_K = 10
+MAX_SEMANTIC_K = 50
+BULK_MAX_LISTINGS = int(os.getenv('BULK_MAX_LISTINGS', 10000)) # Listings one /bulk_add_listings request may add
+BULK_INSERT_PAGE_SIZE = 1000 # Rows per INSERT statement
+SMS_COUNTRY_CODE = os.getenv('SMS_COUNTRY_CODE', '+91') # Listings store phone numbers without it
+# Postgres format() template for the seller's SMS: item name, buyer contact
+ORDER_RECEIVED_SMS = "🛍️ Order Received! You have received an order for '%s'. Call buyer at %s"
+SEARCH_SIMILARITY_THRESHOLD = float(os.getenv('SEARCH_SIMILARITY_THRESHOLD', 0.3)) # pg_trgm similarity an item name needs
+# Hindi names callers use for common produce, searched for alongside the English name
+ITEM_SYNONYMS = {
+	'tamatar': 'tomato', 'pyaz': 'onion', 'pyaaz': 'onion', 'kanda': 'onion', 'aloo': 'potato', 'alu': 'potato',
+	'gehun': 'wheat', 'gehu': 'wheat', 'chawal': 'rice', 'dhan': 'paddy', 'makka': 'maize', 'bhindi': 'okra',
+	'baingan': 'brinjal', 'gobhi': 'cauliflower', 'gobi': 'cauliflower', 'mirch': 'chilli', 'lahsun': 'garlic',
+	'adrak': 'ginger', 'kela': 'banana', 'aam': 'mango', 'doodh': 'milk', 'chana': 'chickpea', 'sarson': 'mustard',
+}
+
+# Index updates embed text, so they run off the request path; one thread keeps them in order
+listing_index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='listing-index')
+
+def apply_listing_index_change(action: str, *args):
+	index = get_listing_index()
+	if index is None:
+		return
+	try:
+		getattr(index, action)(*args)
+	except Exception as e:
+		print(f"Listing index {action} failed: {e}")
+
+def sync_listing_index(action: str, *args):
+	"""Queues a change to the semantic listing index, if there is one. Never fails or delays the database write."""
+	return listing_index_executor.submit(apply_listing_index_change, action, *args)
 
 def create_listing_in_db(item_name: str, price: float, seller_name: str, seller_contact: str, description: str = ""):
 	"""Directly inserts a new item listing into the database."""
 	try:
-		conn = get_db_connection()
-		cur = conn.cursor()
-		cur.execute(
-			"""
-			INSERT INTO listings (item_name, price, description, seller_name, seller_contact, status)
-			VALUES (%s, %s, %s, %s, %s, 'active')
-			RETURNING id;
-			""",
-			(item_name, price, description, seller_name, seller_contact)
-		)
-		new_listing_id = cur.fetchone()[0]
-		conn.commit()
-		cur.close()
-		conn.close()
+		with db_connection() as conn, conn.cursor() as cur:
+			cur.execute(
+				"""
+				INSERT INTO listings (item_name, price, description, seller_name, seller_contact, status)
+				VALUES (%s, %s, %s, %s, %s, 'active')
+				RETURNING id;
+				""",
+				(item_name, price, description, seller_name, seller_contact)
+			)
+			new_listing_id = cur.fetchone()[0]
+			conn.commit()
+		invalidate_listings_cache()
+		sync_listing_index('add_listings', [{
+			'id': new_listing_id, 'item_name': item_name, 'price': price, 'description': description,
+			'seller_name': seller_name, 'seller_contact': seller_contact, 'status': 'active'
+		}])
 		return {
 			"status": "success",
 			"message": f"Listing for '{item_name}' added.",
@@ -25,28 +88,202 @@ def create_listing_in_db(item_name: str, price: float, seller_name: str, seller_
 		}
 	except Exception as e:
 		print(f"Error in create_listing_in_db: {e}")
-		# In a real app, you might want to rollback the transaction
 		return {"status": "error", "message": str(e)}
 
+def insert_listings(cur, listings: list) -> list:
+	"""
+	Inserts listings (dicts with create_listing_in_db's arguments) as active with multi-row
+	INSERTs of BULK_INSERT_PAGE_SIZE rows each. The ids are generated here rather than by the
+	database, so they are returned in input order. The caller commits.
+	"""
+	listing_ids = [str(uuid.uuid4()) for _ in listings]
+	execute_values(
+		cur,
+		"INSERT INTO listings (id, item_name, price, description, seller_name, seller_contact, status) VALUES %s;",
+		[
+			(listing_id, listing['item_name'], listing['price'], listing.get('description', ""), listing.get('seller_name'), listing.get('seller_contact'))
+			for listing_id, listing in zip(listing_ids, listings)
+		],
+		template="(%s::uuid, %s, %s, %s, %s, %s, 'active')",
+		page_size=BULK_INSERT_PAGE_SIZE
+	)
+	return listing_ids
+
+def create_listings_in_db(listings: list):
+	"""
+	Inserts several listings (dicts with create_listing_in_db's arguments) in one transaction.
+	Returns one result per listing in input order; if any insert fails, none are kept.
+	"""
+	try:
+		# An insert that fails leaves the transaction uncommitted, and db_connection rolls it back
+		with db_connection() as conn, conn.cursor() as cur:
+			listing_ids = insert_listings(cur, listings)
+			conn.commit()
+		results = [{
+			"status": "success",
+			"message": f"Listing for '{listing['item_name']}' added.",
+			"listing_id": listing_id
+		} for listing, listing_id in zip(listings, listing_ids)]
+		invalidate_listings_cache()
+		sync_listing_index('add_listings', [
+			dict(listing, id=result['listing_id'], status='active') for listing, result in zip(listings, results)
+		])
+		return results
+	except Exception as e:
+		print(f"Error in create_listings_in_db: {e}")
+		return [{"status": "error", "message": str(e)} for _ in listings]
+
+def validate_listing(listing) -> str:
+	"""Why a listing for bulk_create_listings_in_db is invalid, or None if it is valid."""
+	if not isinstance(listing, dict):
+		return "must be an object"
+	item_name = listing.get('item_name')
+	if not isinstance(item_name, str) or not item_name.strip():
+		return "item_name is required"
+	if len(item_name) > 255:
+		return "item_name must be at most 255 characters"
+	price = listing.get('price')
+	if isinstance(price, bool) or not isinstance(price, (int, float)) or not 0 <= price < 10 ** 8:
+		return "price must be a number between 0 and 99999999.99"
+	seller_contact = str(listing.get('seller_contact') or "")
+	if not seller_contact.isdigit() or len(seller_contact) > 10:
+		return "seller_contact must be a phone number of up to 10 digits without any prefix"
+	for field in ('description', 'seller_name'):
+		if listing.get(field) is not None and not isinstance(listing[field], str):
+			return f"{field} must be a string"
+	unknown = set(listing) - {'item_name', 'price', 'description', 'seller_name', 'seller_contact'}
+	if unknown:
+		return f"Unknown fields: {', '.join(sorted(unknown))}"
+	return None
+
+def bulk_create_listings_in_db(listings: list):
+	"""
+	Validates a batch of listings and inserts all of them in one transaction, or none if any is
+	invalid or the insert fails. On success returns the new listing ids in input order and the
+	insert rate; an invalid batch gets status "invalid" with the index and reason per listing.
+	"""
+	if not isinstance(listings, list) or not listings:
+		return {"status": "invalid", "message": "listings must be a non-empty list"}
+	if len(listings) > BULK_MAX_LISTINGS:
+		return {"status": "invalid", "message": f"At most {BULK_MAX_LISTINGS} listings can be added at once"}
+	errors = [{"index": index, "message": error} for index, error in enumerate(map(validate_listing, listings)) if error]
+	if errors:
+		return {"status": "invalid", "message": f"{len(errors)} of {len(listings)} listings are invalid", "errors": errors}
+
+	try:
+		start = time.perf_counter()
+		with db_connection() as conn, conn.cursor() as cur:
+			listing_ids = insert_listings(cur, listings)
+			conn.commit()
+		elapsed = time.perf_counter() - start
+	except Exception as e:
+		print(f"Error in bulk_create_listings_in_db: {e}")
+		return {"status": "error", "message": str(e)}
+	rows_per_second = round(len(listings) / elapsed, 1) if elapsed > 0 else None
+	print(f"Bulk inserted {len(listings)} listings in {elapsed:.3f}s ({rows_per_second} rows/s)")
+	invalidate_listings_cache()
+	sync_listing_index('add_listings', [
+		dict(listing, id=listing_id, status='active') for listing, listing_id in zip(listings, listing_ids)
+	])
+	return {
+		"status": "success",
+		"message": f"{len(listings)} listings added.",
+		"listing_ids": listing_ids,
+		"elapsed_seconds": round(elapsed, 3),
+		"rows_per_second": rows_per_second
+	}
+
+def place_order_in_db(listing_id: str, buyer_contact: str, idempotency_key: str):
+	"""
+	Sells an active listing to a buyer in a single statement: the listing is marked sold, the
+	order is recorded and the seller's SMS is queued in the notification outbox. The UPDATE only
+	matches an active listing, so of several concurrent buyers exactly one gets it; the others
+	wait for that row lock alone and then find it sold.
+	Retrying with the same idempotency key returns the order placed by the first attempt.
+	Returns status "success" (with "created" False for a replay), "not_found" if the listing does
+	not exist or is sold, or "conflict" if the key was used to order another listing.
+	"""
+	columns = ('id', 'listing_id', 'item_name', 'price', 'seller_contact', 'buyer_contact', 'created_at')
+	try:
+		listing_id = str(uuid.UUID(str(listing_id)))
+	except ValueError:
+		return {"status": "not_found", "message": f"Listing '{listing_id}' not found or already sold."}
+	try:
+		with db_connection() as conn, conn.cursor() as cur:
+			cur.execute(
+				sql.SQL("""
+				WITH sold AS (
+					UPDATE listings
+					SET status = 'sold', updated_at = CURRENT_TIMESTAMP
+					WHERE id = %(listing_id)s AND status = 'active'
+						AND NOT EXISTS (SELECT 1 FROM orders WHERE idempotency_key = %(key)s)
+					RETURNING id, item_name, price, seller_contact
+				), placed AS (
+					INSERT INTO orders (idempotency_key, listing_id, item_name, price, seller_contact, buyer_contact)
+					SELECT %(key)s, id, item_name, price, seller_contact, %(buyer_contact)s FROM sold
+					RETURNING {columns}
+				), notification AS (
+					INSERT INTO notification_outbox (kind, listing_id, to_phone, body)
+					SELECT 'order_received', listing_id, %(country_code)s || seller_contact::BIGINT, format(%(sms)s, item_name, %(buyer_contact)s)
+					FROM placed
+				)
+				SELECT {columns}, TRUE FROM placed
+				UNION ALL
+				SELECT {columns}, FALSE FROM orders WHERE idempotency_key = %(key)s;
+				""").format(columns=sql.SQL(', ').join(map(sql.Identifier, columns))),
+				{
+					'listing_id': listing_id, 'key': idempotency_key, 'buyer_contact': buyer_contact,
+					'country_code': SMS_COUNTRY_CODE, 'sms': ORDER_RECEIVED_SMS
+				}
+			)
+			row = cur.fetchone()
+			conn.commit()
+			if row is None:
+				# A concurrent request with the same key may have committed after this statement's
+				# snapshot was taken; only this path needs another round trip
+				cur.execute(
+					sql.SQL("SELECT {columns}, FALSE FROM orders WHERE idempotency_key = %s;").format(columns=sql.SQL(', ').join(map(sql.Identifier, columns))),
+					(idempotency_key,)
+				)
+				row = cur.fetchone()
+	except Exception as e:
+		print(f"Error in place_order_in_db: {e}")
+		return {"status": "error", "message": str(e)}
+
+	if row is None:
+		return {"status": "not_found", "message": f"Listing '{listing_id}' not found or already sold."}
+	order = serialize_listing(dict(zip(columns, row[:-1])))
+	order['listing_id'] = str(order['listing_id'])
+	if order['listing_id'] != listing_id:
+		return {"status": "conflict", "message": "Idempotency key was already used for another listing."}
+	created = row[-1]
+	if created:
+		invalidate_listings_cache()
+		sync_listing_index('set_status', order['listing_id'], 'sold')
+	return {
+		"status": "success",
+		"message": f"Listing '{listing_id}' for '{order['item_name']}' marked as sold.",
+		"order": order,
+		"created": created
+	}
+
 def remove_listing_from_db(listing_id: str):
 	"""Directly deletes an item listing from the database."""
 	try:
-		conn = get_db_connection()
-		cur = conn.cursor()
-		cur.execute(
-			"""
-			DELETE FROM listings
-			WHERE id = %s
-			RETURNING id;
-			""",
-			(listing_id,)
-		)
-		deleted_row = cur.fetchone()
-		conn.commit()
-		cur.close()
-		conn.close()
-
+		with db_connection() as conn, conn.cursor() as cur:
+			cur.execute(
+				"""
+				DELETE FROM listings
+				WHERE id = %s
+				RETURNING id;
+				""",
+				(listing_id,)
+			)
+			deleted_row = cur.fetchone()
+			conn.commit()
 		if deleted_row:
+			invalidate_listings_cache()
+			sync_listing_index('remove_listing', listing_id)
 			return {
 				"status": "success",
 				"message": f"Listing '{listing_id}' deleted."
@@ -58,4 +295,197 @@ def remove_listing_from_db(listing_id: str):
 			}
 	except Exception as e:
 		print(f"Error in remove_listing_from_db: {e}")
-		return {"status": "error", "message": str(e)}
\ No newline at end of file
+		return {"status": "error", "message": str(e)}
+
+def encode_cursor(created_at, listing_id) -> str:
+	"""Opaque cursor pointing just past a listing in (created_at, id) order."""
+	return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), str(listing_id)]).encode()).decode()
+
+def decode_cursor(cursor: str):
+	"""Returns (created_at, id) from encode_cursor. Raises ValueError for a malformed cursor."""
+	try:
+		created_at, listing_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+		return datetime.fromisoformat(created_at), str(uuid.UUID(listing_id))
+	except (TypeError, ValueError) as e:
+		raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def serialize_listing(listing: dict) -> dict:
+	"""Converts UUID and Decimal/NUMERIC values of a listing row to JSON-friendly strings and floats."""
+	if listing.get('id') is not None:
+		listing['id'] = str(listing['id'])
+	if listing.get('price') is not None:
+		listing['price'] = float(listing['price'])
+	# seller_contact is NUMERIC in DB, will be int or float in Python; ensure it's simple
+	if listing.get('seller_contact') is not None:
+		listing['seller_contact'] = str(int(listing['seller_contact'])) # Convert to string for phone numbers
+	return listing
+
+def listing_fields(fields=None) -> list:
+	"""The requested listing columns, all of them by default. Raises ValueError for unknown ones."""
+	fields = list(fields or LISTING_FIELDS)
+	unknown = [field for field in fields if field not in LISTING_FIELDS]
+	if unknown:
+		raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+	return fields
+
+def listing_filters(status: str = 'active', seller_contact: str = None):
+	"""SQL conditions and their parameters for the status and seller filters. Raises ValueError for invalid ones."""
+	if status not in LISTING_STATUSES:
+		raise ValueError(f"status must be one of {', '.join(LISTING_STATUSES)}")
+	conditions = []
+	params = []
+	if status != 'all':
+		conditions.append(sql.SQL("status = %s"))
+		params.append(status)
+	if seller_contact:
+		if not seller_contact.isdigit():
+			raise ValueError("seller_contact must be a phone number without any prefix")
+		conditions.append(sql.SQL("seller_contact = %s"))
+		params.append(seller_contact)
+	return conditions, params
+
+def get_listings_page(status: str = 'active', seller_contact: str = None, limit: int = DEFAULT_PAGE_SIZE, cursor: str = None, fields=None):
+	"""
+	One page of listings, newest first, using keyset pagination on (created_at, id) so every page
+	is an index range scan however deep it is. status is 'active', 'sold' or 'all'; fields limits
+	the returned columns. Returns {"status": "success", "listings": [...], "next_cursor": ...}
+	where next_cursor is None on the last page. Raises ValueError for invalid arguments.
+	"""
+	conditions, params = listing_filters(status, seller_contact)
+	if not 1 <= limit <= MAX_PAGE_SIZE:
+		raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+	fields = listing_fields(fields)
+	# The cursor columns are always read; they are dropped again if not asked for
+	columns = fields + [column for column in ('created_at', 'id') if column not in fields]
+
+	if cursor:
+		conditions.append(sql.SQL("(created_at, id) < (%s, %s::uuid)"))
+		params.extend(decode_cursor(cursor))
+	query = sql.SQL("SELECT {columns} FROM listings {where} ORDER BY created_at DESC, id DESC LIMIT %s;").format(
+		columns=sql.SQL(', ').join(map(sql.Identifier, columns)),
+		where=sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""),
+	)
+	params.append(limit + 1) # One extra row tells whether there is a next page
+
+	with db_connection() as conn, conn.cursor() as cur:
+		cur.execute(query, params)
+		rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+
+	next_cursor = None
+	if len(rows) > limit:
+		rows = rows[:limit]
+		next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+	listings = [serialize_listing({field: row[field] for field in fields}) for row in rows]
+	return {"status": "success", "listings": listings, "next_cursor": next_cursor}
+
+def export_listings(status: str = 'all', seller_contact: str = None, fields=None, batch_size: int = EXPORT_BATCH_SIZE):
+	"""
+	Every listing matching the filters, oldest first, as a generator of serialized dicts. Rows are
+	read through a named (server-side) cursor batch_size at a time, so memory stays flat however
+	large the table is. The arguments are checked here, before anything is read, and raise
+	ValueError; the generator holds a pooled connection until it is exhausted or closed.
+	"""
+	conditions, params = listing_filters(status, seller_contact)
+	fields = listing_fields(fields)
+	query = sql.SQL("SELECT {columns} FROM listings {where} ORDER BY created_at, id;").format(
+		columns=sql.SQL(', ').join(map(sql.Identifier, fields)),
+		where=sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""),
+	)
+
+	def rows():
+		with db_connection() as conn, conn.cursor(name="export_listings") as cur:
+			cur.itersize = batch_size
+			cur.execute(query, params)
+			for row in cur:
+				yield serialize_listing(dict(zip(fields, row)))
+	return rows()
+
+def get_listing_changes(since: str = None, limit: int = DEFAULT_PAGE_SIZE):
+	"""
+	Listings inserted, updated or deleted after the since cursor (from the start if None), oldest
+	change first. Listings are read by (updated_at, id) and deletions from listing_tombstones by
+	(deleted_at, listing_id), both index range scans, so a poll costs the number of changes rather
+	than the size of the table. Returns {"status": "success", "changes": [...], "next_cursor": ...,
+	"has_more": ...}; each change is {"op": "upsert", "listing": {...}} or {"op": "delete", "id": ...}.
+	next_cursor is always set: pass it as since on the next poll. Raises ValueError for invalid arguments.
+	"""
+	if not 1 <= limit <= MAX_PAGE_SIZE:
+		raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+	changed_at, listing_id = decode_cursor(since) if since else (datetime.min.replace(tzinfo=timezone.utc), str(uuid.UUID(int=0)))
+	fields = list(LISTING_FIELDS)
+	# Each branch takes limit + 1 rows off its own index before the two are merged
+	query = sql.SQL("""
+		WITH settled AS (SELECT clock_timestamp() - make_interval(secs => %(settle)s) AS until)
+		(SELECT 'upsert', updated_at, id, {columns} FROM listings, settled
+			WHERE (updated_at, id) > (%(changed_at)s, %(id)s::uuid) AND updated_at < settled.until
+			ORDER BY updated_at, id LIMIT %(limit)s)
+		UNION ALL
+		(SELECT 'delete', deleted_at, listing_id, {nulls} FROM listing_tombstones, settled
+			WHERE (deleted_at, listing_id) > (%(changed_at)s, %(id)s::uuid) AND deleted_at < settled.until
+			ORDER BY deleted_at, listing_id LIMIT %(limit)s)
+		ORDER BY 2, 3
+		LIMIT %(limit)s;
+	""").format(
+		columns=sql.SQL(', ').join(map(sql.Identifier, fields)),
+		nulls=sql.SQL(', ').join(sql.SQL("NULL") for _ in fields),
+	)
+
+	with db_connection() as conn, conn.cursor() as cur:
+		cur.execute(query, {
+			'settle': LISTING_CHANGES_SETTLE_SECONDS, 'changed_at': changed_at, 'id': listing_id, 'limit': limit + 1
+		})
+		rows = cur.fetchall()
+
+	has_more = len(rows) > limit
+	rows = rows[:limit]
+	changes = []
+	for op, row_changed_at, row_id, *values in rows:
+		if op == 'upsert':
+			changes.append({"op": op, "listing": serialize_listing(dict(zip(fields, values)))})
+		else:
+			changes.append({"op": op, "id": str(row_id)})
+	next_cursor = encode_cursor(rows[-1][1], rows[-1][2]) if rows else (since or encode_cursor(changed_at, listing_id))
+	return {"status": "success", "changes": changes, "next_cursor": next_cursor, "has_more": has_more}
+
+def search_listings(query: str, limit: int = DEFAULT_SEARCH_LIMIT):
+	"""
+	Active listings matching a spoken item name, best first. A listing matches if its full-text
+	document matches the query (or the English name of a Hindi word in it), or if its item name
+	or a word of its description is similar to the query, which catches misspellings. Both
+	conditions are served by GIN indexes, so only matching rows are read.
+	Returns {"status": "success", "listings": [...]} with a score per listing.
+	Raises ValueError for an empty query or an invalid limit.
+	"""
+	query = " ".join(query.split()) if query else ""
+	if not query:
+		raise ValueError("q is required")
+	if not 1 <= limit <= MAX_SEARCH_LIMIT:
+		raise ValueError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}")
+	synonyms = [ITEM_SYNONYMS[word] for word in query.lower().split() if word in ITEM_SYNONYMS]
+	text_query = " or ".join([query] + synonyms)
+	fields = [field for field in LISTING_FIELDS if field not in ('created_at', 'updated_at')]
+
+	with db_connection() as conn, conn.cursor() as cur:
+		# Applies to this transaction only, which db_connection ends with a rollback
+		cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true);", (str(SEARCH_SIMILARITY_THRESHOLD),))
+		cur.execute(
+			sql.SQL("""
+			WITH search AS (SELECT websearch_to_tsquery('english', %(text_query)s) AS tsquery)
+			SELECT {columns},
+				ts_rank(search_vector, search.tsquery) + GREATEST(similarity(item_name, %(query)s), word_similarity(%(query)s, description)) AS score
+			FROM listings, search
+			WHERE status = 'active'
+				AND (search_vector @@ search.tsquery OR item_name %% %(query)s OR %(query)s <%% description)
+			ORDER BY score DESC, created_at DESC
+			LIMIT %(limit)s;
+			""").format(columns=sql.SQL(', ').join(map(sql.Identifier, fields))),
+			{'text_query': text_query, 'query': query, 'limit': limit}
+		)
+		rows = cur.fetchall()
+
+	listings = []
+	for row in rows:
+		listing = serialize_listing(dict(zip(fields, row[:-1])))
+		listing['score'] = round(float(row[-1]), 4)
+		listings.append(listing)
+	return {"status": "success", "listings": listings}
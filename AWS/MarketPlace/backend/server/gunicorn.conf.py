@@ -0,0 +1,50 @@
+import gc
+import multiprocessing
+import os
+import sys
+
+# Production settings shared by app.py and the voice gateways: gunicorn -c gunicorn.conf.py ...
+# The app (and with it torch, the embedding model, the intent router's example vectors and the
+# AWS/Redis clients) is imported once in the master and the workers are forked from it, so they
+# share those pages copy-on-write instead of each loading its own copy.
+
+GUNICORN_PRELOAD = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+GUNICORN_FREEZE_GC = os.getenv('GUNICORN_FREEZE_GC', 'true').lower() == 'true'
+# Intra-op threads per worker; by default the cores are split evenly between the workers
+TORCH_THREADS_PER_WORKER = os.getenv('TORCH_THREADS_PER_WORKER')
+
+preload_app = GUNICORN_PRELOAD
+workers = int(os.getenv('GUNICORN_WORKERS', os.getenv('WEB_CONCURRENCY', 1)))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 300))
+
+if preload_app:
+	# The master only encodes a few examples while loading. Keeping it to one thread means no
+	# OpenMP thread pool exists at fork time, which the workers could not use (or could deadlock on).
+	os.environ.setdefault('OMP_NUM_THREADS', '1')
+	os.environ.setdefault('MKL_NUM_THREADS', '1')
+	if GUNICORN_FREEZE_GC:
+		# No collections while the app loads, so its objects are not moved between generations
+		# (touching their pages) before they are frozen
+		gc.disable()
+
+def when_ready(server):
+	if preload_app and GUNICORN_FREEZE_GC:
+		# Move everything loaded so far out of the collector's reach: a collection in a worker would
+		# otherwise write to the GC header of every shared object and copy its page
+		gc.collect()
+		gc.freeze()
+		gc.enable()
+		server.log.info(f"Froze {gc.get_freeze_count()} objects before forking workers")
+
+def post_fork(server, worker):
+	cache = sys.modules.get('cache')
+	if cache is not None:
+		# Sockets opened while the app loaded in the master must not be shared by the workers
+		cache.reset_connections_after_fork()
+		server.log.info(f"Worker {worker.pid}: dropped Redis and embedding service connections inherited from the master")
+	torch = sys.modules.get('torch')
+	if torch is None:
+		return # This app does not use torch (or loads it lazily with its own defaults)
+	threads = int(TORCH_THREADS_PER_WORKER or max(1, multiprocessing.cpu_count() // server.cfg.workers))
+	torch.set_num_threads(threads)
+	server.log.info(f"Worker {worker.pid}: torch intra-op threads set to {threads}")
@@ -0,0 +1,151 @@
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+import redis
+from redis.commands.search.field import NumericField, TagField, TextField, VectorField
+from redis.commands.search.index_definition import IndexDefinition, IndexType
+from redis.commands.search.query import Query
+
+SEMANTIC_LISTING_SEARCH = os.getenv('SEMANTIC_LISTING_SEARCH', 'true').lower() == 'true'
+LISTING_INDEX_NAME = "listing_idx"
+LISTING_KEY_PREFIX = "listing:"
+LISTING_INDEX_RETRY_AFTER = 60 # Seconds before setting the index up again after a failure
+# Fields stored next to the vector, so search results need no database round trip. The listing
+# id is the key suffix, since RediSearch reserves "id" for the key.
+LISTING_INDEX_FIELDS = ('item_name', 'price', 'description', 'seller_name', 'seller_contact', 'status')
+
+def listing_text(listing: dict) -> str:
+	"""The text a listing is embedded from: what it is and how the seller described it."""
+	description = listing.get('description') or ""
+	return f"{listing['item_name']}. {description}".strip()
+
+class ListingIndex:
+	"""
+	RediSearch HNSW index of listing embeddings, one hash per listing. Listings are embedded once
+	when they are created; selling one only changes its status tag and deleting one removes its
+	hash, so the index is kept up to date incrementally.
+	"""
+
+	def __init__(self, redis_client, embedding_model, index_name: str = LISTING_INDEX_NAME, prefix: str = LISTING_KEY_PREFIX):
+		self.redis = redis_client
+		self.embedding_model = embedding_model
+		self.index_name = index_name
+		self.prefix = prefix
+		self._create_index()
+
+	def _create_index(self):
+		try:
+			self.redis.ft(self.index_name).info()
+		except redis.exceptions.ResponseError:
+			schema = (
+				TextField("item_name"),
+				TagField("status"),
+				NumericField("price"),
+				VectorField("vector", "HNSW", {
+					"TYPE": "FLOAT32",
+					"DIM": self.embedding_model.get_sentence_embedding_dimension(),
+					"DISTANCE_METRIC": "COSINE",
+				}),
+			)
+			definition = IndexDefinition(prefix=[self.prefix], index_type=IndexType.HASH)
+			self.redis.ft(self.index_name).create_index(fields=schema, definition=definition)
+			print(f"RediSearch index '{self.index_name}' created successfully.")
+
+	def get_key(self, listing_id) -> str:
+		return f"{self.prefix}{listing_id}"
+
+	def add_listings(self, listings: list):
+		"""Embeds listings (dicts with id and LISTING_INDEX_FIELDS) in one batch and stores them."""
+		if not listings:
+			return
+		vectors = np.asarray(self.embedding_model.encode([listing_text(listing) for listing in listings]), dtype=np.float32)
+		pipeline = self.redis.pipeline(transaction=False)
+		for listing, vector in zip(listings, vectors):
+			mapping = {field: str(listing[field]) for field in LISTING_INDEX_FIELDS if listing.get(field) is not None}
+			mapping.setdefault('status', 'active')
+			mapping['vector'] = vector.tobytes()
+			pipeline.hset(self.get_key(listing['id']), mapping=mapping)
+		pipeline.execute()
+
+	def set_status(self, listing_id, status: str):
+		"""Updates the status tag of an indexed listing without re-embedding it."""
+		key = self.get_key(listing_id)
+		if self.redis.exists(key):
+			self.redis.hset(key, "status", status)
+
+	def remove_listing(self, listing_id):
+		self.redis.delete(self.get_key(listing_id))
+
+	def search(self, query: str, k: int = 10, status: str = 'active'):
+		"""The k listings with the given status whose embeddings are closest to the query's, closest first."""
+		query_vector = np.asarray(self.embedding_model.encode(query), dtype=np.float32).tobytes()
+		q = Query(f"(@status:{{{status}}})=>[KNN {int(k)} @vector $query_vec AS distance]")\
+			.return_fields(*LISTING_INDEX_FIELDS, "distance")\
+			.sort_by("distance")\
+			.paging(0, int(k))\
+			.dialect(2)
+		results = self.redis.ft(self.index_name).search(q, query_params={"query_vec": query_vector})
+		listings = []
+		for doc in results.docs:
+			listing = {'id': doc.id[len(self.prefix):]}
+			listing.update({field: getattr(doc, field, None) for field in LISTING_INDEX_FIELDS})
+			listing['price'] = float(listing['price']) if listing['price'] is not None else None
+			listing['score'] = round(1 - float(doc.distance), 4) # Cosine similarity
+			listings.append(listing)
+		return listings
+
+_listing_index = None
+_listing_index_lock = threading.Lock()
+_listing_index_failed_at = None
+
+def get_listing_index():
+	"""
+	The process-wide ListingIndex, created on first use with the same embedding model as
+	RedisCache, or None if semantic search is disabled or Redis or the model are unavailable.
+	"""
+	global _listing_index, _listing_index_failed_at
+	if not SEMANTIC_LISTING_SEARCH:
+		return None
+	if _listing_index is None:
+		with _listing_index_lock:
+			recently_failed = _listing_index_failed_at is not None and time.monotonic() - _listing_index_failed_at < LISTING_INDEX_RETRY_AFTER
+			if _listing_index is None and not recently_failed:
+				try:
+					from cache import EMBEDDING_MODEL, create_redis_client, load_embedding_model
+					_listing_index = ListingIndex(create_redis_client(), load_embedding_model(EMBEDDING_MODEL))
+				except Exception as e:
+					print(f"Semantic listing search unavailable: {e}")
+					_listing_index_failed_at = time.monotonic()
+	return _listing_index
+
+def reindex_listings(batch_size: int = 256):
+	"""Embeds every active listing again, e.g. after the index was dropped or Redis was flushed."""
+	from database import db_connection
+	index = get_listing_index()
+	if index is None:
+		raise RuntimeError("Listing index is not available")
+	columns = ['id', *LISTING_INDEX_FIELDS]
+	total = 0
+	with db_connection() as conn, conn.cursor(name='reindex_listings') as cur:
+		cur.execute(f"SELECT {', '.join(columns)} FROM listings WHERE status = 'active';")
+		while True:
+			rows = cur.fetchmany(batch_size)
+			if not rows:
+				break
+			listings = [dict(zip(columns, row)) for row in rows]
+			for listing in listings:
+				listing['seller_contact'] = int(listing['seller_contact']) if listing['seller_contact'] is not None else None
+			index.add_listings(listings)
+			total += len(listings)
+	print(f"Indexed {total} listings.")
+	return total
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Maintain the semantic listing index.")
+	parser.add_argument('--reindex', action='store_true', help="Embed all active listings from the database")
+	args = parser.parse_args()
+	if args.reindex:
+		reindex_listings()
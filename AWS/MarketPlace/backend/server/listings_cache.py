@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+LISTINGS_CACHE = os.getenv('LISTINGS_CACHE', 'true').lower() == 'true'
+LISTINGS_CACHE_TTL = int(os.getenv('LISTINGS_CACHE_TTL', 300)) # Seconds a cached page is kept if nothing changes
+LISTINGS_CACHE_RETRY_AFTER = 30 # Seconds the cache is bypassed after a Redis error
+LISTINGS_VERSION_KEY = "listings:version"
+LISTINGS_PAGE_PREFIX = "listings_page:"
+
+class ListingsCache:
+	"""
+	Response cache for listing pages, shared by all workers through Redis. Every write to the
+	listings table bumps one version counter; pages are stored under the version they were read
+	at, so a bump makes every cached page (and every ETag handed out) stale at once, and the old
+	entries simply expire. A Redis error disables the cache for a while instead of failing or
+	slowing down requests, which then go to the database as before.
+	"""
+
+	def __init__(self, redis_client, ttl: int = LISTINGS_CACHE_TTL):
+		self.redis = redis_client
+		self.ttl = ttl
+		self._unavailable_until = 0
+		self._invalidation_pending = False
+
+	def _available(self) -> bool:
+		return time.monotonic() >= self._unavailable_until
+
+	def _failed(self, action: str, error: Exception):
+		print(f"Listings cache {action} failed, bypassing it for {LISTINGS_CACHE_RETRY_AFTER}s: {error}")
+		self._unavailable_until = time.monotonic() + LISTINGS_CACHE_RETRY_AFTER
+
+	@staticmethod
+	def params_digest(params: dict) -> str:
+		return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+	def version(self):
+		"""The current listings version, or None if the cache cannot be used right now."""
+		if not self._available():
+			return None
+		try:
+			if self._invalidation_pending:
+				self.redis.incr(LISTINGS_VERSION_KEY)
+				self._invalidation_pending = False
+			return int(self.redis.get(LISTINGS_VERSION_KEY) or 0)
+		except Exception as e:
+			self._failed("read", e)
+			return None
+
+	def etag(self, version: int, params: dict) -> str:
+		return f"listings-{version}-{self.params_digest(params)}"
+
+	def get_key(self, version: int, params: dict) -> str:
+		return f"{LISTINGS_PAGE_PREFIX}{version}:{self.params_digest(params)}"
+
+	def get(self, version: int, params: dict):
+		"""The cached JSON body of a page, or None."""
+		try:
+			return self.redis.get(self.get_key(version, params))
+		except Exception as e:
+			self._failed("read", e)
+			return None
+
+	def set(self, version: int, params: dict, body: bytes):
+		try:
+			self.redis.set(self.get_key(version, params), body, ex=self.ttl)
+		except Exception as e:
+			self._failed("write", e)
+
+	def invalidate(self):
+		"""Marks every cached page stale. Call after a committed change to the listings table."""
+		try:
+			self.redis.incr(LISTINGS_VERSION_KEY)
+		except Exception as e:
+			# Cached pages could now be served stale, so the bump is retried before the next read
+			self._invalidation_pending = True
+			self._failed("invalidation", e)
+
+_listings_cache = None
+_listings_cache_lock = threading.Lock()
+
+def get_listings_cache():
+	"""The process-wide ListingsCache, or None if it is disabled or Redis is not configured."""
+	global _listings_cache
+	if not LISTINGS_CACHE or not os.getenv('REDIS_HOST'):
+		return None
+	if _listings_cache is None:
+		with _listings_cache_lock:
+			if _listings_cache is None:
+				from cache import create_redis_client
+				_listings_cache = ListingsCache(create_redis_client())
+	return _listings_cache
+
+def invalidate_listings_cache():
+	"""Makes the next listing queries read the database again."""
+	listings_cache = get_listings_cache()
+	if listings_cache is not None:
+		listings_cache.invalidate()
@@ -0,0 +1,183 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2 import sql
+from database import db_connection
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from resilience import DEPENDENCY_TIMEOUTS, CircuitOpen, DeadlineExceeded, guarded_call
+
+NOTIFICATION_BATCH_SIZE = int(os.getenv('NOTIFICATION_BATCH_SIZE', 50)) # Rows claimed per round
+NOTIFICATION_POLL_INTERVAL = float(os.getenv('NOTIFICATION_POLL_INTERVAL', 1)) # Seconds between rounds while the outbox is drained
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 5))
+NOTIFICATION_RETRY_BACKOFF = float(os.getenv('NOTIFICATION_RETRY_BACKOFF', 30)) # Seconds before the first retry, doubled on every retry
+# Seconds a claimed row stays hidden from other workers; a worker that dies mid-batch is retried after this
+NOTIFICATION_LEASE = float(os.getenv('NOTIFICATION_LEASE', 120))
+NOTIFICATION_SEND_THREADS = int(os.getenv('NOTIFICATION_SEND_THREADS', 4))
+SMS_RATE_PER_SECOND = float(os.getenv('SMS_RATE_PER_SECOND', 1)) # Shared by every worker using the same Redis
+SMS_BURST = int(os.getenv('SMS_BURST', 5))
+SMS_QUOTA_COOLDOWN = float(os.getenv('SMS_QUOTA_COOLDOWN', 10)) # Seconds all workers back off after a 429
+
+TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
+TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
+TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
+
+# Errors after which sending again can succeed (OSError covers network errors, including requests');
+# anything else, e.g. an invalid number, fails the row at once
+RETRYABLE_ERRORS = (CircuitOpen, DeadlineExceeded, OSError)
+
+def is_retryable(error: Exception) -> bool:
+	status = getattr(error, 'status', None) # TwilioRestException carries the HTTP status
+	if status is not None:
+		return status == 429 or status >= 500
+	return isinstance(error, RETRYABLE_ERRORS)
+
+class NotificationWorker:
+	"""
+	Drains the notification outbox. Each round claims up to batch_size due rows with
+	FOR UPDATE SKIP LOCKED, so any number of workers can run side by side, and hides them for
+	lease seconds while they are sent. Sends run on a small thread pool, paced by an optional
+	token bucket shared through Redis. Retryable failures are tried again with exponential
+	backoff up to max_attempts; the outcome of a round is written back in one transaction.
+	Delivery is at least once: a worker dying between sending and recording resends the SMS.
+	The lease must cover sending a whole batch at the rate limit (batch_size / rate seconds).
+	"""
+
+	def __init__(self, send_sms, bucket=None, table: str = "notification_outbox", batch_size: int = NOTIFICATION_BATCH_SIZE,
+				 max_attempts: int = NOTIFICATION_MAX_ATTEMPTS, retry_backoff: float = NOTIFICATION_RETRY_BACKOFF,
+				 lease: float = NOTIFICATION_LEASE, threads: int = NOTIFICATION_SEND_THREADS):
+		self.send_sms = send_sms # (to_phone, body) -> provider message id
+		self.bucket = bucket
+		self.table = sql.Identifier(table)
+		self.batch_size = batch_size
+		self.max_attempts = max_attempts
+		self.retry_backoff = retry_backoff
+		self.lease = lease
+		self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='sms-sender')
+		self.stats = {'sent': 0, 'retried': 0, 'failed': 0}
+
+	def claim(self) -> list:
+		"""Leases the next due rows to this worker. Returns (id, to_phone, body, attempts) tuples."""
+		with db_connection() as conn, conn.cursor() as cur:
+			cur.execute(
+				sql.SQL("""
+				UPDATE {table}
+				SET attempts = attempts + 1, next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+				WHERE id IN (
+					SELECT id FROM {table}
+					WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+					ORDER BY next_attempt_at
+					LIMIT %s
+					FOR UPDATE SKIP LOCKED
+				)
+				RETURNING id, to_phone, body, attempts;
+				""").format(table=self.table),
+				(self.lease, self.batch_size)
+			)
+			rows = cur.fetchall()
+			conn.commit()
+		return rows
+
+	def wait_for_token(self):
+		while self.bucket is not None:
+			wait = self.bucket.take()
+			if wait <= 0:
+				return
+			time.sleep(wait)
+
+	def deliver(self, notification):
+		"""Sends one claimed row. Returns (id, attempts, message id or None, error or None)."""
+		notification_id, to_phone, body, attempts = notification
+		self.wait_for_token()
+		try:
+			return notification_id, attempts, guarded_call('twilio', self.send_sms, to_phone, body), None
+		except Exception as e:
+			if getattr(e, 'status', None) == 429 and self.bucket is not None:
+				self.bucket.cool_down(SMS_QUOTA_COOLDOWN)
+			return notification_id, attempts, None, e
+
+	def record(self, results: list):
+		sent, retries, failed = [], [], []
+		for notification_id, attempts, message_id, error in results:
+			if error is None:
+				sent.append((message_id, notification_id))
+			elif is_retryable(error) and attempts < self.max_attempts:
+				retries.append((self.retry_backoff * 2 ** (attempts - 1), str(error), notification_id))
+			else:
+				failed.append((str(error), notification_id))
+		with db_connection() as conn, conn.cursor() as cur:
+			cur.executemany(
+				sql.SQL("UPDATE {table} SET status = 'sent', sent_at = CURRENT_TIMESTAMP, provider_message_id = %s, last_error = NULL WHERE id = %s;").format(table=self.table),
+				sent
+			)
+			cur.executemany(
+				sql.SQL("UPDATE {table} SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s), last_error = %s WHERE id = %s;").format(table=self.table),
+				retries
+			)
+			cur.executemany(
+				sql.SQL("UPDATE {table} SET status = 'failed', last_error = %s WHERE id = %s;").format(table=self.table),
+				failed
+			)
+			conn.commit()
+		self.stats['sent'] += len(sent)
+		self.stats['retried'] += len(retries)
+		self.stats['failed'] += len(failed)
+
+	def run_once(self) -> int:
+		"""Claims, sends and records one batch. Returns the number of rows it handled."""
+		notifications = self.claim()
+		if notifications:
+			self.record(list(self.executor.map(self.deliver, notifications)))
+			print(f"Notifications: {len(notifications)} handled, totals {self.stats}")
+		return len(notifications)
+
+	def run(self, poll_interval: float = NOTIFICATION_POLL_INTERVAL):
+		while True:
+			try:
+				handled = self.run_once()
+			except Exception as e:
+				print(f"Notification round failed: {e}")
+				handled = 0
+			if handled < self.batch_size: # A full batch means more rows are probably due
+				time.sleep(poll_interval)
+
+def create_twilio_sender():
+	"""An SMS sender for NotificationWorker using the Twilio credentials from the environment."""
+	from twilio.rest import Client
+	from twilio.http.http_client import TwilioHttpClient
+	sms_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=TwilioHttpClient(timeout=DEPENDENCY_TIMEOUTS['twilio']))
+
+	def send_sms(to_phone: str, body: str) -> str:
+		sms = sms_client.messages.create(body=body, from_=TWILIO_PHONE_NUMBER, to=to_phone)
+		print(f"✅ SMS sent to {to_phone} (SID: {sms.sid})")
+		return sms.sid
+	return send_sms
+
+def create_sms_bucket():
+	"""The Redis token bucket pacing SMS across workers, or None if Redis is not configured."""
+	if not os.getenv('REDIS_HOST'):
+		return None
+	from cache import create_redis_client
+	from llm_limiter import TokenBucket
+	return TokenBucket(create_redis_client(), rate=SMS_RATE_PER_SECOND, capacity=SMS_BURST, name="sms_limiter")
+
+def main():
+	parser = argparse.ArgumentParser(description="Send queued SMS notifications from the notification outbox.")
+	parser.add_argument('--once', action='store_true', help="Handle one batch and exit")
+	args = parser.parse_args()
+
+	if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_PHONE_NUMBER):
+		print("Twilio is not configured; notifications stay queued in the outbox.")
+		return
+	worker = NotificationWorker(create_twilio_sender(), bucket=create_sms_bucket())
+	print(f"Notification worker started (batch {worker.batch_size}, {SMS_RATE_PER_SECOND} SMS/s)")
+	if args.once:
+		worker.run_once()
+	else:
+		worker.run()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,81 @@
+import unittest
+import io
+import os
+import sys
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from audio_preprocess import decode_wav, encode_wav, pcm16_to_mulaw, preprocess_audio, resample, trim_silence
+
+def tone(seconds, sample_rate, frequency=440, amplitude=0.5):
+	times = np.arange(int(seconds * sample_rate)) / sample_rate
+	return (amplitude * np.sin(2 * np.pi * frequency * times)).astype(np.float32)
+
+def stereo_wav(samples, sample_rate):
+	"""16-bit stereo WAV with the same signal on both channels."""
+	pcm = (np.repeat(samples[:, None], 2, axis=1) * 32767).astype('<i2')
+	buffer = io.BytesIO()
+	with wave.open(buffer, 'wb') as wav_file:
+		wav_file.setnchannels(2)
+		wav_file.setsampwidth(2)
+		wav_file.setframerate(sample_rate)
+		wav_file.writeframes(pcm.tobytes())
+	return buffer.getvalue()
+
+class TestAudioPreprocess(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+
+	def test_trim_silence(self):
+		sample_rate = 16000
+		silence = np.zeros(sample_rate, dtype=np.float32)
+		samples = np.concatenate([silence, tone(1, sample_rate), silence])
+		trimmed = trim_silence(samples, sample_rate, padding_ms=100)
+		self.assertAlmostEqual(len(trimmed) / sample_rate, 1.2, delta=0.05)
+
+	def test_all_silence_is_kept(self):
+		samples = np.zeros(8000, dtype=np.float32)
+		self.assertEqual(len(trim_silence(samples, 8000)), 8000)
+
+	def test_resample(self):
+		samples = tone(1, 44100)
+		self.assertEqual(len(resample(samples, 44100, 16000)), 16000)
+		self.assertIs(resample(samples, 44100, 44100), samples)
+
+	def test_wav_round_trip(self):
+		samples = tone(0.5, 8000)
+		decoded, sample_rate = decode_wav(encode_wav(samples, 8000))
+		self.assertEqual(sample_rate, 8000)
+		self.assertEqual(decoded.shape, (4000, 1))
+		self.assertTrue(np.allclose(decoded[:, 0], samples, atol=1e-3))
+
+	def test_preprocess_saves_bytes_and_seconds(self):
+		sample_rate = 44100
+		silence = np.zeros(sample_rate, dtype=np.float32)
+		data = stereo_wav(np.concatenate([silence, tone(2, sample_rate), silence]), sample_rate)
+		audio, report = preprocess_audio(data, target_rate=16000)
+
+		self.assertIsNotNone(audio)
+		samples, output_rate = decode_wav(audio)
+		self.assertEqual(output_rate, 16000)
+		self.assertEqual(samples.shape[1], 1)
+		self.assertGreater(report['seconds_saved'], 1.5)
+		self.assertEqual(report['bytes_saved'], len(data) - len(audio))
+		self.assertLess(len(audio), len(data) / 5)
+
+	def test_undecodable_audio_passes_through(self):
+		audio, report = preprocess_audio(b"ID3 not really an mp3")
+		self.assertIsNone(audio)
+		self.assertEqual(report['bytes_saved'], 0)
+
+	def test_mulaw_encoding(self):
+		pcm = np.array([0, -1, 100, -100, 32767, -32768], dtype='<i2').tobytes()
+		self.assertEqual(pcm16_to_mulaw(pcm), bytes([0xFF, 0x7E, 0xF2, 0x72, 0x80, 0x00]))
+		self.assertEqual(len(pcm16_to_mulaw(encode_wav(tone(1, 8000), 8000)[44:])), 8000)
+
+if __name__ == '__main__':
+	unittest.main()
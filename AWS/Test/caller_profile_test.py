@@ -0,0 +1,57 @@
+import unittest
+import os
+import sys
+
+import redis
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from caller_profile import CallerLanguageProfiles
+
+redis_client = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)), db=int(os.getenv('REDIS_DB', 0)))
+CALLER = "+91 98765 43210"
+
+class TestCallerLanguageProfiles(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+		self.profiles = CallerLanguageProfiles(redis_client, min_confirmations=2, min_confidence=0.7, reverify_every=3)
+		redis_client.delete(self.profiles.get_profile_key(CALLER))
+
+	def tearDown(self):
+		redis_client.delete(self.profiles.get_profile_key(CALLER))
+
+	def test_trusted_after_confirmations(self):
+		self.assertIsNone(self.profiles.get_language(CALLER))
+		self.profiles.record(CALLER, "gu-IN", 0.95, identified=True)
+		self.assertIsNone(self.profiles.get_language(CALLER))
+		self.profiles.record(CALLER, "gu-IN", 0.93, identified=True)
+		self.assertEqual(self.profiles.get_language(CALLER), "gu-IN")
+		# Same number written differently shares the profile
+		self.assertEqual(self.profiles.get_language("9876543210"), "gu-IN")
+
+	def test_language_change_resets_confirmations(self):
+		self.profiles.record(CALLER, "gu-IN", 0.95, identified=True)
+		self.profiles.record(CALLER, "hi-IN", 0.95, identified=True)
+		self.assertIsNone(self.profiles.get_language(CALLER))
+		self.profiles.record(CALLER, "hi-IN", 0.95, identified=True)
+		self.assertEqual(self.profiles.get_language(CALLER), "hi-IN")
+
+	def test_low_confidence_triggers_reverification(self):
+		self.profiles.record(CALLER, "ta-IN", 0.9, identified=True)
+		self.profiles.record(CALLER, "ta-IN", 0.9, identified=True)
+		self.profiles.record(CALLER, "ta-IN", 0.4, identified=False)
+		self.assertIsNone(self.profiles.get_language(CALLER))
+		self.profiles.record(CALLER, "ta-IN", 0.9, identified=True)
+		self.assertEqual(self.profiles.get_language(CALLER), "ta-IN")
+
+	def test_periodic_reverification(self):
+		self.profiles.record(CALLER, "mr-IN", 0.9, identified=True)
+		self.profiles.record(CALLER, "mr-IN", 0.9, identified=True)
+		for _ in range(3):
+			self.assertEqual(self.profiles.get_language(CALLER), "mr-IN")
+			self.profiles.record(CALLER, "mr-IN", 0.9, identified=False)
+		self.assertIsNone(self.profiles.get_language(CALLER))
+
+if __name__ == '__main__':
+	unittest.main()
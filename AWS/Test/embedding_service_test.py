@@ -0,0 +1,99 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from embedding_service import EmbeddingClient, EmbeddingServer, MicroBatcher
+
+class FakeModel:
+	"""Embeds a text as [len(text), number of words, 1] and records every batch it is given."""
+
+	def __init__(self):
+		self.batches = []
+
+	def encode(self, texts, batch_size=32):
+		self.batches.append(list(texts))
+		return np.array([[len(text), len(text.split()), 1.0] for text in texts])
+
+	def get_sentence_embedding_dimension(self):
+		return 3
+
+class TestEmbeddingService(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+		self.model = FakeModel()
+		self.batcher = MicroBatcher(window=0.05, max_batch=64)
+		self.batcher.models['fake'] = self.model
+		self.socket_path = os.path.join(tempfile.mkdtemp(), 'embedding.sock')
+		self.server = EmbeddingServer(self.socket_path, self.batcher)
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		self.client = EmbeddingClient(self.socket_path, 'fake')
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_shapes_match_sentence_transformer(self):
+		self.assertEqual(self.client.get_sentence_embedding_dimension(), 3)
+		vector = self.client.encode("hello world")
+		self.assertEqual(vector.shape, (3,))
+		self.assertEqual(vector.dtype, np.float32)
+		np.testing.assert_array_equal(vector, [11, 2, 1])
+		matrix = self.client.encode(["a", "b c"])
+		self.assertEqual(matrix.shape, (2, 3))
+		np.testing.assert_array_equal(matrix[:, 1], [1, 2])
+		self.assertEqual(self.client.encode([]).shape, (0, 3))
+
+	def test_normalize_embeddings(self):
+		vector = self.client.encode("abc", normalize_embeddings=True)
+		self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=5)
+
+	def test_concurrent_requests_share_a_batch(self):
+		texts = [f"query number {i}" for i in range(16)]
+		with ThreadPoolExecutor(max_workers=16) as executor:
+			vectors = list(executor.map(self.client.encode, texts))
+		for text, vector in zip(texts, vectors):
+			self.assertEqual(vector[0], len(text)) # Every caller gets its own row back
+		self.assertLess(len(self.model.batches), len(texts))
+		self.assertEqual(sorted(text for batch in self.model.batches for text in batch), sorted(texts))
+
+	def test_model_error_is_reported(self):
+		client = EmbeddingClient(self.socket_path, 'broken')
+		self.batcher.models['broken'] = None # encode raises AttributeError inside the service
+		with self.assertRaises(RuntimeError):
+			client.encode("hello")
+		np.testing.assert_array_equal(self.client.encode("hi"), [2, 1, 1]) # The service keeps serving
+
+	def test_forked_process_opens_its_own_connection(self):
+		np.testing.assert_array_equal(self.client.encode("hi"), [2, 1, 1]) # The parent connects first
+		read_end, write_end = os.pipe()
+		pid = os.fork()
+		if pid == 0:
+			try:
+				ok = self.client.encode("child")[0] == 5
+			except Exception:
+				ok = False
+			os.write(write_end, b'1' if ok else b'0')
+			os._exit(0)
+		os.waitpid(pid, 0)
+		self.assertEqual(os.read(read_end, 1), b'1')
+		# The child's requests did not interleave with the parent's on one socket
+		np.testing.assert_array_equal(self.client.encode("parent"), [6, 1, 1])
+
+	def test_reset_drops_the_connection(self):
+		self.client.encode("hi")
+		sock = self.client._local.sock
+		self.client.reset()
+		np.testing.assert_array_equal(self.client.encode("hello"), [5, 1, 1])
+		self.assertIsNot(self.client._local.sock, sock)
+		self.assertEqual(sock.fileno(), -1) # Closed
+
+if __name__ == '__main__':
+	unittest.main()
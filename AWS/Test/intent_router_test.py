@@ -0,0 +1,52 @@
+import unittest
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from intent_router import IntentRouter, extract_listing
+
+class TestIntentRouter(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+
+	def test_extracts_sell_commands(self):
+		listing = extract_listing("Sell 50 kg tomatoes at 30 rupees")
+		self.assertEqual((listing['item_name'], listing['price'], listing['quantity'], listing['unit']), ("tomatoes", 30.0, 50.0, "kg"))
+
+		listing = extract_listing("I want to sell my wheat at Rs 2,000 per quintal")
+		self.assertEqual((listing['item_name'], listing['price'], listing['quantity'], listing['price_unit']), ("wheat", 2000.0, None, "quintal"))
+
+		listing = extract_listing("I want to sell 100 kg of potatoes for 15 rupees per kg")
+		self.assertEqual((listing['item_name'], listing['price'], listing['quantity']), ("potatoes", 15.0, 100.0))
+
+	def test_leaves_other_utterances_to_llm(self):
+		for text in [
+			"what price should I sell tomatoes at?",
+			"should I sell my onions at 20 rupees",
+			"I don't want to sell tomatoes at 30 rupees",
+			"I want to buy tomatoes at 30 rupees",
+			"sell tomatoes",
+			"sell it for 30 rupees",
+			"sell onions at 20 rupees or 25 rupees",
+			"how do I grow rice",
+		]:
+			self.assertIsNone(extract_listing(text), text)
+
+	def test_route_and_hit_rate(self):
+		router = IntentRouter()
+		tool_name, tool_args = router.route("sell 50 kg tomatoes at 30 rupees", seller_contact="9876543210")
+		self.assertEqual(tool_name, "add_listing")
+		self.assertEqual(tool_args['seller_contact'], "9876543210")
+		self.assertEqual(tool_args['description'], "50 kg of tomatoes")
+
+		self.assertIsNone(router.route("sell 50 kg tomatoes at 30 rupees")) # No contact to list it under
+		self.assertIsNone(router.route("how do I grow rice", seller_contact="9876543210"))
+
+		metrics = router.metrics()
+		self.assertEqual((metrics['requests'], metrics['routed'], metrics['no_contact'], metrics['no_slots']), (3, 1, 1, 1))
+		self.assertAlmostEqual(metrics['hit_rate'], 0.333)
+
+if __name__ == '__main__':
+	unittest.main()
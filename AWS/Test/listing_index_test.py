@@ -0,0 +1,77 @@
+import unittest
+import os
+import sys
+import uuid
+
+import numpy as np
+import redis
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MarketPlace', 'backend', 'server')))
+
+from listing_index import ListingIndex
+
+redis_client = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)), db=int(os.getenv('REDIS_DB', 0)))
+
+class KeywordModel:
+	"""Embeds text by the produce categories its words belong to, so nearest neighbours are predictable."""
+	CATEGORIES = (('tomato', 'onion', 'okra', 'vegetables'), ('wheat', 'rice', 'grain', 'grains'), ('milk', 'ghee', 'dairy'))
+
+	def __init__(self):
+		self.calls = 0
+
+	def encode(self, texts):
+		self.calls += 1
+		single = isinstance(texts, str)
+		vectors = []
+		for text in [texts] if single else texts:
+			words = text.lower().replace('.', ' ').split()
+			vector = [sum(word in category for word in words) for category in self.CATEGORIES] + [0.1]
+			vectors.append(vector)
+		vectors = np.array(vectors, dtype=np.float32)
+		return vectors[0] if single else vectors
+
+	def get_sentence_embedding_dimension(self):
+		return len(self.CATEGORIES) + 1
+
+class TestListingIndex(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+		self.model = KeywordModel()
+		self.index = ListingIndex(redis_client, self.model, index_name="test_listing_idx", prefix="test_listing:")
+		self.ids = {name: str(uuid.uuid4()) for name in ('tomato', 'wheat', 'milk')}
+		self.index.add_listings([
+			{'id': self.ids['tomato'], 'item_name': "tomato", 'price': 30, 'description': "Fresh red tomato", 'seller_contact': "9876543210"},
+			{'id': self.ids['wheat'], 'item_name': "wheat", 'price': 2000, 'description': "Sharbati grain", 'seller_contact': "9876543211"},
+			{'id': self.ids['milk'], 'item_name': "milk", 'price': 50, 'description': None, 'seller_contact': "9876543212"},
+		])
+
+	def tearDown(self):
+		redis_client.ft("test_listing_idx").dropindex(delete_documents=True)
+
+	def test_listings_are_embedded_in_one_batch(self):
+		self.assertEqual(self.model.calls, 1)
+
+	def test_nearest_listing_first(self):
+		results = self.index.search("fresh vegetables", k=2)
+		self.assertEqual(results[0]['id'], self.ids['tomato'])
+		self.assertEqual(results[0]['item_name'], "tomato")
+		self.assertEqual(results[0]['price'], 30.0)
+		self.assertGreater(results[0]['score'], results[1]['score'])
+		self.assertEqual(self.index.search("rice and grains", k=1)[0]['id'], self.ids['wheat'])
+
+	def test_sold_listing_is_hidden_without_reembedding(self):
+		calls = self.model.calls
+		self.index.set_status(self.ids['tomato'], 'sold')
+		self.assertEqual(self.model.calls, calls)
+		self.assertNotIn(self.ids['tomato'], [listing['id'] for listing in self.index.search("vegetables", k=3)])
+		self.assertEqual(self.index.search("vegetables", k=3, status='sold')[0]['id'], self.ids['tomato'])
+
+	def test_deleted_listing_is_removed(self):
+		self.index.remove_listing(self.ids['milk'])
+		self.assertNotIn(self.ids['milk'], [listing['id'] for listing in self.index.search("dairy", k=3)])
+		self.index.set_status(self.ids['milk'], 'sold') # Unknown listings are not recreated
+		self.assertFalse(redis_client.exists(self.index.get_key(self.ids['milk'])))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import os
+import sys
+
+import redis
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MarketPlace', 'backend', 'server')))
+
+from listings_cache import LISTINGS_VERSION_KEY, ListingsCache
+
+redis_client = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)), db=int(os.getenv('REDIS_DB', 0)))
+
+class TestListingsCache(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+		self.cache = ListingsCache(redis_client, ttl=60)
+		self.params = {'status': 'active', 'seller_contact': None, 'limit': 24, 'cursor': None, 'fields': None}
+
+	def test_cached_page_is_returned_for_same_params(self):
+		version = self.cache.version()
+		self.cache.set(version, self.params, b'{"listings": []}')
+		self.assertEqual(self.cache.get(version, self.params), b'{"listings": []}')
+		self.assertIsNone(self.cache.get(version, dict(self.params, limit=25)))
+
+	def test_etag_depends_on_params(self):
+		version = self.cache.version()
+		self.assertEqual(self.cache.etag(version, self.params), self.cache.etag(version, dict(self.params)))
+		self.assertNotEqual(self.cache.etag(version, self.params), self.cache.etag(version, dict(self.params, status='sold')))
+
+	def test_invalidate_makes_pages_and_etags_stale(self):
+		version = self.cache.version()
+		etag = self.cache.etag(version, self.params)
+		self.cache.set(version, self.params, b'{"listings": []}')
+		self.cache.invalidate()
+		new_version = self.cache.version()
+		self.assertEqual(new_version, version + 1)
+		self.assertNotEqual(self.cache.etag(new_version, self.params), etag)
+		self.assertIsNone(self.cache.get(new_version, self.params))
+
+	def test_unreachable_redis_bypasses_cache(self):
+		unreachable = redis.Redis(host='localhost', port=1, socket_connect_timeout=0.5)
+		cache = ListingsCache(unreachable)
+		self.assertIsNone(cache.version())
+		cache.invalidate()
+		self.assertTrue(cache._invalidation_pending)
+		# Bypassed until the retry period is over, without waiting on Redis again
+		self.assertIsNone(cache.version())
+
+	def test_pending_invalidation_is_applied_before_next_read(self):
+		version = self.cache.version()
+		self.cache._invalidation_pending = True
+		self.assertEqual(self.cache.version(), version + 1)
+		self.assertFalse(self.cache._invalidation_pending)
+
+	@classmethod
+	def tearDownClass(cls):
+		redis_client.delete(LISTINGS_VERSION_KEY)
+
+if __name__ == "__main__":
+	unittest.main()
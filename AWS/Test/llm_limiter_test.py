@@ -0,0 +1,152 @@
+import unittest
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from llm_limiter import LLMLimiter, LLMRateLimited
+
+class FakeBucket:
+	"""Token bucket stand-in that makes callers wait a fixed time for every token."""
+	def __init__(self, waits):
+		self.waits = list(waits)
+
+	def take(self):
+		return self.waits.pop(0) if self.waits else 0.0
+
+	def cool_down(self, seconds):
+		pass
+
+class TestLLMLimiter(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+
+	def test_concurrency_cap(self):
+		limiter = LLMLimiter(max_concurrency=2, max_queue=10, queue_timeout=5)
+		in_flight, peak = [0], [0]
+		lock = threading.Lock()
+
+		def create(**kwargs):
+			with lock:
+				in_flight[0] += 1
+				peak[0] = max(peak[0], in_flight[0])
+			time.sleep(0.05)
+			with lock:
+				in_flight[0] -= 1
+			return "ok"
+
+		threads = [threading.Thread(target=limiter.call, args=(create,)) for _ in range(6)]
+		for thread in threads: thread.start()
+		for thread in threads: thread.join()
+
+		self.assertEqual(peak[0], 2)
+		metrics = limiter.metrics()
+		self.assertEqual(metrics["served"], 6)
+		self.assertEqual(metrics["active"], 0)
+
+	def test_full_queue_rejects(self):
+		limiter = LLMLimiter(max_concurrency=1, max_queue=0, queue_timeout=5)
+		limiter.acquire()
+		with self.assertRaises(LLMRateLimited):
+			limiter.acquire()
+		limiter.release()
+		self.assertEqual(limiter.metrics()["rejected"], 1)
+
+	def test_queue_timeout_rejects(self):
+		limiter = LLMLimiter(max_concurrency=1, max_queue=5, queue_timeout=0.05)
+		limiter.acquire()
+		with self.assertRaises(LLMRateLimited):
+			limiter.acquire()
+		limiter.release()
+		self.assertEqual(limiter.metrics()["waiting"], 0)
+
+	def test_priority_served_first(self):
+		limiter = LLMLimiter(max_concurrency=1, max_queue=5, queue_timeout=5)
+		limiter.acquire()
+		order = []
+
+		def wait(priority, label):
+			limiter.acquire(priority)
+			order.append(label)
+			limiter.release()
+
+		normal = threading.Thread(target=wait, args=(False, "normal"))
+		normal.start()
+		time.sleep(0.05)
+		urgent = threading.Thread(target=wait, args=(True, "priority"))
+		urgent.start()
+		time.sleep(0.05)
+		limiter.release()
+		normal.join()
+		urgent.join()
+
+		self.assertEqual(order, ["priority", "normal"])
+
+	def test_token_bucket_wait(self):
+		limiter = LLMLimiter(max_concurrency=1, max_queue=5, queue_timeout=1, bucket=FakeBucket([0.05]))
+		start = time.monotonic()
+		self.assertEqual(limiter.call(lambda **kwargs: "ok"), "ok")
+		self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+		limiter = LLMLimiter(max_concurrency=1, max_queue=5, queue_timeout=0.01, bucket=FakeBucket([1]))
+		with self.assertRaises(LLMRateLimited):
+			limiter.call(lambda **kwargs: "ok")
+		self.assertEqual(limiter.metrics()["active"], 0)
+
+	def test_async_waiters_do_not_hold_threads(self):
+		limiter = LLMLimiter(max_concurrency=2, max_queue=200, queue_timeout=5)
+		in_flight, peak, threads = [0], [0], []
+
+		async def create(**kwargs):
+			in_flight[0] += 1
+			peak[0] = max(peak[0], in_flight[0])
+			threads.append(threading.active_count())
+			await asyncio.sleep(0.01)
+			in_flight[0] -= 1
+			return "ok"
+
+		async def run():
+			return await asyncio.gather(*(limiter.async_call(create) for _ in range(100)))
+
+		before = threading.active_count()
+		self.assertEqual(asyncio.run(run()), ["ok"] * 100)
+		self.assertEqual(peak[0], 2)
+		self.assertEqual(max(threads), before) # 98 callers queued without a thread each
+		self.assertEqual(limiter.metrics()["active"], 0)
+
+	def test_async_waiter_gets_slot_released_by_thread(self):
+		limiter = LLMLimiter(max_concurrency=1, max_queue=5, queue_timeout=5)
+		limiter.acquire()
+		threading.Timer(0.05, limiter.release).start()
+
+		async def run():
+			await limiter.async_acquire()
+			limiter.release()
+
+		asyncio.run(run())
+		self.assertEqual(limiter.metrics()["active"], 0)
+
+	def test_async_queue_timeout_and_cancel(self):
+		limiter = LLMLimiter(max_concurrency=1, max_queue=5, queue_timeout=0.05)
+		limiter.acquire()
+
+		async def run():
+			with self.assertRaises(LLMRateLimited):
+				await limiter.async_acquire()
+			waiting = asyncio.ensure_future(limiter.async_acquire())
+			await asyncio.sleep(0.01)
+			waiting.cancel()
+			with self.assertRaises(asyncio.CancelledError):
+				await waiting
+
+		asyncio.run(run())
+		self.assertEqual(limiter.metrics()["waiting"], 0)
+		limiter.release()
+		self.assertEqual(limiter.metrics()["active"], 0)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,114 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# Compares the memory of gunicorn workers started with and without preloading the app.
+# RSS counts shared pages in every worker, so the private (USS) and proportional (PSS) sizes
+# from /proc/<pid>/smaps_rollup show what each extra worker really costs. Linux only.
+#
+#   cd AWS/MarketPlace/backend/server
+#   python ../../../Test/memory_benchmark.py --app async_client:app --worker-class uvicorn.workers.UvicornWorker --workers 4
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MarketPlace', 'backend', 'server'))
+
+def memory_kb(pid):
+	"""RSS, PSS and private (USS) memory of a process in kB."""
+	fields = {}
+	with open(f"/proc/{pid}/smaps_rollup") as smaps:
+		for line in smaps:
+			parts = line.split()
+			if len(parts) == 3 and parts[2] == 'kB':
+				fields[parts[0].rstrip(':')] = int(parts[1])
+	return {
+		'rss': fields.get('Rss', 0),
+		'pss': fields.get('Pss', 0),
+		'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+	}
+
+def child_pids(pid):
+	children = []
+	for entry in os.listdir('/proc'):
+		if not entry.isdigit():
+			continue
+		try:
+			with open(f"/proc/{entry}/stat") as stat:
+				# The parent pid is the second field after the parenthesised command name
+				if int(stat.read().rsplit(')', 1)[1].split()[1]) == pid:
+					children.append(int(entry))
+		except (OSError, IndexError, ValueError):
+			continue
+	return children
+
+def wait_for_workers(master, workers, timeout):
+	"""Waits until every worker is up and its RSS has stopped growing, i.e. the app has loaded."""
+	deadline = time.monotonic() + timeout
+	previous = None
+	while time.monotonic() < deadline:
+		if master.poll() is not None:
+			raise RuntimeError(f"gunicorn exited with code {master.returncode}")
+		pids = sorted(child_pids(master.pid))
+		if len(pids) == workers:
+			try:
+				current = [memory_kb(pid)['rss'] for pid in pids]
+			except OSError:
+				current = None
+			if current is not None and current == previous:
+				return pids
+			previous = current
+		time.sleep(2)
+	raise RuntimeError(f"Workers did not settle within {timeout}s")
+
+def warm_up(bind, path, requests):
+	for _ in range(requests):
+		try:
+			urllib.request.urlopen(f"http://{bind}{path}", timeout=30).read()
+		except (urllib.error.URLError, OSError):
+			pass # Only the work done by the worker matters, not the status
+
+def measure(args, preload):
+	env = dict(os.environ, GUNICORN_PRELOAD='true' if preload else 'false')
+	command = [
+		sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', args.bind,
+		'--workers', str(args.workers), '--worker-class', args.worker_class, args.app,
+	]
+	master = subprocess.Popen(command, cwd=args.chdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	try:
+		pids = wait_for_workers(master, args.workers, args.timeout)
+		warm_up(args.bind, args.warmup_path, args.warmup_requests)
+		time.sleep(1)
+		return memory_kb(master.pid), [memory_kb(pid) for pid in pids]
+	finally:
+		master.send_signal(signal.SIGTERM)
+		master.wait(timeout=60)
+
+def main():
+	parser = argparse.ArgumentParser(description="Per-worker memory of gunicorn with and without preload_app.")
+	parser.add_argument('--app', default='app:app')
+	parser.add_argument('--worker-class', default='sync')
+	parser.add_argument('--workers', type=int, default=4)
+	parser.add_argument('--bind', default='127.0.0.1:5099')
+	parser.add_argument('--chdir', default=SERVER_DIR)
+	parser.add_argument('--warmup-path', default='/llm_metrics')
+	parser.add_argument('--warmup-requests', type=int, default=20)
+	parser.add_argument('--timeout', type=float, default=300)
+	args = parser.parse_args()
+
+	results = {}
+	for preload in (False, True):
+		label = 'preload' if preload else 'no preload'
+		print(f"Starting {args.workers} workers of {args.app} ({label})...")
+		results[label] = measure(args, preload)
+
+	print(f"\n{'mode':<12}{'worker RSS':>14}{'worker PSS':>14}{'worker USS':>14}{'total PSS':>14}")
+	for label, (master, workers) in results.items():
+		average = {key: sum(worker[key] for worker in workers) / len(workers) / 1024 for key in ('rss', 'pss', 'uss')}
+		total_pss = (master['pss'] + sum(worker['pss'] for worker in workers)) / 1024
+		print(f"{label:<12}{average['rss']:>11.1f} MB{average['pss']:>11.1f} MB{average['uss']:>11.1f} MB{total_pss:>11.1f} MB")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,84 @@
+import unittest
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pipeline import ASYNC, THREAD, Parallel, Pipeline, Stage, StageCache, StageError
+
+class RecordingHook:
+	def __init__(self):
+		self.events = []
+
+	def stage_finished(self, stage, ctx, elapsed, error=None, cache_hit=False, skipped=False):
+		self.events.append((stage.name, 'skipped' if skipped else 'hit' if cache_hit else 'error' if error else 'done'))
+
+def sleep_and_set(key, seconds=0.1):
+	def run(ctx):
+		time.sleep(seconds)
+		ctx[key] = threading.current_thread().name
+	return run
+
+class TestPipeline(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+
+	def test_parallel_stages_overlap(self):
+		pipeline = Pipeline([Parallel(Stage('a', sleep_and_set('a'), THREAD), Stage('b', sleep_and_set('b'), THREAD))])
+		start = time.monotonic()
+		ctx = pipeline.run({})
+		self.assertLess(time.monotonic() - start, 0.18)
+		self.assertIn('a', ctx)
+		self.assertIn('b', ctx)
+
+	def test_cache_hit_skips_stage(self):
+		hook = RecordingHook()
+		stored = []
+		cache = StageCache(lambda ctx: ctx.get('cached', False), lambda ctx: stored.append(ctx['value']))
+		pipeline = Pipeline([Stage('work', lambda ctx: ctx.update(value=1), cache=cache)], hooks=[hook])
+
+		self.assertNotIn('value', pipeline.run({'cached': True}))
+		self.assertEqual(pipeline.run({})['value'], 1)
+		self.assertEqual(stored, [1])
+		self.assertEqual(hook.events, [('work', 'hit'), ('work', 'done')])
+
+	def test_when_and_background(self):
+		hook = RecordingHook()
+		pipeline = Pipeline([
+			Stage('background', sleep_and_set('background', 0.05), THREAD, background=True),
+			Stage('skipped', lambda ctx: ctx.update(skipped=True), when=lambda ctx: False),
+		], hooks=[hook])
+		ctx = pipeline.run({})
+		self.assertIn('background', ctx) # Background stages finish before run() returns
+		self.assertNotIn('skipped', ctx)
+
+	def test_stage_error_propagates(self):
+		def fail(ctx):
+			raise StageError('broken', status=503)
+		pipeline = Pipeline([Stage('fail', fail), Stage('after', lambda ctx: ctx.update(after=True))])
+		ctx = {}
+		with self.assertRaises(StageError) as raised:
+			pipeline.run(ctx)
+		self.assertEqual(raised.exception.status, 503)
+		self.assertNotIn('after', ctx)
+
+	def test_run_async_uses_async_stage(self):
+		async def run_async(ctx, run_blocking):
+			await asyncio.sleep(0)
+			ctx['mode'] = 'async'
+		pipeline = Pipeline([
+			Stage('mode', lambda ctx: ctx.update(mode='sync'), ASYNC, run_async=run_async),
+			Parallel(Stage('a', sleep_and_set('a'), THREAD), Stage('b', sleep_and_set('b'), THREAD)),
+		])
+		self.assertEqual(pipeline.run({})['mode'], 'sync')
+		start = time.monotonic()
+		ctx = asyncio.run(pipeline.run_async({}))
+		self.assertEqual(ctx['mode'], 'async')
+		self.assertLess(time.monotonic() - start, 0.18)
+
+if __name__ == '__main__':
+	unittest.main()
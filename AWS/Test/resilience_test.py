@@ -0,0 +1,121 @@
+import unittest
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import resilience
+from resilience import Bulkhead, BulkheadFull, CircuitOpen, DeadlineExceeded, async_guarded_call, breakers, bulkheads, guarded_call
+
+class TestBulkheads(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+		self.original = dict(bulkheads)
+		bulkheads['s3'] = Bulkhead('s3', 2)
+		bulkheads['gemini'] = Bulkhead('gemini', 200)
+		breakers['s3'].record_success()
+		breakers['gemini'].record_success()
+
+	def tearDown(self):
+		bulkheads.update(self.original)
+
+	def test_full_bulkhead_rejects_without_waiting(self):
+		release = threading.Event()
+		threads = [threading.Thread(target=guarded_call, args=('s3', release.wait)) for _ in range(2)]
+		for thread in threads:
+			thread.start()
+		while bulkheads['s3'].in_flight < 2:
+			time.sleep(0.01)
+		started = time.monotonic()
+		with self.assertRaises(BulkheadFull):
+			guarded_call('s3', lambda: "unreachable")
+		self.assertLess(time.monotonic() - started, 0.1)
+		self.assertEqual(guarded_call('s3', lambda: "unreachable", fallback=lambda: "fallback"), "fallback")
+		release.set()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(guarded_call('s3', lambda: "ok"), "ok")
+
+	def test_timed_out_call_keeps_its_slot_until_it_returns(self):
+		release = threading.Event()
+		resilience.DEPENDENCY_TIMEOUTS['s3'], timeout = 0.05, resilience.DEPENDENCY_TIMEOUTS['s3']
+		try:
+			with self.assertRaises(DeadlineExceeded):
+				guarded_call('s3', release.wait)
+		finally:
+			resilience.DEPENDENCY_TIMEOUTS['s3'] = timeout
+		self.assertEqual(bulkheads['s3'].in_flight, 1)
+		release.set()
+		while bulkheads['s3'].in_flight:
+			time.sleep(0.01)
+
+	def test_rejections_do_not_open_the_breaker(self):
+		bulkheads['s3'] = Bulkhead('s3', 1)
+		release = threading.Event()
+		thread = threading.Thread(target=guarded_call, args=('s3', release.wait))
+		thread.start()
+		while not bulkheads['s3'].in_flight:
+			time.sleep(0.01)
+		for _ in range(10):
+			with self.assertRaises(CircuitOpen):
+				guarded_call('s3', lambda: None)
+		self.assertEqual(breakers['s3'].state, 'closed')
+		release.set()
+		thread.join()
+
+	def test_slow_dependency_does_not_starve_another(self):
+		release = threading.Event()
+		for _ in range(2):
+			threading.Thread(target=guarded_call, args=('s3', release.wait)).start()
+		try:
+			results = []
+			threads = [threading.Thread(target=lambda: results.append(guarded_call('gemini', time.sleep, 0.2))) for _ in range(200)]
+			started = time.monotonic()
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			# Hundreds of concurrent calls run side by side instead of queueing
+			self.assertEqual(len(results), 200)
+			self.assertLess(time.monotonic() - started, 1.5)
+		finally:
+			release.set()
+
+	def test_async_call_releases_its_slot(self):
+		async def call():
+			return await async_guarded_call('s3', asyncio.sleep, 0.01)
+		asyncio.run(call())
+		self.assertEqual(bulkheads['s3'].in_flight, 0)
+
+	def test_client_errors_do_not_open_the_breaker(self):
+		class QuotaError(Exception):
+			pass
+
+		def refuse():
+			raise QuotaError("429")
+
+		for _ in range(10):
+			with self.assertRaises(QuotaError):
+				guarded_call('gemini', refuse, not_failures=(QuotaError,))
+		self.assertEqual(breakers['gemini'].state, 'closed')
+
+		async def call():
+			async def refuse_async():
+				raise QuotaError("429")
+			for _ in range(10):
+				with self.assertRaises(QuotaError):
+					await async_guarded_call('gemini', refuse_async, not_failures=(QuotaError,))
+		asyncio.run(call())
+		self.assertEqual(breakers['gemini'].state, 'closed')
+		for _ in range(10):
+			with self.assertRaises((QuotaError, CircuitOpen)):
+				guarded_call('gemini', refuse) # Counted as failures without not_failures
+		self.assertEqual(breakers['gemini'].state, 'open')
+		breakers['gemini'].record_success()
+
+if __name__ == "__main__":
+	unittest.main()
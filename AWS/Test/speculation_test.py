@@ -0,0 +1,72 @@
+import unittest
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from speculation import SpeculationPolicy
+from voice_pipeline import VoiceGateway
+
+class FakeLimiter:
+
+	def call(self, fn, priority=False, **kwargs):
+		return fn(**kwargs)
+
+class FakeCache:
+
+	def get(self, text):
+		return None
+
+class TestSpeculationPolicy(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+
+	def test_modes(self):
+		self.assertFalse(SpeculationPolicy('off').should_speculate())
+		self.assertTrue(SpeculationPolicy('always').should_speculate())
+		with self.assertRaises(ValueError):
+			SpeculationPolicy('sometimes')
+
+	def test_auto_follows_hit_rate(self):
+		policy = SpeculationPolicy('auto', max_hit_rate=0.5, window=4)
+		self.assertTrue(policy.should_speculate())
+		for hit in (True, True, True, False):
+			policy.record_lookup(hit)
+		self.assertFalse(policy.should_speculate())
+		for _ in range(3):
+			policy.record_lookup(False) # Old hits slide out of the window
+		self.assertTrue(policy.should_speculate())
+
+	def test_metrics(self):
+		policy = SpeculationPolicy('always')
+		policy.record_speculated()
+		policy.record_used(0.25)
+		policy.record_speculated()
+		policy.record_wasted()
+		policy.record_wasted_tokens(120)
+		metrics = policy.metrics()
+		self.assertEqual((metrics['speculated'], metrics['used'], metrics['wasted'], metrics['tokens_wasted']), (2, 1, 1, 120))
+		self.assertEqual(metrics['latency_saved_ms'], 250.0)
+
+	def test_speculative_call_does_not_wait_for_the_pipeline_pool(self):
+		completions = SimpleNamespace(create=lambda **kwargs: SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Water twice a week.", tool_calls=None))]))
+		gateway = VoiceGateway(
+			s3_client=None, transcribe_client=None, translate_client=None, polly_client=None,
+			llm_client=SimpleNamespace(chat=SimpleNamespace(completions=completions)), cache=FakeCache(), llm_limiter=FakeLimiter(),
+			bucket='test', cache_strategy='exact', speculation=SpeculationPolicy('always'), executor=ThreadPoolExecutor(max_workers=1)
+		)
+		ctx = gateway.new_context(b'')
+		ctx['text_for_llm'] = "How often should I water tomatoes?"
+
+		def llm_stage():
+			# The only pipeline thread starts the speculative call and waits for it, so it must run elsewhere
+			gateway.lookup_cached_response(ctx)
+			gateway.generate_response(ctx)
+		gateway.pipeline.executor.submit(llm_stage).result(timeout=5)
+		self.assertEqual(ctx['llm_response_text'], "Water twice a week.")
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+import io
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pipeline import StageError
+from voice_pipeline import VoiceGateway, split_for_speech
+
+class FakePolly:
+	"""Returns the text as audio after a delay and records the requests it is sent."""
+
+	def __init__(self, delay=0.2, fail_on=None):
+		self.delay = delay
+		self.fail_on = fail_on
+		self.texts = []
+		self._lock = threading.Lock()
+
+	def synthesize_speech(self, Text, **kwargs):
+		with self._lock:
+			self.texts.append(Text)
+		time.sleep(self.delay)
+		if self.fail_on and self.fail_on in Text:
+			raise RuntimeError("Polly failed")
+		return {'AudioStream': io.BytesIO(f"<{Text}>".encode())}
+
+class FakeSpeechCache:
+
+	def __init__(self):
+		self.entries = {}
+
+	def get_speech(self, text, language, voice_id, audio_format="mp3", sample_rate=None):
+		return self.entries.get((text, language, voice_id, audio_format, sample_rate))
+
+	def set_speech(self, text, language, voice_id, final_text, audio, ttl=None, audio_format="mp3", sample_rate=None):
+		self.entries[(text, language, voice_id, audio_format, sample_rate)] = {'final_text': final_text, 'audio': audio}
+
+class FailingTranslate:
+
+	def translate_text(self, **kwargs):
+		raise RuntimeError("Translate failed")
+
+SENTENCES = [f"Sentence number {i} tells the farmer something useful about the crop." for i in range(6)]
+
+class TestSpeechSynthesis(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+		self.polly = FakePolly()
+		self.cache = FakeSpeechCache()
+		self.gateway = self.new_gateway(self.polly)
+
+	def new_gateway(self, polly):
+		return VoiceGateway(
+			s3_client=None, transcribe_client=None, translate_client=None, polly_client=polly,
+			llm_client=None, cache=self.cache, llm_limiter=None, bucket='test', speech_chunk_chars=150
+		)
+
+	def new_context(self, text, audio_format='mp3'):
+		ctx = self.gateway.new_context(b'', audio_format=audio_format)
+		ctx.update({'final_response_text': text, 'target_polly_lang': 'en-IN', 'polly_voice_id': 'Kajal', 'polly_engine': 'neural'})
+		return ctx
+
+	def test_split_keeps_sentences_within_limit(self):
+		text = " ".join(SENTENCES)
+		chunks = split_for_speech(text, 150)
+		self.assertGreater(len(chunks), 1)
+		self.assertTrue(all(len(chunk) <= 150 for chunk in chunks))
+		self.assertEqual(" ".join(chunks), text)
+		self.assertTrue(all(chunk.endswith('.') for chunk in chunks)) # Cut at sentence ends only
+
+	def test_split_long_sentence_and_danda(self):
+		self.assertEqual(split_for_speech("पहला वाक्य। दूसरा वाक्य।", 12), ["पहला वाक्य।", "दूसरा वाक्य।"])
+		chunks = split_for_speech("word " * 100, 50)
+		self.assertTrue(all(len(chunk) <= 50 for chunk in chunks))
+		self.assertEqual(" ".join(chunks).split(), ["word"] * 100)
+
+	def test_short_response_is_one_request(self):
+		ctx = self.new_context("Grow rice.")
+		self.gateway.synthesize(ctx)
+		self.assertEqual(ctx['audio_stream'], b"<Grow rice.>")
+		self.assertEqual(self.polly.texts, ["Grow rice."])
+		self.assertNotIn('speech_chunks', ctx)
+
+	def test_chunks_run_in_parallel_and_join_in_order(self):
+		ctx = self.new_context(" ".join(SENTENCES))
+		started = time.monotonic()
+		self.gateway.synthesize(ctx)
+		elapsed = time.monotonic() - started
+		chunks = split_for_speech(ctx['final_response_text'], 150)
+		self.assertEqual(ctx['audio_stream'], b"".join(f"<{chunk}>".encode() for chunk in chunks))
+		self.assertEqual(ctx['speech_chunks'], {'chunks': len(chunks), 'cached': 0})
+		self.assertLess(elapsed, self.polly.delay * len(chunks) * 0.75)
+
+	def test_chunks_are_cached(self):
+		self.gateway.synthesize(self.new_context(" ".join(SENTENCES)))
+		self.polly.texts.clear()
+		# A different answer that shares its first sentences only synthesizes the new chunk
+		ctx = self.new_context(" ".join(SENTENCES[:4] + ["A brand new closing sentence."]))
+		self.gateway.synthesize(ctx)
+		self.assertEqual(len(self.polly.texts), 1)
+		self.assertIn("A brand new closing sentence.", self.polly.texts[0])
+		self.assertEqual(ctx['speech_chunks']['cached'], ctx['speech_chunks']['chunks'] - 1)
+
+	def test_ogg_is_not_split_below_polly_limit(self):
+		ctx = self.new_context(" ".join(SENTENCES), audio_format='ogg_vorbis')
+		self.gateway.synthesize(ctx)
+		self.assertEqual(len(self.polly.texts), 1)
+
+	def test_failed_chunk_fails_the_stage(self):
+		gateway = self.new_gateway(FakePolly(delay=0, fail_on="number 3"))
+		ctx = self.new_context(" ".join(SENTENCES))
+		with self.assertRaises(StageError):
+			gateway.synthesize(ctx)
+
+	def test_untranslated_fallback_is_not_cached(self):
+		self.gateway.translate_client = FailingTranslate()
+		ctx = self.new_context(None)
+		ctx.update({'llm_response_text': " ".join(SENTENCES), 'target_polly_lang': 'hi-IN', 'cacheable': True})
+		self.gateway.translate_out(ctx)
+		self.assertTrue(ctx['degraded'])
+		self.assertEqual(ctx['final_response_text'], ctx['llm_response_text'])
+		self.gateway.synthesize(ctx)
+		self.gateway.store_cached_speech(ctx)
+		self.assertEqual(self.cache.entries, {})
+
+if __name__ == '__main__':
+	unittest.main()
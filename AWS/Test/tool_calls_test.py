@@ -0,0 +1,136 @@
+import unittest
+import json
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MarketPlace', 'backend', 'server')))
+
+import requests
+
+import marketplace_tools
+
+def tool_call(name, arguments):
+	return SimpleNamespace(type='function', function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+class FakeSession:
+	"""Answers every request with one canned JSON response and records the requests."""
+
+	def __init__(self, status_code, body):
+		self.status_code = status_code
+		self.body = body
+		self.requests = []
+
+	def request(self, method, url, **kwargs):
+		self.requests.append((method, url, kwargs))
+		response = requests.Response()
+		response.status_code = self.status_code
+		response._content = json.dumps(self.body).encode()
+		response.url = url
+		return response
+
+class TestToolCalls(unittest.TestCase):
+
+	def setUp(self):
+		print(f"\n--- Running test: {self._testMethodName} ---\n")
+		self.available_tools = dict(marketplace_tools.available_tools)
+		self.batch_tools = dict(marketplace_tools.batch_tools)
+		self.create_listings_in_db = marketplace_tools.create_listings_in_db
+
+	def tearDown(self):
+		marketplace_tools.available_tools.clear()
+		marketplace_tools.available_tools.update(self.available_tools)
+		marketplace_tools.batch_tools.clear()
+		marketplace_tools.batch_tools.update(self.batch_tools)
+		marketplace_tools.create_listings_in_db = self.create_listings_in_db
+
+	def test_calls_run_concurrently_in_order(self):
+		started = threading.Barrier(3, timeout=2)
+
+		def delete_listing(listing_id):
+			started.wait() # Only passes if all three calls are running at once
+			return {"status": "success", "listing_id": listing_id}
+
+		marketplace_tools.available_tools["delete_listing"] = delete_listing
+		calls = marketplace_tools.parse_tool_calls([tool_call("delete_listing", {"listing_id": str(i)}) for i in range(3)])
+		outputs = marketplace_tools.run_tool_calls(calls)
+		self.assertEqual([output["listing_id"] for output in outputs], ["0", "1", "2"])
+
+	def test_add_listing_calls_are_batched(self):
+		batches = []
+
+		def add_listings(listings):
+			batches.append(listings)
+			return [{"status": "success", "listing_id": listing["item_name"]} for listing in listings]
+
+		marketplace_tools.batch_tools["add_listing"] = add_listings
+		marketplace_tools.available_tools["delete_listing"] = lambda listing_id: {"status": "success", "listing_id": listing_id}
+		calls = marketplace_tools.parse_tool_calls([
+			tool_call("add_listing", {"item_name": "tomatoes", "price": 30}),
+			tool_call("delete_listing", {"listing_id": "old"}),
+			tool_call("add_listing", {"item_name": "onions", "price": 20}),
+			tool_call("unknown_tool", {}),
+		])
+		outputs = marketplace_tools.run_tool_calls(calls)
+		self.assertEqual(len(batches), 1)
+		self.assertEqual([output["listing_id"] for output in outputs], ["tomatoes", "old", "onions"])
+
+	def test_invalid_add_listing_call_only_fails_itself(self):
+		inserted = []
+
+		def create_listings_in_db(listings):
+			inserted.extend(listings)
+			return [{"status": "success", "listing_id": listing["item_name"]} for listing in listings]
+
+		marketplace_tools.create_listings_in_db = create_listings_in_db
+		calls = marketplace_tools.parse_tool_calls([
+			tool_call("add_listing", {"item_name": "tomatoes", "price": 30, "seller_name": "Ravi", "seller_contact": "9876543210"}),
+			tool_call("add_listing", {"item_name": "onions", "price": 20, "seller_name": "Ravi", "seller_contact": None}),
+			tool_call("add_listing", {"price": 10, "seller_name": "Ravi", "seller_contact": "9876543210"}),
+			tool_call("add_listing", {"item_name": "garlic", "price": 50, "seller_name": "Ravi", "seller_contact": "9876543210"}),
+		])
+		outputs = marketplace_tools.run_tool_calls(calls)
+		self.assertEqual([listing["item_name"] for listing in inserted], ["tomatoes", "garlic"])
+		self.assertEqual([output["status"] for output in outputs], ["success", "error", "error", "success"])
+		self.assertIn("seller_contact", outputs[1]["message"])
+		self.assertIn("item_name", outputs[2]["message"])
+		self.assertEqual(outputs[3]["listing_id"], "garlic")
+
+	def test_slow_call_times_out(self):
+		marketplace_tools.available_tools["delete_listing"] = lambda listing_id: time.sleep(0.5)
+		calls = marketplace_tools.parse_tool_calls([tool_call("delete_listing", {"listing_id": "1"})])
+		outputs = marketplace_tools.run_tool_calls(calls, timeout=0.05)
+		self.assertEqual(outputs[0]["status"], "error")
+
+	def test_client_adds_listings_with_one_bulk_request(self):
+		client = marketplace_tools.MarketplaceClient(base_url="http://marketplace")
+		client.session = FakeSession(201, {"status": "success", "listing_ids": ["a", "b"]})
+		outputs = client.add_listings([{"item_name": "tomatoes", "price": 30}, {"item_name": "onions", "price": 20}])
+		self.assertEqual(len(client.session.requests), 1)
+		method, url, kwargs = client.session.requests[0]
+		self.assertEqual((method, url), ("POST", "http://marketplace/bulk_add_listings"))
+		self.assertEqual(len(kwargs['json']['listings']), 2)
+		self.assertEqual([output["listing_id"] for output in outputs], ["a", "b"])
+
+	def test_client_reports_invalid_listings_per_listing(self):
+		client = marketplace_tools.MarketplaceClient(base_url="http://marketplace")
+		client.session = FakeSession(400, {
+			"status": "invalid", "message": "1 of 2 listings are invalid",
+			"errors": [{"index": 1, "message": "item_name is required"}]
+		})
+		outputs = client.add_listings([{"item_name": "tomatoes", "price": 30}, {"item_name": "", "price": 20}])
+		self.assertEqual([output["status"] for output in outputs], ["error", "error"])
+		self.assertEqual(outputs[1]["message"], "item_name is required")
+		self.assertIn("1 of 2 listings are invalid", outputs[0]["message"])
+
+	def test_client_timeouts_fit_the_guarded_call(self):
+		client = marketplace_tools.MarketplaceClient(timeout=5, retries=2, backoff_factor=0.2)
+		connect, read = client.timeout
+		self.assertLessEqual(connect * 3 + 0.2 + 0.4, 5 + 1e-9)
+		self.assertEqual(client.session.get_adapter("http://").max_retries.read, 0)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,148 @@
+import io
+import os
+import shutil
+import subprocess
+import wave
+
+import numpy as np
+
+AUDIO_PREPROCESSING = os.getenv('AUDIO_PREPROCESSING', 'true').lower() == 'true'
+AUDIO_TARGET_SAMPLE_RATE = int(os.getenv('AUDIO_TARGET_SAMPLE_RATE', 16000)) # 8000 is enough for phone-quality audio
+AUDIO_SILENCE_THRESHOLD_DB = float(os.getenv('AUDIO_SILENCE_THRESHOLD_DB', -35)) # Frame energy relative to the loudest frame
+AUDIO_FRAME_MS = 30
+AUDIO_PADDING_MS = int(os.getenv('AUDIO_PADDING_MS', 200)) # Kept around speech so word edges are not clipped
+AUDIO_MIN_SECONDS_SAVED = float(os.getenv('AUDIO_MIN_SECONDS_SAVED', 0.5))
+FFMPEG_TIMEOUT = 10
+
+
+def decode_wav(data: bytes):
+    """Decodes PCM WAV bytes into float32 samples of shape (frames, channels) in [-1, 1] and the sample rate."""
+    with wave.open(io.BytesIO(data), 'rb') as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+    if sample_width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768
+    elif sample_width == 4:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {sample_width}")
+    return samples.reshape(-1, channels), sample_rate
+
+
+def decode_with_ffmpeg(data: bytes):
+    """Decodes any format ffmpeg understands (mp3, m4a, ...) to PCM WAV; returns None if ffmpeg is unavailable."""
+    if shutil.which('ffmpeg') is None:
+        return None
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0', '-f', 'wav', '-acodec', 'pcm_s16le', 'pipe:1'],
+        input=data, capture_output=True, timeout=FFMPEG_TIMEOUT, check=True
+    )
+    return decode_wav(result.stdout)
+
+
+def encode_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    """Encodes mono float samples as 16-bit PCM WAV."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """Averages all channels into one."""
+    return samples.mean(axis=1) if samples.ndim == 2 else samples
+
+
+def resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    """Linear-interpolation resampling with a moving-average low-pass when downsampling."""
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    if target_rate < source_rate:
+        width = int(np.ceil(source_rate / target_rate))
+        samples = np.convolve(samples, np.ones(width, dtype=np.float32) / width, mode='same')
+    duration = len(samples) / source_rate
+    target_times = np.arange(int(duration * target_rate)) / target_rate
+    source_times = np.arange(len(samples)) / source_rate
+    return np.interp(target_times, source_times, samples).astype(np.float32)
+
+
+def trim_silence(samples: np.ndarray, sample_rate: int, threshold_db: float = AUDIO_SILENCE_THRESHOLD_DB,
+                 frame_ms: int = AUDIO_FRAME_MS, padding_ms: int = AUDIO_PADDING_MS) -> np.ndarray:
+    """
+    Energy-based voice activity trimming: drops leading and trailing frames whose RMS is more than
+    threshold_db below the loudest frame. Audio that is silent throughout is returned unchanged.
+    """
+    frame_length = max(1, sample_rate * frame_ms // 1000)
+    frame_count = len(samples) // frame_length
+    if frame_count == 0:
+        return samples
+    frames = samples[:frame_count * frame_length].reshape(frame_count, frame_length)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    peak = rms.max()
+    if peak <= 0:
+        return samples
+    voiced = np.flatnonzero(rms >= peak * 10 ** (threshold_db / 20))
+    padding = sample_rate * padding_ms // 1000
+    start = max(0, voiced[0] * frame_length - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame_length + padding)
+    return samples[start:end]
+
+
+def preprocess_audio(data: bytes, target_rate: int = AUDIO_TARGET_SAMPLE_RATE):
+    """
+    Trims silence, downmixes to mono and downsamples to target_rate. Returns (audio, report):
+    audio is 16-bit mono WAV, or None when the input cannot be decoded or shrinking it would not
+    pay off, in which case the original should be used. report records the bytes and seconds saved.
+    """
+    report = {'original_bytes': len(data), 'processed_bytes': len(data), 'bytes_saved': 0, 'seconds_saved': 0.0}
+    try:
+        try:
+            decoded = decode_wav(data)
+        except (wave.Error, EOFError, ValueError):
+            decoded = decode_with_ffmpeg(data)
+    except Exception as e:
+        print(f"Audio decode error, uploading original audio: {e}")
+        return None, report
+    if decoded is None:
+        return None, report
+
+    samples, sample_rate = decoded
+    original_seconds = len(samples) / sample_rate
+    processed = trim_silence(downmix(samples), sample_rate)
+    output_rate = min(sample_rate, target_rate) # Never upsample
+    processed = resample(processed, sample_rate, output_rate)
+    processed_seconds = len(processed) / output_rate
+    audio = encode_wav(processed, output_rate)
+
+    report.update({
+        'original_seconds': round(original_seconds, 2),
+        'processed_seconds': round(processed_seconds, 2),
+        'seconds_saved': round(original_seconds - processed_seconds, 2),
+        'sample_rate': output_rate,
+    })
+    # Decoded compressed input can be larger as WAV; it is still worth it if Transcribe has less to listen to
+    if len(audio) >= len(data) and report['seconds_saved'] < AUDIO_MIN_SECONDS_SAVED:
+        report['seconds_saved'] = 0.0
+        return None, report
+    report['processed_bytes'] = len(audio)
+    report['bytes_saved'] = len(data) - len(audio)
+    return audio, report
+
+
+def pcm16_to_mulaw(data: bytes) -> bytes:
+    """Companded G.711 mu-law encoding of 16-bit little-endian PCM, one byte per sample."""
+    # Works on the 14-bit magnitude like the reference implementation, so results match bit for bit
+    samples = np.frombuffer(data[:len(data) - len(data) % 2], dtype='<i2').astype(np.int32) >> 2
+    sign = (samples < 0).astype(np.int32) << 7
+    magnitude = np.minimum(np.abs(samples), 8158) + 0x21
+    exponent = np.clip(np.floor(np.log2(magnitude)).astype(np.int32) - 5, 0, 7)
+    mantissa = (magnitude >> (exponent + 1)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
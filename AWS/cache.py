@@ -2,30 +2,84 @@ import redis
 import hashlib
 import os
 import json
+import weakref
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
 import numpy as np
+from embedding_service import EMBEDDING_SERVICE_SOCKET, EmbeddingClient
 from redis.commands.search.query import Query
 from redis.commands.search.field import VectorField, TagField, TextField
 from redis.commands.search.index_definition import IndexDefinition, IndexType
 
 load_dotenv()  # Load environment variables
 
+_embedding_models = {}
+_redis_clients = weakref.WeakSet() # Every client made by create_redis_client, for reset_connections_after_fork
+
+def load_embedding_model(model_name: str):
+    """
+    The shared embedding service if EMBEDDING_SERVICE_SOCKET is set, otherwise a model in this
+    process. Loaded once per process and name, so every index using a model shares one copy.
+    """
+    if model_name not in _embedding_models:
+        if EMBEDDING_SERVICE_SOCKET:
+            print(f"Using embedding service at {EMBEDDING_SERVICE_SOCKET} for '{model_name}'")
+            _embedding_models[model_name] = EmbeddingClient(EMBEDDING_SERVICE_SOCKET, model_name)
+        else:
+            # Imported here so that processes using the embedding service do not need torch
+            from sentence_transformers import SentenceTransformer
+            _embedding_models[model_name] = SentenceTransformer(model_name)
+    return _embedding_models[model_name]
+
+SPEECH_CACHE_TTL = int(os.getenv('SPEECH_CACHE_TTL', 86400)) # Synthesized audio expires after a day by default
+# Multilingual model for the native-language cache, e.g. 'paraphrase-multilingual-MiniLM-L12-v2'; unset disables it
+NATIVE_CACHE_MODEL = os.getenv('NATIVE_CACHE_MODEL')
+NATIVE_CACHE_DISTANCE_THRESHOLD = float(os.getenv('NATIVE_CACHE_DISTANCE_THRESHOLD', 0.15))
+
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+
+def create_redis_client(**kwargs) -> redis.Redis:
+    """A client for the Redis server in REDIS_HOST/REDIS_PORT/REDIS_DB."""
+    kwargs.setdefault('socket_timeout', float(os.getenv('REDIS_SOCKET_TIMEOUT', 2))) # Never let a stuck Redis pin a request
+    kwargs.setdefault('socket_connect_timeout', float(os.getenv('REDIS_SOCKET_TIMEOUT', 2)))
+    client = redis.Redis(
+        host=os.getenv('REDIS_HOST'),
+        port=int(os.getenv('REDIS_PORT')),
+        db=int(os.getenv('REDIS_DB')),
+        **kwargs
+    )
+    _redis_clients.add(client)
+    return client
+
+def reset_connections_after_fork():
+    """
+    Drops the Redis and embedding service connections a forked worker inherited from its parent,
+    without closing them for the parent. The clients reconnect on their next use.
+    """
+    for client in list(_redis_clients):
+        client.connection_pool.reset()
+    for model in _embedding_models.values():
+        if isinstance(model, EmbeddingClient):
+            model.reset()
+
 class RedisCache:
-    def __init__(self, embedding_model_name: str = 'all-MiniLM-L6-v2', distance_threshold: float = 0.2): # Adjusted default threshold
+    def __init__(self, embedding_model_name: str = EMBEDDING_MODEL, distance_threshold: float = 0.2, # Adjusted default threshold
+                 native_model_name: str = NATIVE_CACHE_MODEL, native_distance_threshold: float = NATIVE_CACHE_DISTANCE_THRESHOLD):
         print(f"REDIS_HOST: {os.getenv('REDIS_HOST')}")
-        self.redis = redis.Redis(
-            host=os.getenv('REDIS_HOST'),
-            port=int(os.getenv('REDIS_PORT')),
-            db=int(os.getenv('REDIS_DB')),
-            decode_responses=False # Keep as bytes for vector storage
-        )
-        self.embedding_model = SentenceTransformer(embedding_model_name)
+        self.redis = create_redis_client(decode_responses=False) # Keep as bytes for vector storage
+        self.embedding_model = load_embedding_model(embedding_model_name)
         self.vector_dimension = self.embedding_model.get_sentence_embedding_dimension()
         self.distance_threshold = distance_threshold
         self.index_name = "semantic_cache_idx" # Name for your Redis search index
         self._create_redis_index()
 
+        # Optional second index over the caller's untranslated transcript
+        self.native_enabled = native_model_name is not None
+        if self.native_enabled:
+            self.native_embedding_model = load_embedding_model(native_model_name)
+            self.native_distance_threshold = native_distance_threshold
+            self.native_index_name = "native_cache_idx"
+            self._create_native_index()
+
     def _create_redis_index(self):
         """Creates a RediSearch index for vector search if it doesn't exist."""
         try:
@@ -46,6 +100,25 @@ class RedisCache:
             self.redis.ft(self.index_name).create_index(fields=schema, definition=definition)
             print(f"RediSearch index '{self.index_name}' created successfully.")
 
+    def _create_native_index(self):
+        """Creates the RediSearch index for native-language queries if it doesn't exist."""
+        try:
+            self.redis.ft(self.native_index_name).info()
+            print(f"RediSearch index '{self.native_index_name}' already exists.")
+        except:
+            schema = (
+                TextField("query"),
+                VectorField("query_vector", "FLAT", {
+                    "TYPE": "FLOAT32",
+                    "DIM": self.native_embedding_model.get_sentence_embedding_dimension(),
+                    "DISTANCE_METRIC": "COSINE"
+                }),
+                TagField("language"),
+            )
+            definition = IndexDefinition(prefix=["native:"], index_type=IndexType.HASH)
+            self.redis.ft(self.native_index_name).create_index(fields=schema, definition=definition)
+            print(f"RediSearch index '{self.native_index_name}' created successfully.")
+
     def _get_embedding(self, text: str) -> np.ndarray:
         """Generates a vector embedding for the given text."""
         return self.embedding_model.encode(text).astype(np.float32)
@@ -105,4 +178,81 @@ class RedisCache:
         })
         if ttl is not None:
             self.redis.expire(key, ttl)
-        return key
\ No newline at end of file
+        return key
+
+    def get_native_cache_key(self, query: str, language: str) -> str:
+        return f"native:{hashlib.sha256(f'{language}|{query.strip().lower()}'.encode()).hexdigest()}"
+
+    def get_native(self, query: str, language: str):
+        """
+        Looks up a query in the caller's own language. On a hit returns the English query and
+        response plus the already-translated final text; the response text and the speech
+        language and voice together locate the synthesized audio in the speech cache.
+        """
+        query_vector = self.native_embedding_model.encode(query).astype(np.float32).tobytes()
+        escaped_language = language.replace('-', '\\-')
+        q = Query(f"(@language:{{{escaped_language}}})=>[KNN 1 @query_vector $query_vec AS vector_score]")\
+            .return_fields("text_for_llm", "llm_response", "final_text", "speech_language", "voice_id", "vector_score")\
+            .sort_by("vector_score")\
+            .dialect(2)
+        search_results = self.redis.ft(self.native_index_name).search(q, query_params={"query_vec": query_vector})
+        if search_results.total == 0:
+            return None
+        top_result = search_results.docs[0]
+        if float(top_result.vector_score) > self.native_distance_threshold:
+            print(f"Native cache miss. Dissimilarity score (distance): {top_result.vector_score}")
+            return None
+        print(f"Native cache hit! Dissimilarity score (distance): {top_result.vector_score}")
+        return {
+            "text_for_llm": top_result.text_for_llm,
+            "llm_response": top_result.llm_response,
+            "final_text": top_result.final_text,
+            "speech_language": top_result.speech_language,
+            "voice_id": top_result.voice_id,
+        }
+
+    def set_native(self, query: str, language: str, text_for_llm: str, llm_response: str, final_text: str,
+                   speech_language: str, voice_id: str, ttl: int = None):
+        """Stores a native-language query with everything needed to answer it without AWS calls."""
+        key = self.get_native_cache_key(query, language)
+        self.redis.hset(key, mapping={
+            "query": query,
+            "query_vector": self.native_embedding_model.encode(query).astype(np.float32).tobytes(),
+            "language": language,
+            "text_for_llm": text_for_llm,
+            "llm_response": llm_response,
+            "final_text": final_text,
+            "speech_language": speech_language,
+            "voice_id": voice_id,
+        })
+        if ttl is not None:
+            self.redis.expire(key, ttl)
+        return key
+
+    def get_speech_cache_key(self, text: str, language: str, voice_id: str, audio_format: str = "mp3", sample_rate: str = None) -> str:
+        """Create the Redis key for synthesized speech of an (untranslated) response text in one output format."""
+        # Prefixed with "speech:" so that audio blobs are not picked up by the semantic index
+        digest = hashlib.sha256(f"{language}|{voice_id}|{audio_format}|{sample_rate or 'default'}|{text.strip()}".encode()).hexdigest()
+        return f"speech:{digest}"
+
+    def get_speech(self, text: str, language: str, voice_id: str, audio_format: str = "mp3", sample_rate: str = None):
+        """Get previously synthesized speech for a response text, or None on a miss."""
+        entry = self.redis.hgetall(self.get_speech_cache_key(text, language, voice_id, audio_format, sample_rate))
+        if not entry:
+            return None
+        return {
+            "final_text": entry[b"final_text"].decode('utf-8'),
+            "audio": entry[b"audio"]
+        }
+
+    def set_speech(self, text: str, language: str, voice_id: str, final_text: str, audio: bytes, ttl: int = SPEECH_CACHE_TTL,
+                   audio_format: str = "mp3", sample_rate: str = None):
+        """Store the translated text and synthesized audio for a response text."""
+        key = self.get_speech_cache_key(text, language, voice_id, audio_format, sample_rate)
+        self.redis.hset(key, mapping={
+            "final_text": final_text,
+            "audio": audio
+        })
+        if ttl is not None:
+            self.redis.expire(key, ttl)
+        return key
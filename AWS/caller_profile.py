@@ -0,0 +1,65 @@
+import os
+import re
+
+CALLER_MIN_CONFIRMATIONS = int(os.getenv('CALLER_MIN_CONFIRMATIONS', 2)) # Identified calls before the language is trusted
+CALLER_MIN_CONFIDENCE = float(os.getenv('CALLER_MIN_CONFIDENCE', 0.7)) # Below this the language is re-identified
+CALLER_REVERIFY_EVERY = int(os.getenv('CALLER_REVERIFY_EVERY', 20)) # Re-identify periodically even when confident
+CALLER_PROFILE_TTL = int(os.getenv('CALLER_PROFILE_TTL', 90 * 24 * 3600))
+
+
+class CallerLanguageProfiles:
+    """
+    Remembers which language each phone number speaks, so that repeat callers get a Transcribe
+    job with a fixed LanguageCode instead of the slower automatic language identification.
+    """
+
+    def __init__(self, redis_client, min_confirmations: int = CALLER_MIN_CONFIRMATIONS, min_confidence: float = CALLER_MIN_CONFIDENCE,
+                 reverify_every: int = CALLER_REVERIFY_EVERY, ttl: int = CALLER_PROFILE_TTL):
+        self.redis = redis_client
+        self.min_confirmations = min_confirmations
+        self.min_confidence = min_confidence
+        self.reverify_every = reverify_every
+        self.ttl = ttl
+
+    def get_profile_key(self, caller_number: str) -> str:
+        # Only the last 10 digits, so '+91 98765 43210' and '9876543210' share a profile
+        digits = re.sub(r'\D', '', caller_number)
+        return f"caller_lang:{digits[-10:]}"
+
+    def get_language(self, caller_number: str):
+        """Returns the caller's language if it is trusted, or None if it should be identified."""
+        if not caller_number:
+            return None
+        profile = self.redis.hgetall(self.get_profile_key(caller_number))
+        if not profile or profile.get(b"stale") == b"1":
+            return None
+        if int(profile.get(b"confirmations", 0)) < self.min_confirmations:
+            return None
+        if int(profile.get(b"calls_since_verify", 0)) >= self.reverify_every:
+            return None
+        return profile[b"language"].decode('utf-8')
+
+    def record(self, caller_number: str, language: str, confidence: float, identified: bool):
+        """
+        Updates the profile after a transcription. identified is True when Transcribe picked the
+        language itself, False when the job used the profile's language.
+        """
+        key = self.get_profile_key(caller_number)
+        if identified:
+            previous = self.redis.hget(key, "language")
+            same_language = previous is not None and previous.decode('utf-8') == language
+            confident = confidence >= self.min_confidence
+            pipe = self.redis.pipeline()
+            if same_language and confident:
+                pipe.hincrby(key, "confirmations", 1)
+            else:
+                pipe.hset(key, "confirmations", int(confident))
+            pipe.hset(key, mapping={"language": language, "confidence": confidence, "calls_since_verify": 0, "stale": 0})
+        else:
+            pipe = self.redis.pipeline()
+            pipe.hincrby(key, "calls_since_verify", 1)
+            pipe.hset(key, mapping={"confidence": confidence, "stale": int(confidence < self.min_confidence)})
+            if confidence < self.min_confidence:
+                print(f"Low transcription confidence ({confidence:.2f}) for {language}, re-identifying caller language next time.")
+        pipe.expire(key, self.ttl)
+        pipe.execute()
@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+EMBEDDING_SERVICE_SOCKET = os.getenv('EMBEDDING_SERVICE_SOCKET') # Unset: every process loads its own model
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', 5)) # How long a batch waits for more requests
+EMBEDDING_MAX_BATCH = int(os.getenv('EMBEDDING_MAX_BATCH', 64))
+EMBEDDING_CLIENT_TIMEOUT = float(os.getenv('EMBEDDING_CLIENT_TIMEOUT', 5))
+EMBEDDING_SERVICE_STARTUP_TIMEOUT = float(os.getenv('EMBEDDING_SERVICE_STARTUP_TIMEOUT', 120)) # The service binds its socket once models are loaded
+
+# Wire format, both directions: 4-byte big-endian length, then the payload.
+# Request payload: JSON {"model": name, "texts": [...]} or {"model": name, "op": "dimension"}.
+# Response payload: JSON header line {"rows": n, "dim": d} or {"error": message}, then n*d float32 values.
+
+
+def send_message(sock, payload: bytes):
+    sock.sendall(struct.pack('>I', len(payload)) + payload)
+
+
+def recv_exactly(sock, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Embedding service connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock) -> bytes:
+    (size,) = struct.unpack('>I', recv_exactly(sock, 4))
+    return recv_exactly(sock, size)
+
+
+class MicroBatcher:
+    """
+    Collects encode requests from many connections for up to window seconds (or max_batch texts)
+    and encodes them with one model call per model, so concurrent queries share a forward pass.
+    """
+
+    def __init__(self, window: float = EMBEDDING_BATCH_WINDOW_MS / 1000, max_batch: int = EMBEDDING_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.models = {}
+        self._models_lock = threading.Lock()
+        self.stats = {'requests': 0, 'batches': 0, 'texts': 0}
+        threading.Thread(target=self._run, name='embedding-batcher', daemon=True).start()
+
+    def model(self, name: str):
+        with self._models_lock:
+            if name not in self.models:
+                from sentence_transformers import SentenceTransformer
+                print(f"Loading embedding model '{name}'")
+                self.models[name] = SentenceTransformer(name)
+            return self.models[name]
+
+    def encode(self, model_name: str, texts: list) -> np.ndarray:
+        """Queues texts for the next batch and blocks until their vectors are ready."""
+        request = {'model': model_name, 'texts': texts, 'done': threading.Event()}
+        self.requests.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['vectors']
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        texts = len(batch[0]['texts'])
+        deadline = time.monotonic() + self.window
+        while texts < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            texts += len(request['texts'])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            by_model = {}
+            for request in batch:
+                by_model.setdefault(request['model'], []).append(request)
+            for model_name, requests in by_model.items():
+                try:
+                    texts = [text for request in requests for text in request['texts']]
+                    vectors = self.model(model_name).encode(texts, batch_size=len(texts)).astype(np.float32)
+                    offset = 0
+                    for request in requests:
+                        request['vectors'] = vectors[offset:offset + len(request['texts'])]
+                        offset += len(request['texts'])
+                except Exception as e:
+                    for request in requests:
+                        request['error'] = e
+                for request in requests:
+                    request['done'].set()
+                self.stats['requests'] += len(requests)
+                self.stats['batches'] += 1
+                self.stats['texts'] += sum(len(request['texts']) for request in requests)
+
+
+class EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """Serves requests on one connection until the client disconnects."""
+
+    def handle(self):
+        batcher = self.server.batcher
+        while True:
+            try:
+                request = json.loads(recv_message(self.request))
+            except (ConnectionError, struct.error):
+                return
+            try:
+                if request.get('op') == 'dimension':
+                    dimension = batcher.model(request['model']).get_sentence_embedding_dimension()
+                    send_message(self.request, json.dumps({'rows': 0, 'dim': dimension}).encode() + b'\n')
+                    continue
+                vectors = batcher.encode(request['model'], request['texts'])
+                header = json.dumps({'rows': vectors.shape[0], 'dim': vectors.shape[1]}).encode()
+                send_message(self.request, header + b'\n' + vectors.tobytes())
+            except Exception as e:
+                send_message(self.request, json.dumps({'error': str(e)}).encode() + b'\n')
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, batcher: MicroBatcher):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, EmbeddingRequestHandler)
+        os.chmod(socket_path, 0o666)
+        self.batcher = batcher
+
+
+class EmbeddingClient:
+    """
+    Stand-in for a SentenceTransformer that encodes through the shared embedding service.
+    Each thread keeps its own connection to the socket and reconnects once if it drops.
+    Connections are tagged with the pid that opened them, so a worker forked from a process
+    that already used the client (e.g. the gunicorn master) opens its own instead of sharing
+    the parent's socket.
+    """
+
+    def __init__(self, socket_path: str, model_name: str, timeout: float = EMBEDDING_CLIENT_TIMEOUT):
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.timeout = timeout
+        self._local = threading.local()
+        self._dimension = None
+
+    def _connection(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            # Inherited through fork: closing our copy leaves the parent's connection open
+            self._close()
+            self._local.pid = os.getpid()
+        if self._local.sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return self._local.sock
+
+    def _close(self):
+        if getattr(self._local, 'sock', None) is not None:
+            self._local.sock.close()
+        self._local.sock = None
+
+    def reset(self):
+        """Forgets every thread's connection; each thread reconnects on its next request."""
+        self._close()
+        self._local = threading.local()
+
+    def _request(self, request: dict):
+        payload = json.dumps(request).encode()
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                send_message(sock, payload)
+                response = recv_message(sock)
+                break
+            except (OSError, ConnectionError):
+                self._close()
+                if attempt:
+                    raise
+        header, _, body = response.partition(b'\n')
+        header = json.loads(header)
+        if 'error' in header:
+            raise RuntimeError(f"Embedding service error: {header['error']}")
+        return header, body
+
+    def encode(self, texts, **kwargs) -> np.ndarray:
+        """Same shapes as SentenceTransformer.encode: a vector for a string, a matrix for a list."""
+        single = isinstance(texts, str)
+        if not single and len(texts) == 0:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        header, body = self._request({'model': self.model_name, 'texts': [texts] if single else list(texts)})
+        vectors = np.frombuffer(body, dtype=np.float32).reshape(header['rows'], header['dim'])
+        if kwargs.get('normalize_embeddings'):
+            vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors[0] if single else vectors
+
+    def get_sentence_embedding_dimension(self, startup_timeout: float = EMBEDDING_SERVICE_STARTUP_TIMEOUT) -> int:
+        """Asked once at startup, so it waits up to startup_timeout for the service to come up."""
+        deadline = time.monotonic() + startup_timeout
+        while self._dimension is None:
+            try:
+                header, _ = self._request({'model': self.model_name, 'op': 'dimension'})
+                self._dimension = header['dim']
+            except OSError as e:
+                if time.monotonic() >= deadline:
+                    raise
+                print(f"Waiting for embedding service at {self.socket_path}: {e}")
+                time.sleep(1)
+        return self._dimension
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared micro-batching SentenceTransformer service on a Unix socket.")
+    parser.add_argument('--socket', default=EMBEDDING_SERVICE_SOCKET or '/tmp/embedding.sock')
+    parser.add_argument('--preload', nargs='*', default=['all-MiniLM-L6-v2'], help="Models to load before accepting requests")
+    args = parser.parse_args()
+
+    batcher = MicroBatcher()
+    for model_name in args.preload:
+        batcher.model(model_name)
+    server = EmbeddingServer(args.socket, batcher)
+    print(f"Embedding service listening on {args.socket} (batch window {batcher.window * 1000:.0f} ms, max batch {batcher.max_batch})")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import os
+import re
+import threading
+
+import numpy as np
+
+INTENT_ROUTER = os.getenv('INTENT_ROUTER', 'true').lower() == 'true'
+INTENT_ROUTER_MIN_MARGIN = float(os.getenv('INTENT_ROUTER_MIN_MARGIN', 0.05)) # Sell examples must beat the others by this much
+
+# Utterances the classifier compares against: one set for "list this item", one for everything
+# that merely mentions selling, prices or quantities
+SELL_EXAMPLES = [
+    "sell 50 kg tomatoes at 30 rupees",
+    "I want to sell onions for 20 rupees per kg",
+    "list my wheat for 2000 rupees per quintal",
+    "I am selling 10 dozen bananas at 40 rupees a dozen",
+    "put 100 kg potatoes for sale at 15 rupees",
+]
+OTHER_EXAMPLES = [
+    "what is the price of tomatoes today",
+    "should I sell my onions now or wait",
+    "how do I grow rice",
+    "I want to buy 20 kg potatoes",
+    "delete my listing",
+    "where can I sell wheat for a good price",
+    "my crop has yellow leaves, what should I do",
+]
+
+UNITS = r"kg|kgs|kilo|kilos|kilogram|kilograms|quintal|quintals|ton|tons|tonne|tonnes|dozen|litre|litres|liter|liters|piece|pieces|bag|bags"
+NUMBER = r"\d+(?:[.,]\d+)?"
+
+SELL_PATTERN = re.compile(r"\b(?:sell|selling|sale|list my|put up)\b")
+# Questions, negations and buying are left to the LLM
+REJECT_PATTERN = re.compile(
+    r"\?|^(?:can|could|would|will|is|are|do|does)\b"
+    r"|\b(?:what|how|why|when|where|which|should|don't|do not|not|never|buy|buying|delete|remove)\b"
+)
+PRICE_PATTERN = re.compile(
+    rf"(?:(?:rs\.?|inr|₹)\s*(?P<prefixed>{NUMBER})|(?P<suffixed>{NUMBER})\s*(?:rs\b\.?|rupees?\b|₹|/-))"
+    rf"(?:\s*(?:per|a|an|/|each)\s*(?P<per_unit>{UNITS})\b)?"
+)
+QUANTITY_PATTERN = re.compile(rf"(?P<quantity>{NUMBER})\s*(?P<unit>{UNITS})\b")
+ITEM_PATTERN = re.compile(
+    rf"\b(?:sell|selling|list my|put up)\s+(?:my\s+|the\s+|some\s+)?(?:{NUMBER}\s*(?:{UNITS})\s+(?:of\s+)?)?(?:my\s+)?"
+    rf"(?P<item>[a-z][a-z ]{{1,40}}?)\s+(?:at|for|@|in|price|rs\b|₹)"
+)
+
+
+def to_number(value: str) -> float:
+    return float(value.replace(',', ''))
+
+
+def extract_listing(text: str):
+    """
+    Pulls add_listing arguments out of an English sell request with regexes. Returns a dict with
+    item_name, price, quantity and unit, or None if any required slot is missing or ambiguous.
+    """
+    text = text.lower().strip()
+    if not SELL_PATTERN.search(text) or REJECT_PATTERN.search(text):
+        return None
+    prices = list(PRICE_PATTERN.finditer(text))
+    item = ITEM_PATTERN.search(text)
+    if len(prices) != 1 or item is None:
+        return None
+    price = prices[0]
+    # The quantity is a number with a unit that is not part of the price ("30 rupees per kg")
+    quantities = [match for match in QUANTITY_PATTERN.finditer(text) if not (price.start() <= match.start() < price.end())]
+    if len(quantities) > 1:
+        return None
+    item_name = re.sub(r"\s+", " ", item.group('item')).strip()
+    if item_name in ('it', 'this', 'that', 'them'):
+        return None
+    return {
+        'item_name': item_name,
+        'price': to_number(price.group('prefixed') or price.group('suffixed')),
+        'quantity': to_number(quantities[0].group('quantity')) if quantities else None,
+        'unit': quantities[0].group('unit') if quantities else None,
+        'price_unit': price.group('per_unit'),
+    }
+
+
+class IntentRouter:
+    """
+    Answers simple marketplace commands without the LLM: if the regex slots for an add_listing
+    call are all filled (and, when an embedding function is given, the utterance is closer to the
+    sell examples than to the other examples), it returns the tool call to make. Everything else
+    returns None and goes to the LLM.
+    """
+
+    def __init__(self, embed=None, min_margin: float = INTENT_ROUTER_MIN_MARGIN):
+        """embed(texts) returns one embedding row per text, e.g. a SentenceTransformer's encode."""
+        self.embed = embed
+        self.min_margin = min_margin
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'routed': 0, 'no_slots': 0, 'no_contact': 0, 'classifier_rejected': 0}
+        self._examples = None
+        if embed is not None:
+            self._examples = (self._normalized(SELL_EXAMPLES), self._normalized(OTHER_EXAMPLES))
+
+    def _normalized(self, texts):
+        vectors = np.asarray(self.embed(texts), dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def sell_margin(self, text: str) -> float:
+        """How much closer text is to the nearest sell example than to the nearest other example."""
+        sell_examples, other_examples = self._examples
+        vector = self._normalized([text])[0]
+        return float((sell_examples @ vector).max() - (other_examples @ vector).max())
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats[outcome] += 1
+
+    def route(self, text: str, seller_contact: str = None, seller_name: str = None):
+        """Returns (tool_name, tool_args) for a confident match, otherwise None."""
+        listing = extract_listing(text)
+        if listing is None:
+            self._count('no_slots')
+            return None
+        if not seller_contact:
+            # The marketplace requires a contact; without the caller's number the LLM has to ask for it
+            self._count('no_contact')
+            return None
+        if self._examples is not None and self.sell_margin(text) < self.min_margin:
+            self._count('classifier_rejected')
+            return None
+        self._count('routed')
+        description = ""
+        if listing['quantity'] is not None:
+            description = f"{listing['quantity']:g} {listing['unit']} of {listing['item_name']}"
+        if listing['price_unit']:
+            description = f"{description}, {listing['price']:g} rupees per {listing['price_unit']}".lstrip(', ')
+        return 'add_listing', {
+            'item_name': listing['item_name'],
+            'price': listing['price'],
+            'seller_name': seller_name,
+            'seller_contact': seller_contact,
+            'description': description,
+        }
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['hit_rate'] = round(stats['routed'] / stats['requests'], 3) if stats['requests'] else 0.0
+        return stats
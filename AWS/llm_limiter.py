@@ -0,0 +1,261 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from openai import RateLimitError
+
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8)) # In-flight Gemini calls per process
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', 32)) # Callers allowed to wait for a slot before we reject
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 10)) # Seconds a caller may wait for a slot and a token
+LLM_RATE_PER_SECOND = float(os.getenv('LLM_RATE_PER_SECOND', 4)) # Shared across every node using the same Redis
+LLM_BURST = int(os.getenv('LLM_BURST', 10))
+LLM_QUOTA_COOLDOWN = float(os.getenv('LLM_QUOTA_COOLDOWN', 5)) # Seconds all nodes back off after a 429
+
+# Refills and takes one token atomically. Uses the Redis clock so that nodes with skewed clocks
+# share one consistent bucket. Returns the seconds to wait before retrying (0 when a token was taken).
+TOKEN_BUCKET_SCRIPT = """
+local cooldown = redis.call('PTTL', KEYS[2])
+if cooldown > 0 then
+    return tostring(cooldown / 1000)
+end
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class LLMRateLimited(Exception):
+    """Raised when an LLM call is rejected by admission control or the provider's quota."""
+
+
+class TokenBucket:
+    def __init__(self, redis_client, rate: float = LLM_RATE_PER_SECOND, capacity: int = LLM_BURST, name: str = "llm_limiter"):
+        self.redis = redis_client
+        self.rate = rate
+        self.capacity = capacity
+        self.bucket_key = f"{name}:bucket"
+        self.cooldown_key = f"{name}:cooldown"
+        self._script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self) -> float:
+        """Takes a token. Returns 0 on success, otherwise the seconds to wait before trying again."""
+        try:
+            return float(self._script(keys=[self.bucket_key, self.cooldown_key], args=[self.rate, self.capacity]))
+        except Exception as e:
+            # Redis being down must not take the LLM down with it; the per-process cap still applies
+            print(f"Token bucket unavailable, admitting call: {e}")
+            return 0.0
+
+    def cool_down(self, seconds: float):
+        """Makes every node wait before the next call, e.g. after the provider returned a 429."""
+        try:
+            self.redis.set(self.cooldown_key, 1, px=int(seconds * 1000))
+        except Exception as e:
+            print(f"Failed to set token bucket cooldown: {e}")
+
+
+class _AsyncWaiter:
+    """A queued async caller. Like threading.Event, set() may be called from any thread."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self._set = False
+
+    def set(self) -> bool:
+        try:
+            self.loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            return False # The loop is closed, so nobody is waiting any more
+        self._set = True
+        return True
+
+    def _wake(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def is_set(self) -> bool:
+        return self._set
+
+
+class LLMLimiter:
+    """
+    Admission control for LLM calls: a per-process concurrency cap with a bounded wait queue
+    (priority callers are served first) and an optional Redis token bucket shared across nodes.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, bucket: TokenBucket = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.bucket = bucket
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = {True: deque(), False: deque()} # priority -> waiting events (or _AsyncWaiters)
+        self._counters = {"served": 0, "queued": 0, "rejected": 0, "quota_errors": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _enqueue(self, priority: bool, new_waiter):
+        """Takes a free slot and returns None, or queues and returns new_waiter() to be set when a slot is handed over."""
+        with self._lock:
+            waiting = len(self._waiters[True]) + len(self._waiters[False])
+            # Normal callers may not overtake anyone; priority callers only queue behind other priority callers
+            ahead = len(self._waiters[True]) if priority else waiting
+            if self._active < self.max_concurrency and ahead == 0:
+                self._active += 1
+                return None
+            if waiting >= self.max_queue:
+                self._counters["rejected"] += 1
+                raise LLMRateLimited("LLM wait queue is full")
+            waiter = new_waiter()
+            self._waiters[priority].append(waiter)
+            self._counters["queued"] += 1
+            return waiter
+
+    def _stop_waiting(self, priority: bool, waiter) -> bool:
+        """Dequeues a waiter that gave up. Returns True if it was handed a slot just before."""
+        with self._lock:
+            if waiter.is_set():
+                return True
+            self._waiters[priority].remove(waiter)
+            self._counters["rejected"] += 1
+            return False
+
+    def _acquire_slot(self, priority: bool, deadline: float):
+        event = self._enqueue(priority, threading.Event)
+        if event is None or event.wait(max(0.0, deadline - time.monotonic())):
+            return # A free slot, or the releasing caller handed its slot over to us
+        if not self._stop_waiting(priority, event):
+            raise LLMRateLimited("Timed out waiting for an LLM slot")
+
+    async def _async_acquire_slot(self, priority: bool, deadline: float):
+        """Like _acquire_slot, but the caller waits on the event loop instead of holding a thread."""
+        loop = asyncio.get_running_loop()
+        waiter = self._enqueue(priority, lambda: _AsyncWaiter(loop))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            if not self._stop_waiting(priority, waiter):
+                raise LLMRateLimited("Timed out waiting for an LLM slot")
+        except asyncio.CancelledError:
+            if self._stop_waiting(priority, waiter):
+                self._release_slot() # Pass on the slot we were handed
+            raise
+
+    def _release_slot(self):
+        with self._lock:
+            for priority in (True, False):
+                while self._waiters[priority]:
+                    if self._waiters[priority].popleft().set() is not False:
+                        return
+            self._active -= 1
+
+    def _take_token(self, deadline: float):
+        while self.bucket is not None and (wait := self.bucket.take()) > 0:
+            if time.monotonic() + wait > deadline:
+                self._count("rejected")
+                raise LLMRateLimited("LLM rate limit exceeded")
+            time.sleep(wait)
+
+    async def _async_take_token(self, deadline: float):
+        while self.bucket is not None and (wait := await asyncio.to_thread(self.bucket.take)) > 0:
+            if time.monotonic() + wait > deadline:
+                self._count("rejected")
+                raise LLMRateLimited("LLM rate limit exceeded")
+            await asyncio.sleep(wait)
+
+    def acquire(self, priority: bool = False):
+        """Blocks until the caller may make an LLM call, or raises LLMRateLimited."""
+        deadline = time.monotonic() + self.queue_timeout
+        self._acquire_slot(priority, deadline)
+        try:
+            self._take_token(deadline)
+        except BaseException:
+            self._release_slot()
+            raise
+
+    async def async_acquire(self, priority: bool = False):
+        """Async variant of acquire(); queued callers wait on the event loop, not in a thread."""
+        deadline = time.monotonic() + self.queue_timeout
+        await self._async_acquire_slot(priority, deadline)
+        try:
+            await self._async_take_token(deadline)
+        except BaseException:
+            self._release_slot()
+            raise
+
+    def release(self):
+        self._release_slot()
+
+    @contextmanager
+    def slot(self, priority: bool = False):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _on_quota_error(self, e: RateLimitError):
+        self._count("quota_errors")
+        retry_after = None
+        if getattr(e, 'response', None) is not None:
+            retry_after = e.response.headers.get('retry-after')
+        if self.bucket is not None:
+            self.bucket.cool_down(float(retry_after) if retry_after else LLM_QUOTA_COOLDOWN)
+        return LLMRateLimited(f"LLM quota exceeded: {e}")
+
+    def call(self, create, priority: bool = False, **kwargs):
+        """Runs create(**kwargs), e.g. client.chat.completions.create, under admission control."""
+        with self.slot(priority):
+            try:
+                response = create(**kwargs)
+            except RateLimitError as e:
+                raise self._on_quota_error(e) from e
+        self._count("served")
+        return response
+
+    async def async_call(self, create, priority: bool = False, **kwargs):
+        """Async variant of call() for AsyncOpenAI; waiting for a slot does not block the event loop."""
+        await self.async_acquire(priority)
+        try:
+            response = await create(**kwargs)
+        except RateLimitError as e:
+            raise self._on_quota_error(e) from e
+        finally:
+            self.release()
+        self._count("served")
+        return response
+
+    def metrics(self):
+        """Returns counters for served, queued, rejected and quota-failed calls plus current load."""
+        with self._lock:
+            return {
+                **self._counters,
+                "active": self._active,
+                "waiting": len(self._waiters[True]) + len(self._waiters[False]),
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue
+            }
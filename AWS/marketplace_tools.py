@@ -5,9 +5,15 @@ from openai import OpenAI
 import os
 from dotenv import load_dotenv
 import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from resilience import DEPENDENCY_TIMEOUTS, CircuitOpen, DeadlineExceeded, guarded_call
 
 try:
-	from database_logic import create_listing_in_db, remove_listing_from_db
+	from database_logic import bulk_create_listings_in_db, create_listing_in_db, create_listings_in_db, remove_listing_from_db, validate_listing
 except ImportError:
 	print("Skipped database_logic module import")
 
@@ -17,6 +23,15 @@ FLASK_SERVER_BASE_URL = os.getenv('FLASK_SERVER_BASE_URL')
 
 print(f"FLASK_SERVER_BASE_URL: {FLASK_SERVER_BASE_URL}")
 
+MARKETPLACE_POOL_SIZE = int(os.getenv('MARKETPLACE_POOL_SIZE', 20)) # Keep-alive connections to the marketplace server
+MARKETPLACE_RETRIES = int(os.getenv('MARKETPLACE_RETRIES', 2))
+MARKETPLACE_RETRY_BACKOFF = float(os.getenv('MARKETPLACE_RETRY_BACKOFF', 0.2)) # Seconds, doubled on every retry
+TOOL_CALL_THREADS = int(os.getenv('TOOL_CALL_THREADS', 8)) # Tool calls of one response run concurrently
+TOOL_CALL_TIMEOUT = float(os.getenv('TOOL_CALL_TIMEOUT', 10)) # Seconds each tool call may take
+
+# Errors that mean the marketplace server could not be reached in time
+MARKETPLACE_ERRORS = (requests.exceptions.RequestException, CircuitOpen, DeadlineExceeded)
+
 def add_listing(item_name: str, price: float, seller_name: str, seller_contact: str, description: str = ""):
 	"""Makes an API call to add a new item listing to the marketplace."""
 	print(f"\n--- Making API Call: add_listing ---")
@@ -33,49 +48,153 @@ def delete_listing(listing_id: str):
 	print(f"\n--- Making API Call: delete_listing ---")
 	return remove_listing_from_db(listing_id)
 
+def add_listings(listings: list):
+	"""
+	Adds several listings (dicts of add_listing arguments) with one database transaction for the
+	valid ones. Each listing is validated first, so an invalid one only fails itself, as it would
+	as a separate call. Returns one result per listing in input order.
+	"""
+	print(f"\n--- Making API Call: add_listings ({len(listings)} listings) ---")
+	results = [None] * len(listings)
+	valid = []
+	for index, listing in enumerate(listings):
+		error = validate_listing(listing)
+		if error:
+			results[index] = {"status": "error", "message": error}
+		else:
+			valid.append(index)
+	if valid:
+		for index, result in zip(valid, create_listings_in_db([listings[index] for index in valid])):
+			results[index] = result
+	return results
+
+def bulk_add_listings(listings: list):
+	"""Validates and adds a whole batch of listings in one database transaction, all or none."""
+	print(f"\n--- Making API Call: bulk_add_listings ({len(listings)} listings) ---")
+	return bulk_create_listings_in_db(listings)
+
+class MarketplaceClient:
+	"""
+	HTTP client for the marketplace server. Calls share one keep-alive session whose connection
+	pool holds up to pool_size connections, so repeated tool calls skip the TCP handshake.
+	Connection failures are retried with backoff for every call, 502/503/504 responses only for
+	idempotent (GET) calls, since a retried POST could create a listing twice. Reads are not
+	retried: every call runs under guarded_call's timeout, which a second read could not fit
+	in, so the connect timeout is sized for all connection attempts to fit as well.
+	"""
+
+	def __init__(self, base_url: str = FLASK_SERVER_BASE_URL, pool_size: int = MARKETPLACE_POOL_SIZE, timeout: float = DEPENDENCY_TIMEOUTS['marketplace'],
+				 retries: int = MARKETPLACE_RETRIES, backoff_factor: float = MARKETPLACE_RETRY_BACKOFF):
+		self.base_url = base_url
+		backoff = sum(backoff_factor * 2 ** attempt for attempt in range(retries))
+		self.timeout = (min(2, max(0.1, (timeout - backoff) / (retries + 1))), timeout) # (connect, read)
+		self.session = requests.Session()
+		retry = Retry(
+			total=retries, connect=retries, read=0, status=retries, backoff_factor=backoff_factor,
+			status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET']), raise_on_status=False
+		)
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+		# Batch calls fan out on their own pool, sized to the connection pool
+		self.batch_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='marketplace')
+
+	def request(self, name: str, method: str, path: str, **kwargs):
+		url = f"{self.base_url}{path}"
+		try:
+			response = guarded_call('marketplace', self.session.request, method, url, timeout=self.timeout, **kwargs)
+			response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+			return response.json()
+		except requests.exceptions.HTTPError as e:
+			# Results the server rejected with a status of their own (not_found, invalid) are passed on
+			try:
+				result = e.response.json()
+			except ValueError:
+				result = None
+			if isinstance(result, dict) and 'status' in result:
+				return result
+			print(f"Error calling {name} API: {e}")
+			return {"status": "error", "message": str(e)}
+		except MARKETPLACE_ERRORS as e:
+			print(f"Error calling {name} API: {e}")
+			return {"status": "error", "message": str(e)}
+
+	def add_listing(self, item_name: str, price: float, seller_name: str, seller_contact: str, description: str = ""):
+		"""Adds a new item listing to the marketplace."""
+		print(f"\n--- Making API Call: add_listing ---")
+		payload = {
+			"item_name": item_name,
+			"price": price,
+			"description": description,
+			"seller_name" : seller_name,
+			"seller_contact" : seller_contact,
+		}
+		return self.request("add_listing", "POST", "/add_listing", json=payload)
+
+	def bulk_add_listings(self, listings: list):
+		"""Adds a batch of listings in one request and one transaction on the server, all or none."""
+		print(f"\n--- Making API Call: bulk_add_listings ({len(listings)} listings) ---")
+		return self.request("bulk_add_listings", "POST", "/bulk_add_listings", json={"listings": listings})
+
+	def delete_listing(self, listing_id: str):
+		"""Deletes an item listing from the marketplace."""
+		print(f"\n--- Making API Call: delete_listing ---")
+		return self.request("delete_listing", "POST", "/delete_listing", json={"listing_id": listing_id})
+
+	def get_all_listings(self):
+		"""Retrieves all active item listings."""
+		print(f"\n--- Making API Call: get_all_listings ---")
+		return self.request("get_all_listings", "GET", "/get_all_listings")
+
+	def search_listings(self, query: str, limit: int = 20):
+		"""Finds active listings by an approximate item name, best match first."""
+		print(f"\n--- Making API Call: search_listings ---")
+		return self.request("search_listings", "GET", "/search_listings", params={"q": query, "limit": limit})
+
+	def add_listings(self, listings: list):
+		"""
+		Adds several listings (dicts of add_listing arguments) with one /bulk_add_listings request.
+		Returns one result per listing in input order; if any listing is invalid, none are added.
+		"""
+		result = self.bulk_add_listings(listings)
+		if result.get("status") == "success":
+			return [{
+				"status": "success",
+				"message": f"Listing for '{listing['item_name']}' added.",
+				"listing_id": listing_id
+			} for listing, listing_id in zip(listings, result['listing_ids'])]
+		errors = {error['index']: error['message'] for error in result.get("errors", [])}
+		message = result.get("message", "Listings could not be added")
+		return [
+			{"status": "error", "message": errors[index] if index in errors else f"Not added: {message}"}
+			for index in range(len(listings))
+		]
+
+	def delete_listings(self, listing_ids: list):
+		"""Deletes several listings concurrently; results are in input order."""
+		return list(self.batch_executor.map(self.delete_listing, listing_ids))
+
+marketplace_client = MarketplaceClient()
+
 def add_listing_api(item_name: str, price: float, seller_name: str, seller_contact: str, description: str = ""):
 	"""Makes an API call to add a new item listing to the marketplace."""
-	print(f"\n--- Making API Call: add_listing ---")
-	url = f"{FLASK_SERVER_BASE_URL}/add_listing"
-	payload = {
-		"item_name": item_name,
-		"price": price,
-		"description": description,
-		"seller_name" : seller_name,
-		"seller_contact" : seller_contact,
-	}
-	try:
-		response = requests.post(url, json=payload)
-		response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-		return response.json()
-	except requests.exceptions.RequestException as e:
-		print(f"Error calling add_listing API: {e}")
-		return {"status": "error", "message": str(e)}
+	return marketplace_client.add_listing(item_name, price, seller_name, seller_contact, description)
+
+def bulk_add_listings_api(listings: list):
+	"""Makes an API call to add a batch of listings to the marketplace."""
+	return marketplace_client.bulk_add_listings(listings)
 
 def delete_listing_api(listing_id: str):
 	"""Makes an API call to delete an item listing from the marketplace."""
-	print(f"\n--- Making API Call: delete_listing ---")
-	url = f"{FLASK_SERVER_BASE_URL}/delete_listing"
-	payload = {"listing_id": listing_id}
-	try:
-		response = requests.post(url, json=payload)
-		response.raise_for_status()
-		return response.json()
-	except requests.exceptions.RequestException as e:
-		print(f"Error calling delete_listing API: {e}")
-		return {"status": "error", "message": str(e)}
+	return marketplace_client.delete_listing(listing_id)
 
 def get_all_listings_api():
 	"""Makes an API call to retrieve all active item listings."""
-	print(f"\n--- Making API Call: get_all_listings ---")
-	url = f"{FLASK_SERVER_BASE_URL}/get_all_listings"
-	try:
-		response = requests.get(url)
-		response.raise_for_status()
-		return response.json()
-	except requests.exceptions.RequestException as e:
-		print(f"Error calling get_all_listings API: {e}")
-		return {"status": "error", "message": str(e)}
+	return marketplace_client.get_all_listings()
+
+def search_listings_api(query: str, limit: int = 20):
+	"""Makes an API call to search active listings by item name."""
+	return marketplace_client.search_listings(query, limit)
 
 
 tools = [
@@ -118,6 +237,36 @@ tools = [
 	  }
 	}
   },
+  {
+	"type": "function",
+	"function": {
+	  "name": "bulk_add_listings",
+	  "description": "Adds many item listings of the same seller at once, e.g. a whole inventory. Either all of them are added or none.",
+	  "parameters": {
+		"type": "object",
+		"properties": {
+		  "listings": {
+			"type": "array",
+			"description": "The listings to add.",
+			"items": {
+			  "type": "object",
+			  "properties": {
+				"item_name": {"type": "string", "description": "The name of the item to be listed."},
+				"price": {"type": "number", "description": "The price of the item."},
+				"seller_name": {"type": "string", "description": "Seller's name", "nullable": True},
+				"seller_contact": {"type": "string", "description": "Seller's 10 digit phone number without any prefix."},
+				"description": {"type": "string", "description": "A detailed description of the item.", "nullable": True}
+			  },
+			  "required": ["item_name", "price", "seller_contact"]
+			}
+		  }
+		},
+		"required": [
+		  "listings"
+		]
+	  }
+	}
+  },
   {
 	"type": "function",
 	"function": {
@@ -140,25 +289,32 @@ tools = [
 ]
 
 
+# Words that suggest the farmer wants to buy, sell or manage a listing. Such requests are likely
+# to end in a tool call, so they get the priority path of the LLM limiter.
+MARKETPLACE_KEYWORDS = ('sell', 'buy', 'listing', 'list my', 'order', 'price', 'rupee', 'rs ', 'delete', 'remove', 'kg')
+
+def is_marketplace_request(text: str):
+	"""Returns True if the query looks like a marketplace transaction rather than a general question."""
+	text = f"{text.lower()} "
+	return any(keyword in text for keyword in MARKETPLACE_KEYWORDS)
+
 # --- Map tool names (strings) to their corresponding API client functions ---
 available_tools = {
 	"add_listing": add_listing,
+	"bulk_add_listings": bulk_add_listings,
 	"delete_listing": delete_listing,
 }
 
-# --- Function to process the AI's tool call response (remains largely the same) ---
-def process_tool_calls(ai_response: ChatCompletion):
-	"""
-	Extracts tool calls from an AI response and executes the corresponding functions.
-	"""
-	tool_calls = ai_response.choices[0].message.tool_calls
-
-	if not tool_calls:
-		print("No tool calls found in the AI response.")
-		return False
+# Tools whose calls in one response are merged into a single batched call taking a list of arguments
+batch_tools = {
+	"add_listing": add_listings,
+}
 
-	function_called = False
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_CALL_THREADS, thread_name_prefix='tool-call')
 
+def parse_tool_calls(tool_calls):
+	"""Returns (function_name, function_args) for every tool call that names a known tool with valid arguments."""
+	calls = []
 	for tool_call in tool_calls:
 		if tool_call.type == 'function':
 			function_name = tool_call.function.name
@@ -174,18 +330,61 @@ def process_tool_calls(ai_response: ChatCompletion):
 				continue
 
 			if function_name in available_tools:
-				function_to_call = available_tools[function_name]
-				print(f"  Attempting to call API client function: {function_to_call.__name__} with {function_args}")
-				try:
-					tool_output = function_to_call(**function_args)
-					print(f"  API Client Function Output: {json.dumps(tool_output, indent=2)}")
-					# You would typically send this tool_output back to the AI model
-					# for it to continue the conversation, describing the result of the tool.
-				except Exception as e:
-					print(f"  An error occurred during API client function call: {e}")
-				finally:
-					function_called = True
+				calls.append((function_name, function_args))
 			else:
 				print(f"  Error: Tool '{function_name}' is not defined in available_tools.")
+	return calls
+
+def run_tool_calls(calls, timeout: float = TOOL_CALL_TIMEOUT):
+	"""
+	Runs (function_name, function_args) calls concurrently on the bounded tool executor, with
+	several calls of a batchable tool merged into one call. Returns the outputs in call order;
+	a call that fails or takes longer than timeout gets an error dict.
+	"""
+	outputs = [None] * len(calls)
+	jobs = [] # (indexes of the calls, future)
+	batches = {}
+	for index, (function_name, function_args) in enumerate(calls):
+		if function_name in batch_tools and sum(name == function_name for name, _ in calls) > 1:
+			batches.setdefault(function_name, []).append(index)
+		else:
+			print(f"  Attempting to call API client function: {available_tools[function_name].__name__} with {function_args}")
+			jobs.append(([index], tool_executor.submit(available_tools[function_name], **function_args)))
+	for function_name, indexes in batches.items():
+		print(f"  Attempting to call API client function: {batch_tools[function_name].__name__} with {len(indexes)} calls")
+		jobs.append((indexes, tool_executor.submit(batch_tools[function_name], [calls[index][1] for index in indexes])))
+
+	# Every call was submitted at once, so one deadline gives each call the same timeout
+	deadline = time.monotonic() + timeout
+	for indexes, future in jobs:
+		try:
+			result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+			results = result if len(indexes) > 1 else [result]
+		except FutureTimeoutError:
+			print(f"  Tool call timed out after {timeout}s")
+			results = [{"status": "error", "message": "Tool call timed out"}] * len(indexes)
+		except Exception as e:
+			print(f"  An error occurred during API client function call: {e}")
+			results = [{"status": "error", "message": str(e)}] * len(indexes)
+		for index, output in zip(indexes, results):
+			outputs[index] = output
+	return outputs
+
+# --- Function to process the AI's tool call response ---
+def process_tool_calls(ai_response: ChatCompletion):
+	"""
+	Extracts tool calls from an AI response and executes the corresponding functions.
+	"""
+	tool_calls = ai_response.choices[0].message.tool_calls
+
+	if not tool_calls:
+		print("No tool calls found in the AI response.")
+		return False
+
+	calls = parse_tool_calls(tool_calls)
+	for (function_name, _), tool_output in zip(calls, run_tool_calls(calls)):
+		print(f"  API Client Function Output ({function_name}): {json.dumps(tool_output, indent=2)}")
+		# You would typically send this tool_output back to the AI model
+		# for it to continue the conversation, describing the result of the tool.
 
-	return function_called
+	return bool(calls)
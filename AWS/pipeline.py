@@ -0,0 +1,174 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# How a stage is executed. INLINE runs on the caller (cheap CPU work), THREAD on the pipeline's
+# pool (blocking I/O), ASYNC awaits the stage's coroutine when the pipeline runs on an event loop.
+INLINE = 'inline'
+THREAD = 'thread'
+ASYNC = 'async'
+
+PIPELINE_THREADS = int(os.getenv('PIPELINE_THREADS', 64))
+
+
+class StageError(Exception):
+    """Stops the pipeline with a message and status code that the entry point turns into a response."""
+
+    def __init__(self, message: str, status: int = 500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class StageCache:
+    """
+    Caching hook for a stage. lookup(ctx) fills ctx from a cache and returns True on a hit, in
+    which case the stage is skipped. store(ctx) runs after the stage to cache what it produced.
+    """
+
+    def __init__(self, lookup, store=None):
+        self.lookup = lookup
+        self.store = store
+
+
+class Stage:
+    def __init__(self, name: str, run, executor: str = INLINE, run_async=None, when=None, cache: StageCache = None, background: bool = False):
+        """
+        run(ctx) does the stage's work by reading and writing the shared context dict.
+        run_async(ctx, run_blocking) is an optional coroutine used by Pipeline.run_async.
+        when(ctx) returning False skips the stage. Background stages are started and only
+        waited for at the end of the pipeline.
+        """
+        self.name = name
+        self.run = run
+        self.executor = executor
+        self.run_async = run_async
+        self.when = when
+        self.cache = cache
+        self.background = background
+
+
+class Parallel:
+    """A group of independent stages that run concurrently; the pipeline continues when all finish."""
+
+    def __init__(self, *stages: Stage):
+        self.stages = stages
+        self.name = '+'.join(stage.name for stage in stages)
+
+
+class TimingHook:
+    """Instrumentation hook that records how long every stage took in ctx['timings']."""
+
+    def stage_finished(self, stage, ctx, elapsed, error=None, cache_hit=False, skipped=False):
+        if skipped:
+            return
+        ctx.setdefault('timings', {})[stage.name] = round(elapsed * 1000, 1)
+        outcome = 'cache hit' if cache_hit else ('failed' if error else 'done')
+        print(f"[pipeline] {stage.name}: {outcome} in {elapsed * 1000:.0f} ms")
+
+
+class Pipeline:
+    def __init__(self, steps, hooks=(), executor: ThreadPoolExecutor = None):
+        self.steps = list(steps)
+        self.hooks = list(hooks)
+        self.executor = executor or ThreadPoolExecutor(max_workers=PIPELINE_THREADS, thread_name_prefix='pipeline')
+
+    def _notify(self, event, *args, **kwargs):
+        for hook in self.hooks:
+            if hasattr(hook, event):
+                try:
+                    getattr(hook, event)(*args, **kwargs)
+                except Exception as e:
+                    print(f"Pipeline hook {type(hook).__name__}.{event} failed: {e}")
+
+    # --- Synchronous execution ---
+
+    def _run_stage(self, stage, ctx):
+        if stage.when is not None and not stage.when(ctx):
+            self._notify('stage_finished', stage, ctx, 0.0, skipped=True)
+            return
+        self._notify('stage_started', stage, ctx)
+        started_at = time.monotonic()
+        try:
+            if stage.cache is not None and stage.cache.lookup(ctx):
+                self._notify('stage_finished', stage, ctx, time.monotonic() - started_at, cache_hit=True)
+                return
+            stage.run(ctx)
+            if stage.cache is not None and stage.cache.store is not None:
+                stage.cache.store(ctx)
+        except Exception as e:
+            self._notify('stage_finished', stage, ctx, time.monotonic() - started_at, error=e)
+            raise
+        self._notify('stage_finished', stage, ctx, time.monotonic() - started_at)
+
+    def run(self, ctx: dict):
+        """Runs every step in order on the calling thread, using the pool for parallel and background stages."""
+        background = []
+        try:
+            for step in self.steps:
+                if isinstance(step, Parallel):
+                    futures = [self.executor.submit(self._run_stage, stage, ctx) for stage in step.stages]
+                    errors = [future.exception() for future in futures]
+                    if (error := next((e for e in errors if e is not None), None)) is not None:
+                        raise error
+                elif step.background:
+                    background.append(self.executor.submit(self._run_stage, step, ctx))
+                else:
+                    self._run_stage(step, ctx)
+        finally:
+            for future in background:
+                if future.exception() is not None:
+                    print(f"Background stage failed: {future.exception()}")
+        return ctx
+
+    # --- Asynchronous execution ---
+
+    async def run_blocking(self, func, *args):
+        """Runs a blocking call on the pipeline's pool without blocking the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _call(self, stage, func, ctx):
+        if stage.executor == INLINE:
+            return func(ctx)
+        return await self.run_blocking(func, ctx)
+
+    async def _run_stage_async(self, stage, ctx):
+        if stage.when is not None and not stage.when(ctx):
+            self._notify('stage_finished', stage, ctx, 0.0, skipped=True)
+            return
+        self._notify('stage_started', stage, ctx)
+        started_at = time.monotonic()
+        try:
+            if stage.cache is not None and await self._call(stage, stage.cache.lookup, ctx):
+                self._notify('stage_finished', stage, ctx, time.monotonic() - started_at, cache_hit=True)
+                return
+            if stage.run_async is not None and stage.executor == ASYNC:
+                await stage.run_async(ctx, self.run_blocking)
+            else:
+                await self._call(stage, stage.run, ctx)
+            if stage.cache is not None and stage.cache.store is not None:
+                await self._call(stage, stage.cache.store, ctx)
+        except Exception as e:
+            self._notify('stage_finished', stage, ctx, time.monotonic() - started_at, error=e)
+            raise
+        self._notify('stage_finished', stage, ctx, time.monotonic() - started_at)
+
+    async def run_async(self, ctx: dict):
+        """Runs the pipeline on the event loop; waiting stages do not hold a thread."""
+        background = []
+        try:
+            for step in self.steps:
+                if isinstance(step, Parallel):
+                    results = await asyncio.gather(*(self._run_stage_async(stage, ctx) for stage in step.stages), return_exceptions=True)
+                    if (error := next((r for r in results if isinstance(r, Exception)), None)) is not None:
+                        raise error
+                elif step.background:
+                    background.append(asyncio.ensure_future(self._run_stage_async(step, ctx)))
+                else:
+                    await self._run_stage_async(step, ctx)
+        finally:
+            for result in await asyncio.gather(*background, return_exceptions=True):
+                if isinstance(result, Exception):
+                    print(f"Background stage failed: {result}")
+        return ctx
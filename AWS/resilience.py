@@ -0,0 +1,290 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', 90)) # Seconds a whole voice request may take
+
+# Upper bound per call of each external dependency, overridable with e.g. TIMEOUT_TRANSLATE=2
+DEPENDENCY_TIMEOUTS = {
+    's3': 5,
+    'transcribe': 5,
+    'translate': 3,
+    'gemini': 20,
+    'polly': 8,
+    'marketplace': 5,
+    'twilio': 5,
+}
+DEPENDENCY_TIMEOUTS = {name: float(os.getenv(f'TIMEOUT_{name.upper()}', timeout)) for name, timeout in DEPENDENCY_TIMEOUTS.items()}
+
+# Idempotent calls are re-issued if the first attempt has not answered after this many seconds
+HEDGE_DELAYS = {
+    'translate': float(os.getenv('HEDGE_DELAY_TRANSLATE', 0.5)),
+    'polly': float(os.getenv('HEDGE_DELAY_POLLY', 1.5)),
+}
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 30))
+
+# Calls in flight per dependency, overridable with e.g. BULKHEAD_POLLY=256. A call that timed out
+# keeps its slot until it really returns, so a hung dependency can only exhaust its own bulkhead.
+DEPENDENCY_CONCURRENCY = {
+    's3': 32,
+    'transcribe': 32,
+    'translate': 64,
+    'gemini': 64,
+    'polly': 128, # Long answers are synthesized as parallel chunks
+    'marketplace': 64,
+    'twilio': 16,
+}
+DEPENDENCY_CONCURRENCY = {name: int(os.getenv(f'BULKHEAD_{name.upper()}', limit)) for name, limit in DEPENDENCY_CONCURRENCY.items()}
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request-wide deadline or a dependency timeout has passed."""
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+
+class BulkheadFull(CircuitOpen):
+    """Raised instead of calling a dependency that already has its maximum of calls in flight."""
+
+
+class Deadline:
+    """A request-wide time budget that is passed to every stage."""
+
+    def __init__(self, budget: float = REQUEST_DEADLINE):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    @classmethod
+    def from_lambda_context(cls, context, margin: float = 1.0):
+        """Builds a deadline that ends slightly before the Lambda invocation is killed."""
+        if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+            return cls()
+        return cls(context.get_remaining_time_in_millis() / 1000 - margin)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        """Returns the time a call may take: the smaller of cap and the remaining budget."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        return min(cap, remaining)
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass. Open (after failure_threshold consecutive failures): calls fail fast
+    for reset_timeout seconds. Half-open: a single trial call decides whether to close again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"Circuit breaker '{self.name}' opened after {self._failures} failures.")
+                self._opened_at = time.monotonic()
+
+
+breakers = {name: CircuitBreaker(name) for name in DEPENDENCY_TIMEOUTS}
+
+
+class Bulkhead:
+    """
+    A dependency's own thread pool and in-flight limit. Calls run on the pool so that the caller
+    can stop waiting when the timeout or deadline passes; a call that cannot get a slot is
+    rejected at once instead of queueing behind calls that may never return.
+    """
+
+    def __init__(self, name: str, max_concurrent: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix=f'{name}-call')
+
+    def try_acquire(self) -> bool:
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._in_flight += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs fn on the pool with a slot taken by try_acquire, which is released when fn returns."""
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.release()
+            raise
+        future.add_done_callback(lambda _: self.release())
+        return future
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._in_flight
+
+
+bulkheads = {name: Bulkhead(name, DEPENDENCY_CONCURRENCY[name]) for name in DEPENDENCY_TIMEOUTS}
+
+
+def _hedged(bulkhead: Bulkhead, fn, args, kwargs, timeout: float, hedge_after: float):
+    """
+    Runs fn with the slot already taken, starts a second attempt if the first is slow (and the
+    bulkhead has room for it), and returns whichever succeeds first.
+    """
+    pending = {bulkhead.submit(fn, *args, **kwargs)}
+    started_at = time.monotonic()
+    hedged = False
+    last_error = None
+    while pending:
+        elapsed = time.monotonic() - started_at
+        wait_for = (hedge_after - elapsed) if not hedged else (timeout - elapsed)
+        done, pending = wait(pending, timeout=max(0.0, min(wait_for, timeout - elapsed)), return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            last_error = future.exception()
+        if time.monotonic() - started_at >= timeout:
+            break
+        if not hedged:
+            # Hedge either because the first attempt is slow or because it failed fast
+            hedged = True
+            if bulkhead.try_acquire():
+                pending.add(bulkhead.submit(fn, *args, **kwargs))
+    if last_error is not None and not pending:
+        raise last_error
+    raise DeadlineExceeded(f"Call did not complete within {timeout:.2f}s")
+
+
+def guarded_call(dependency: str, fn, *args, deadline: Deadline = None, hedge: bool = False, fallback=None, not_failures: tuple = (), **kwargs):
+    """
+    Calls fn(*args, **kwargs) against an external dependency with its timeout (bounded by the
+    request deadline), its circuit breaker, its bulkhead and, for idempotent calls, a hedged
+    second attempt. If a fallback callable is given it is returned instead of raising when the
+    call fails. Exceptions of the not_failures types (e.g. a 429 or 400 from the provider) mean
+    the dependency answered, so they do not count towards opening its circuit breaker.
+    """
+    breaker = breakers[dependency]
+    bulkhead = bulkheads[dependency]
+    try:
+        timeout = deadline.timeout(DEPENDENCY_TIMEOUTS[dependency]) if deadline else DEPENDENCY_TIMEOUTS[dependency]
+        if not bulkhead.try_acquire():
+            raise BulkheadFull(f"{dependency} has {bulkhead.max_concurrent} calls in flight")
+        if not breaker.allow():
+            bulkhead.release()
+            raise CircuitOpen(f"{dependency} is unavailable")
+    except (DeadlineExceeded, CircuitOpen) as e:
+        if fallback is not None:
+            print(f"Skipping {dependency} ({e}), using fallback.")
+            return fallback()
+        raise
+
+    try:
+        if hedge and dependency in HEDGE_DELAYS:
+            result = _hedged(bulkhead, fn, args, kwargs, timeout, HEDGE_DELAYS[dependency])
+        else:
+            try:
+                result = bulkhead.submit(fn, *args, **kwargs).result(timeout=timeout)
+            except FutureTimeoutError:
+                raise DeadlineExceeded(f"{dependency} did not respond within {timeout:.2f}s")
+    except Exception as e:
+        if isinstance(e, not_failures):
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        if fallback is not None:
+            print(f"{dependency} call failed ({e!r}), using fallback.")
+            return fallback()
+        raise
+    breaker.record_success()
+    return result
+
+
+async def async_guarded_call(dependency: str, create, *args, deadline: Deadline = None, not_failures: tuple = (), **kwargs):
+    """guarded_call for coroutine functions such as AsyncOpenAI methods (no hedging or fallback)."""
+    breaker = breakers[dependency]
+    bulkhead = bulkheads[dependency]
+    timeout = deadline.timeout(DEPENDENCY_TIMEOUTS[dependency]) if deadline else DEPENDENCY_TIMEOUTS[dependency]
+    if not bulkhead.try_acquire():
+        raise BulkheadFull(f"{dependency} has {bulkhead.max_concurrent} calls in flight")
+    if not breaker.allow():
+        bulkhead.release()
+        raise CircuitOpen(f"{dependency} is unavailable")
+    try:
+        result = await asyncio.wait_for(create(*args, **kwargs), timeout=timeout)
+    except asyncio.TimeoutError:
+        breaker.record_failure()
+        raise DeadlineExceeded(f"{dependency} did not respond within {timeout:.2f}s")
+    except not_failures:
+        breaker.record_success()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    finally:
+        bulkhead.release() # The coroutine was cancelled on timeout, so nothing is left running
+    breaker.record_success()
+    return result
+
+
+def breaker_states():
+    """Returns the state of every dependency's circuit breaker."""
+    return {name: breaker.state for name, breaker in breakers.items()}
+
+
+def bulkhead_states():
+    """Returns the calls in flight and the limit of every dependency's bulkhead."""
+    return {name: {'in_flight': bulkhead.in_flight, 'limit': bulkhead.max_concurrent} for name, bulkhead in bulkheads.items()}
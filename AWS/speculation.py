@@ -0,0 +1,64 @@
+import os
+import threading
+from collections import deque
+
+# 'off': never speculate. 'always': start the LLM call alongside every cache lookup.
+# 'auto': speculate while the recent cache hit rate is low enough that most calls are used.
+LLM_SPECULATION = os.getenv('LLM_SPECULATION', 'off').lower()
+SPECULATION_MAX_HIT_RATE = float(os.getenv('SPECULATION_MAX_HIT_RATE', 0.3))
+SPECULATION_WINDOW = int(os.getenv('SPECULATION_WINDOW', 200)) # Recent lookups the hit rate is measured over
+
+
+class SpeculationPolicy:
+    """
+    Decides whether to start the LLM request before the cache lookup has answered, and keeps
+    score: latency saved on misses against calls and tokens wasted on hits.
+    """
+
+    def __init__(self, mode: str = LLM_SPECULATION, max_hit_rate: float = SPECULATION_MAX_HIT_RATE, window: int = SPECULATION_WINDOW):
+        if mode not in ('off', 'always', 'auto'):
+            raise ValueError(f"Unknown speculation mode '{mode}', expected off, always or auto")
+        self.mode = mode
+        self.max_hit_rate = max_hit_rate
+        self._lookups = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._stats = {'speculated': 0, 'used': 0, 'wasted': 0, 'tokens_wasted': 0, 'latency_saved_ms': 0.0}
+
+    def hit_rate(self) -> float:
+        with self._lock:
+            return sum(self._lookups) / len(self._lookups) if self._lookups else 0.0
+
+    def should_speculate(self) -> bool:
+        if self.mode == 'always':
+            return True
+        return self.mode == 'auto' and self.hit_rate() <= self.max_hit_rate
+
+    def record_lookup(self, hit: bool):
+        with self._lock:
+            self._lookups.append(1 if hit else 0)
+
+    def record_speculated(self):
+        with self._lock:
+            self._stats['speculated'] += 1
+
+    def record_used(self, latency_saved: float):
+        with self._lock:
+            self._stats['used'] += 1
+            self._stats['latency_saved_ms'] += latency_saved * 1000
+
+    def record_wasted(self):
+        with self._lock:
+            self._stats['wasted'] += 1
+
+    def record_wasted_tokens(self, tokens: int):
+        with self._lock:
+            self._stats['tokens_wasted'] += tokens
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = len(self._lookups)
+            hit_rate = sum(self._lookups) / lookups if lookups else 0.0
+        stats['latency_saved_ms'] = round(stats['latency_saved_ms'], 1)
+        stats.update({'mode': self.mode, 'cache_hit_rate': round(hit_rate, 3), 'lookups_in_window': lookups})
+        return stats
@@ -0,0 +1,710 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from openai import BadRequestError, RateLimitError
+
+import marketplace_tools
+from audio_preprocess import AUDIO_PREPROCESSING, pcm16_to_mulaw, preprocess_audio
+from llm_limiter import LLMRateLimited
+from pipeline import ASYNC, INLINE, THREAD, Parallel, Pipeline, Stage, StageCache, StageError, TimingHook
+from resilience import DEPENDENCY_TIMEOUTS, Deadline, DeadlineExceeded, async_guarded_call, guarded_call
+
+TARGET_LLM_LANGUAGE = 'en'
+DEFAULT_FARMER_LANGUAGE = 'hi-IN'
+SUPPORTED_TRANSCRIBE_LANGUAGES = [
+    'en-US', 'hi-IN', 'gu-IN', 'mr-IN', 'bn-IN',
+    'ta-IN', 'te-IN', 'kn-IN', 'ml-IN', 'pa-IN',
+]
+# Polly voices for the languages responses are spoken in; anything else uses the default voice
+POLLY_VOICES = {'hi-IN': 'Kajal', 'en-IN': 'Kajal'}
+DEFAULT_POLLY_VOICE = 'Kajal'
+LLM_MODEL = "gemini-2.0-flash"
+# Response audio formats a client may ask for: the Polly OutputFormat and the sample rates Polly
+# allows for it. 'mulaw' is 8 kHz PCM from Polly companded to G.711 mu-law for phone calls.
+AUDIO_OUTPUT_FORMATS = {
+    'mp3': ('mp3', ('8000', '16000', '22050', '24000')),
+    'ogg_vorbis': ('ogg_vorbis', ('8000', '16000', '22050', '24000')),
+    'pcm': ('pcm', ('8000', '16000')),
+    'mulaw': ('pcm', ('8000',)),
+}
+DEFAULT_AUDIO_FORMAT = 'mp3'
+# Longer responses are synthesized as chunks of about this many characters in parallel
+POLLY_CHUNK_CHARS = int(os.getenv('POLLY_CHUNK_CHARS', 400))
+POLLY_MAX_CHARS = 3000 # Polly's limit on billed characters per request
+POLLY_SYNTHESIS_THREADS = int(os.getenv('POLLY_SYNTHESIS_THREADS', 16)) # Chunk requests in flight across all calls
+SPECULATIVE_LLM_THREADS = int(os.getenv('SPECULATIVE_LLM_THREADS', 16)) # Speculative LLM calls in flight across all calls
+# Formats whose streams can be joined byte for byte: MP3 frames and headerless samples. Ogg
+# Vorbis is only split when the text exceeds Polly's limit, as a chained Ogg stream.
+CONCATENABLE_AUDIO_FORMATS = ('mp3', 'pcm', 'mulaw')
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?।॥])\s+')
+CLAUSE_BOUNDARY = re.compile(r'(?<=[,;:])\s+')
+LLM_BUSY_RESPONSE = "Our assistant is busy right now. Please try again in a moment."
+# Gemini answered, but refused the request: quota bursts are handled by the LLM limiter's cooldown
+# and bad requests are ours, so neither opens the gemini circuit breaker
+LLM_CLIENT_ERRORS = (RateLimitError, BadRequestError)
+
+
+def boto_config_for(dependency, max_pool_connections=10):
+    """Client config whose socket timeouts match the dependency's timeout, so abandoned calls end too."""
+    timeout = DEPENDENCY_TIMEOUTS[dependency]
+    return Config(
+        connect_timeout=min(timeout, 2), read_timeout=timeout, retries={'max_attempts': 2},
+        max_pool_connections=max_pool_connections
+    )
+
+
+def create_aws_clients(region_name=None, max_pool_connections=10):
+    """Creates the S3, Transcribe, Translate and Polly clients used by the voice pipeline."""
+    return {
+        f'{service}_client': boto3.client(service, region_name=region_name, config=boto_config_for(service, max_pool_connections))
+        for service in ('s3', 'transcribe', 'translate', 'polly')
+    }
+
+
+def negotiate_audio_format(audio_format=None, sample_rate=None):
+    """
+    Validates the response audio a client asked for and returns (audio_format, sample_rate).
+    sample_rate is None for formats whose default Polly rate is used. Raises ValueError.
+    """
+    audio_format = (audio_format or DEFAULT_AUDIO_FORMAT).lower()
+    if audio_format not in AUDIO_OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported audio_format '{audio_format}', expected one of {', '.join(AUDIO_OUTPUT_FORMATS)}")
+    supported_rates = AUDIO_OUTPUT_FORMATS[audio_format][1]
+    if sample_rate is None:
+        # Raw PCM has no header, so always tell the client which rate it is getting
+        return audio_format, supported_rates[-1] if audio_format in ('pcm', 'mulaw') else None
+    if str(sample_rate) not in supported_rates:
+        raise ValueError(f"Unsupported sample_rate {sample_rate} for {audio_format}, expected one of {', '.join(supported_rates)}")
+    return audio_format, str(sample_rate)
+
+
+def split_for_speech(text, max_chars=POLLY_CHUNK_CHARS):
+    """
+    Splits text into chunks of at most max_chars for separate Polly requests: at sentence ends
+    (including the Devanagari danda), then at clause ends and spaces for overlong sentences.
+    Neighbouring sentences are packed into one chunk while they fit.
+    """
+    pieces = []
+    for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for clause in CLAUSE_BOUNDARY.split(sentence):
+            while len(clause) > max_chars:
+                cut = clause.rfind(' ', 0, max_chars + 1)
+                if cut <= 0:
+                    cut = max_chars
+                pieces.append(clause[:cut].strip())
+                clause = clause[cut:].strip()
+            pieces.append(clause)
+    chunks = []
+    for piece in filter(None, pieces):
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def language_for_translate(language_code):
+    """Amazon Translate takes the primary language subtag, e.g. 'hi' for 'hi-IN'."""
+    return language_code.split('-')[0]
+
+
+class VoiceGateway:
+    """
+    The voice flow shared by every entry point: receive -> preprocess -> S3 -> transcribe -> translate ->
+    cache/LLM -> translate -> Polly -> cleanup. Entry points build the request context, call
+    run() or run_async() and turn the context into their own response format.
+
+    language_mode 'identify' lets Transcribe detect the language and answers in Hindi or
+    English; 'fixed' uses the caller-supplied farmer_language_code for both directions.
+    cache_strategy 'semantic' matches similar queries, 'exact' only identical ones.
+    With caller_profiles, repeat callers in 'identify' mode are transcribed with the language
+    remembered for their phone number instead of running language identification.
+    audio_preprocessing trims silence and downsamples the recording before it is uploaded.
+    With an intent_router, simple sell commands call add_listing directly instead of the LLM.
+    With a speculation policy, the LLM request may start alongside the cache lookup; its result
+    is only used (and its tool calls only run) if the lookup misses. Speculative calls run on
+    speculation_executor, never on the pipeline's own pool, whose stage threads wait for them.
+    native_cache looks the untranslated transcript up in the cache's multilingual index first;
+    a hit skips translation, the LLM and, when its audio is cached, Polly.
+    Responses longer than speech_chunk_chars are synthesized sentence by sentence in parallel on
+    polly_executor, with every chunk cached on its own.
+    """
+
+    def __init__(self, s3_client, transcribe_client, translate_client, polly_client, llm_client, cache, llm_limiter,
+                 bucket, async_llm_client=None, audio_prefix='incoming_audio', audio_extension='mp3', media_format='mp3',
+                 language_mode='identify', cache_strategy='semantic', poll_interval=1.0, prompt_template=None,
+                 conversation=None, tool_response_text="The requested task has been completed.",
+                 llm_error_text="I'm sorry, I could not generate an a response at this time.", caller_profiles=None,
+                 audio_preprocessing=AUDIO_PREPROCESSING, intent_router=None, speculation=None,
+                 native_cache=False, speech_chunk_chars=POLLY_CHUNK_CHARS, polly_executor=None, speculation_executor=None,
+                 hooks=None, executor=None):
+        self.s3_client = s3_client
+        self.transcribe_client = transcribe_client
+        self.translate_client = translate_client
+        self.polly_client = polly_client
+        self.llm_client = llm_client
+        self.async_llm_client = async_llm_client
+        self.cache = cache
+        self.llm_limiter = llm_limiter
+        self.bucket = bucket
+        self.audio_prefix = audio_prefix
+        self.audio_extension = audio_extension
+        self.media_format = media_format
+        self.language_mode = language_mode
+        self.cache_strategy = cache_strategy
+        self.poll_interval = poll_interval
+        self.prompt_template = prompt_template or "{query}"
+        self.conversation = conversation
+        self.tool_response_text = tool_response_text
+        self.llm_error_text = llm_error_text
+        self.caller_profiles = caller_profiles
+        self.audio_preprocessing = audio_preprocessing
+        self.intent_router = intent_router
+        self.speculation = speculation
+        self.native_cache = native_cache
+        self.speech_chunk_chars = speech_chunk_chars
+        self.polly_executor = polly_executor or ThreadPoolExecutor(max_workers=POLLY_SYNTHESIS_THREADS, thread_name_prefix='polly')
+        self.speculation_executor = speculation_executor or ThreadPoolExecutor(max_workers=SPECULATIVE_LLM_THREADS, thread_name_prefix='speculative-llm')
+
+        if native_cache:
+            # Translation waits for the native lookup, since a hit makes it unnecessary
+            understand = [
+                Parallel(
+                    Stage('resolve_voice', self.resolve_voice, INLINE),
+                    Stage('native_cache', self.lookup_native_cache, THREAD),
+                ),
+                Stage('translate_in', self.translate_in, THREAD, when=lambda ctx: 'text_for_llm' not in ctx),
+            ]
+        else:
+            understand = [
+                Parallel(
+                    Stage('resolve_voice', self.resolve_voice, INLINE),
+                    Stage('translate_in', self.translate_in, THREAD),
+                ),
+            ]
+
+        self.pipeline = Pipeline([
+            Stage('preprocess', self.preprocess_audio, THREAD, when=lambda ctx: self.audio_preprocessing),
+            Stage('upload', self.upload_audio, THREAD),
+            Stage('transcribe', self.transcribe, ASYNC, run_async=self.transcribe_async),
+            Stage('cleanup', self.cleanup, THREAD, background=True),
+            Stage('caller_profile', self.update_caller_profile, THREAD, background=True,
+                  when=lambda ctx: self.caller_profiles is not None and ctx.get('caller_number') and self.language_mode == 'identify'),
+            *understand,
+            Stage('intent_router', self.route_intent, THREAD,
+                  when=lambda ctx: self.intent_router is not None and 'llm_response_text' not in ctx),
+            Stage('llm', self.generate_response, ASYNC, run_async=self.generate_response_async,
+                  when=lambda ctx: 'llm_response_text' not in ctx,
+                  cache=StageCache(self.lookup_cached_response, self.store_cached_response)),
+            Parallel(
+                Stage('translate_out', self.translate_out, THREAD, when=lambda ctx: 'final_response_text' not in ctx),
+                Stage('speech_cache', self.lookup_cached_speech, THREAD),
+            ),
+            Stage('synthesize', self.synthesize, THREAD,
+                  cache=StageCache(self.use_cached_speech, self.store_cached_speech)),
+            Stage('native_cache_store', self.store_native_cache, THREAD, background=True,
+                  when=lambda ctx: self.native_cache and ctx['cache_status'] != 'native_hit' and not ctx.get('degraded') and (ctx.get('cacheable') or ctx['cache_status'] == 'hit')),
+        ], hooks=[TimingHook()] if hooks is None else hooks, executor=executor)
+
+    # --- Entry points ---
+
+    def new_context(self, audio_bytes, farmer_language_code=None, deadline=None, caller_number=None, audio_format=None, sample_rate=None):
+        """Creates the context dict a request is processed with. Raises ValueError for an unsupported audio format."""
+        audio_format, sample_rate = negotiate_audio_format(audio_format, sample_rate)
+        return {
+            'audio_bytes': audio_bytes,
+            'farmer_language_code': farmer_language_code or DEFAULT_FARMER_LANGUAGE,
+            'caller_number': caller_number,
+            'audio_extension': self.audio_extension,
+            'media_format': self.media_format,
+            'audio_format': audio_format,
+            'sample_rate': sample_rate,
+            'deadline': deadline or Deadline(),
+            'cache_status': 'miss',
+        }
+
+    def run(self, ctx):
+        return self.pipeline.run(ctx)
+
+    async def run_async(self, ctx):
+        return await self.pipeline.run_async(ctx)
+
+    # --- Stages ---
+
+    def preprocess_audio(self, ctx):
+        """Replaces the recording with trimmed mono WAV when that makes it shorter or smaller."""
+        audio, report = preprocess_audio(ctx['audio_bytes'])
+        ctx['audio_preprocessing'] = report
+        if audio is None:
+            return
+        ctx['audio_bytes'] = audio
+        ctx['audio_extension'] = ctx['media_format'] = 'wav'
+        print(f"Audio preprocessed: saved {report['bytes_saved']} bytes and {report['seconds_saved']}s "
+              f"({report['original_seconds']}s -> {report['processed_seconds']}s at {report['sample_rate']} Hz).")
+
+    def upload_audio(self, ctx):
+        unique_id = str(uuid.uuid4())
+        audio_filename = f"{self.audio_prefix}/{unique_id}.{ctx['audio_extension']}"
+        try:
+            guarded_call('s3', self.s3_client.put_object, deadline=ctx['deadline'], Bucket=self.bucket, Key=audio_filename, Body=ctx['audio_bytes'])
+        except Exception as e:
+            print(f"S3 Upload Error: {e}")
+            raise StageError('Failed to upload audio to S3') from e
+        ctx['unique_id'] = unique_id
+        ctx['audio_filename'] = audio_filename
+        ctx['audio_s3_uri'] = f"s3://{self.bucket}/{audio_filename}"
+        print(f"Audio uploaded to S3: {ctx['audio_s3_uri']}")
+
+    def start_transcription(self, ctx):
+        transcription_job_name = f"voice-to-text-{ctx['unique_id']}"
+        ctx['transcription_job_name'] = transcription_job_name
+        ctx['transcript_s3_key'] = f'transcripts/{transcription_job_name}.json'
+        if self.language_mode == 'identify' and (caller_language := self.known_caller_language(ctx)):
+            print(f"Known caller, transcribing directly in {caller_language}.")
+            ctx['language_source'] = 'caller_profile'
+            language_args = {'LanguageCode': caller_language}
+        elif self.language_mode == 'identify':
+            ctx['language_source'] = 'identified'
+            language_args = {'IdentifyLanguage': True, 'LanguageOptions': SUPPORTED_TRANSCRIBE_LANGUAGES}
+        else:
+            ctx['language_source'] = 'fixed'
+            language_args = {'LanguageCode': ctx['farmer_language_code']}
+        guarded_call(
+            'transcribe', self.transcribe_client.start_transcription_job, deadline=ctx['deadline'],
+            TranscriptionJobName=transcription_job_name,
+            MediaFormat=ctx['media_format'],
+            Media={'MediaFileUri': ctx['audio_s3_uri']},
+            OutputBucketName=self.bucket,
+            OutputKey=ctx['transcript_s3_key'],
+            **language_args
+        )
+
+    def read_s3_object(self, key):
+        return self.s3_client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def check_transcription(self, ctx):
+        """Checks the Transcribe job once; returns True once the transcript is in ctx, raises if it failed."""
+        job = guarded_call('transcribe', self.transcribe_client.get_transcription_job, deadline=ctx['deadline'],
+                           TranscriptionJobName=ctx['transcription_job_name'])['TranscriptionJob']
+        status = job['TranscriptionJobStatus']
+        print(f"Transcription status: {status}")
+        if status == 'COMPLETED':
+            transcript_content = json.loads(guarded_call('s3', self.read_s3_object, ctx['transcript_s3_key'], deadline=ctx['deadline']).decode('utf-8'))
+            ctx['transcribed_text'] = transcript_content['results']['transcripts'][0]['transcript']
+            ctx['detected_language'] = job.get('LanguageCode') or ctx['farmer_language_code']
+            ctx['transcription_confidence'] = self.transcription_confidence(job, transcript_content)
+            print(f"Detected Language: {ctx['detected_language']}")
+            print(f"Transcribed Text: {ctx['transcribed_text']}")
+            return True
+        elif status == 'FAILED':
+            raise Exception(job.get('FailureReason', 'Unknown reason'))
+        if ctx['deadline'].remaining() <= self.poll_interval:
+            raise DeadlineExceeded("Transcription job timed out.")
+        return False
+
+    def known_caller_language(self, ctx):
+        if self.caller_profiles is None or not ctx.get('caller_number'):
+            return None
+        try:
+            return self.caller_profiles.get_language(ctx['caller_number'])
+        except Exception as e:
+            print(f"Caller profile lookup error: {e}")
+            return None
+
+    def transcription_confidence(self, job, transcript_content):
+        """
+        How sure Transcribe is about the language: the identification score for identified jobs,
+        otherwise the mean word confidence, which drops when the audio is in another language.
+        """
+        if job.get('IdentifiedLanguageScore') is not None:
+            return float(job['IdentifiedLanguageScore'])
+        confidences = [
+            float(item['alternatives'][0]['confidence'])
+            for item in transcript_content['results'].get('items', [])
+            if item.get('type') == 'pronunciation' and item.get('alternatives')
+        ]
+        return sum(confidences) / len(confidences) if confidences else 0.0
+
+    def transcribe(self, ctx):
+        try:
+            self.start_transcription(ctx)
+            while not self.check_transcription(ctx):
+                time.sleep(self.poll_interval)
+        except Exception as e:
+            print(f"Transcribe Error: {e}")
+            raise StageError(f'Transcription failed: {str(e)}') from e
+
+    async def transcribe_async(self, ctx, run_blocking):
+        # Polling sleeps on the event loop, so a waiting request does not hold a thread
+        try:
+            await run_blocking(self.start_transcription, ctx)
+            while not await run_blocking(self.check_transcription, ctx):
+                await asyncio.sleep(self.poll_interval)
+        except Exception as e:
+            print(f"Transcribe Error: {e}")
+            raise StageError(f'Transcription failed: {str(e)}') from e
+
+    def cleanup(self, ctx):
+        """Deletes the uploaded audio and transcript; nothing reads them once the transcript is in ctx."""
+        try:
+            for key in (ctx.get('audio_filename'), ctx.get('transcript_s3_key')):
+                if key:
+                    guarded_call('s3', self.s3_client.delete_object, Bucket=self.bucket, Key=key)
+            print("Cleaned up temporary S3 files.")
+        except Exception as e:
+            print(f"Warning: Failed to cleanup S3 objects: {e}")
+
+    def update_caller_profile(self, ctx):
+        try:
+            self.caller_profiles.record(
+                ctx['caller_number'], ctx['detected_language'], ctx['transcription_confidence'],
+                identified=ctx['language_source'] == 'identified'
+            )
+        except Exception as e:
+            print(f"Caller profile update error: {e}")
+
+    def resolve_voice(self, ctx):
+        """Picks the language and Polly voice the response is spoken with."""
+        detected_language = ctx['detected_language']
+        if self.language_mode != 'identify':
+            target_polly_lang = ctx['farmer_language_code']
+        # If detected language is a regional Indian one without direct Polly support, translate to Hindi or English
+        elif detected_language.startswith(('en-', 'ta-', 'te-', 'kn-', 'ml-')):
+            target_polly_lang = 'en-IN'
+        else:
+            target_polly_lang = 'hi-IN'
+        ctx['target_polly_lang'] = target_polly_lang
+        ctx['polly_voice_id'] = POLLY_VOICES.get(target_polly_lang, DEFAULT_POLLY_VOICE)
+        ctx['polly_engine'] = 'neural' # Prefer neural voices
+
+    def lookup_native_cache(self, ctx):
+        """Answers a query from the native-language cache, filling in every later stage's output it can."""
+        try:
+            entry = self.cache.get_native(ctx['transcribed_text'], ctx['detected_language'])
+        except Exception as e:
+            print(f"Native cache lookup error: {e}")
+            return
+        if entry is None:
+            return
+        print("⚡ Native-language cache HIT!")
+        ctx['cache_status'] = 'native_hit'
+        ctx['text_for_llm'] = entry['text_for_llm']
+        ctx['llm_response_text'] = entry['llm_response']
+        ctx['final_response_text'] = entry['final_text']
+
+    def store_native_cache(self, ctx):
+        try:
+            self.cache.set_native(
+                ctx['transcribed_text'], ctx['detected_language'], ctx['text_for_llm'], ctx['llm_response_text'],
+                ctx['final_response_text'], ctx['target_polly_lang'], ctx['polly_voice_id']
+            )
+        except Exception as e:
+            print(f"Native cache store error: {e}")
+
+    def degrade(self, ctx, fallback):
+        """Wraps a fallback so that using it marks the request degraded, which keeps its results out of every cache."""
+        def degraded():
+            ctx['degraded'] = True
+            return fallback()
+        return degraded
+
+    def translate(self, ctx, text, source_language, target_language):
+        """Translates text, falling back to the original text if Translate fails or is degraded."""
+        translate_response = guarded_call(
+            'translate', self.translate_client.translate_text, deadline=ctx['deadline'], hedge=True,
+            fallback=self.degrade(ctx, lambda: {'TranslatedText': text}),
+            Text=text,
+            SourceLanguageCode=language_for_translate(source_language),
+            TargetLanguageCode=language_for_translate(target_language)
+        )
+        return translate_response['TranslatedText']
+
+    def translate_in(self, ctx):
+        ctx['text_for_llm'] = ctx['transcribed_text']
+        if language_for_translate(ctx['detected_language']) != TARGET_LLM_LANGUAGE:
+            print(f"Translating from {ctx['detected_language']} to {TARGET_LLM_LANGUAGE} for LLM.")
+            ctx['text_for_llm'] = self.translate(ctx, ctx['transcribed_text'], ctx['detected_language'], TARGET_LLM_LANGUAGE)
+            print(f"Translated Text for LLM: {ctx['text_for_llm']}")
+
+    def route_intent(self, ctx):
+        """Runs the tool call of a simple marketplace command directly; anything else is left to the LLM."""
+        caller_digits = re.sub(r'\D', '', ctx.get('caller_number') or '')[-10:]
+        routed = self.intent_router.route(ctx['text_for_llm'], seller_contact=caller_digits or None)
+        if routed is None:
+            return
+        tool_name, tool_args = routed
+        print(f"Intent router matched {tool_name} with {tool_args}, skipping the LLM.")
+        tool_output = marketplace_tools.run_tool_calls([routed])[0]
+        if tool_output.get('status') != 'success':
+            print(f"Routed {tool_name} failed ({tool_output.get('message')}), falling back to the LLM.")
+            return
+        ctx['routed_intent'] = tool_name
+        ctx['llm_response_text'] = f"Your listing for {tool_args['item_name']} at {tool_args['price']:g} rupees has been added."
+        if self.conversation is not None:
+            self.conversation.add_entry({"role": "user", "content": self.prompt_template.format(query=ctx['text_for_llm'])})
+            self.conversation.add_entry({"role": "assistant", "content": ctx['llm_response_text']})
+
+    def lookup_cached_response(self, ctx):
+        speculative = self.start_speculative_llm(ctx)
+        lookup_started_at = time.monotonic()
+        hit = self.lookup_cache(ctx)
+        if self.speculation is not None:
+            self.speculation.record_lookup(hit)
+        if speculative is not None:
+            if hit:
+                self.abandon_speculative_llm(speculative)
+            else:
+                speculative['lookup_time'] = time.monotonic() - lookup_started_at
+                ctx['speculative_llm'] = speculative
+        return hit
+
+    def lookup_cache(self, ctx):
+        try:
+            if self.cache_strategy == 'semantic':
+                cached_response = self.cache.get_semantically(ctx['text_for_llm'])
+            else:
+                cached_response = self.cache.get(ctx['text_for_llm'])
+        except Exception as e:
+            print(f"Cache lookup error: {e}")
+            return False
+        if cached_response:
+            print("⚡ Cache HIT!")
+            ctx['llm_response_text'] = cached_response
+            ctx['cache_status'] = 'hit'
+            return True
+        return False
+
+    def store_cached_response(self, ctx):
+        if ctx.get('cacheable') and not ctx.get('degraded'):
+            try:
+                self.cache.set(ctx['text_for_llm'], ctx['llm_response_text']) # Cache new responses
+            except Exception as e:
+                print(f"Cache store error: {e}")
+
+    def build_llm_messages(self, ctx, record=True):
+        """The conversation plus this query. record=False leaves the conversation untouched."""
+        message = {"role": "user", "content": self.prompt_template.format(query=ctx['text_for_llm'])}
+        if self.conversation is None:
+            return [message]
+        if not record:
+            return (self.conversation.get_all_entries() + [message])[-self.conversation.get_max_size():]
+        self.conversation.add_entry(message)
+        return self.conversation.get_all_entries()
+
+    def llm_request(self, ctx, record=True):
+        return dict(
+            priority=marketplace_tools.is_marketplace_request(ctx['text_for_llm']),
+            model=LLM_MODEL,
+            messages=self.build_llm_messages(ctx, record),
+            tools=marketplace_tools.tools,
+            tool_choice="auto"
+        )
+
+    def call_llm(self, ctx, request):
+        return self.llm_limiter.call(
+            lambda **kwargs: guarded_call('gemini', self.llm_client.chat.completions.create, deadline=ctx['deadline'], not_failures=LLM_CLIENT_ERRORS, **kwargs),
+            **request
+        )
+
+    # --- Speculative LLM calls ---
+
+    def start_speculative_llm(self, ctx):
+        """Starts the LLM request before the cache has answered, if the speculation policy says so."""
+        if self.speculation is None or not self.speculation.should_speculate():
+            return None
+        self.speculation.record_speculated()
+        speculative = {'started_at': time.monotonic()}
+        # The conversation is only updated once the response is actually used
+        request = self.llm_request(ctx, record=False)
+
+        def call():
+            try:
+                return self.call_llm(ctx, request)
+            finally:
+                speculative['finished_at'] = time.monotonic()
+
+        # Not on the pipeline's pool: generate_response blocks a stage thread on this future, so with
+        # every pool thread waiting, a speculative call queued behind them would never run
+        speculative['future'] = self.speculation_executor.submit(call)
+        return speculative
+
+    def abandon_speculative_llm(self, speculative):
+        """Drops the LLM call after a cache hit; the response, tool calls included, is never handled."""
+        self.speculation.record_wasted()
+
+        def count_wasted_tokens(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            usage = getattr(future.result(), 'usage', None)
+            if usage is not None:
+                self.speculation.record_wasted_tokens(usage.total_tokens)
+
+        # Cancelling only succeeds if the call has not started, in which case nothing was spent
+        speculative['future'].cancel()
+        speculative['future'].add_done_callback(count_wasted_tokens)
+
+    def use_speculative_llm(self, ctx, speculative):
+        """Bookkeeping once a speculative response is used: conversation entry and latency saved."""
+        print("Using the LLM response requested alongside the cache lookup.")
+        if self.conversation is not None:
+            self.conversation.add_entry({"role": "user", "content": self.prompt_template.format(query=ctx['text_for_llm'])})
+        llm_time = speculative.get('finished_at', time.monotonic()) - speculative['started_at']
+        self.speculation.record_used(min(speculative['lookup_time'], llm_time))
+
+    def handle_llm_response(self, ctx, response):
+        """Runs any marketplace tool calls in the response and stores the text to speak."""
+        if marketplace_tools.process_tool_calls(response):
+            llm_response_text = self.tool_response_text # Placeholder for tool action
+        else:
+            llm_response_text = response.choices[0].message.content
+            ctx['cacheable'] = True
+        if self.conversation is not None:
+            self.conversation.add_entry({"role": "assistant", "content": llm_response_text})
+        ctx['llm_response_text'] = llm_response_text
+        print(f"LLM Response: {llm_response_text}")
+
+    def handle_llm_error(self, ctx, e):
+        ctx['degraded'] = True
+        if isinstance(e, LLMRateLimited):
+            print(f"LLM call rejected: {e}")
+            ctx['llm_response_text'] = LLM_BUSY_RESPONSE
+        else:
+            print(f"Error interacting with LLM: {e}")
+            ctx['llm_response_text'] = self.llm_error_text
+
+    def generate_response(self, ctx):
+        print("🔄 Cache MISS - Calling Gemini with tool support...")
+        try:
+            speculative = ctx.pop('speculative_llm', None)
+            if speculative is not None:
+                response = speculative['future'].result()
+                self.use_speculative_llm(ctx, speculative)
+            else:
+                response = self.call_llm(ctx, self.llm_request(ctx))
+            self.handle_llm_response(ctx, response)
+        except Exception as e:
+            self.handle_llm_error(ctx, e)
+
+    async def generate_response_async(self, ctx, run_blocking):
+        if 'speculative_llm' in ctx:
+            print("🔄 Cache MISS - Waiting for the speculative Gemini call...")
+            speculative = ctx.pop('speculative_llm')
+            try:
+                response = await asyncio.wrap_future(speculative['future'])
+                self.use_speculative_llm(ctx, speculative)
+                await run_blocking(self.handle_llm_response, ctx, response)
+            except Exception as e:
+                self.handle_llm_error(ctx, e)
+            return
+        if self.async_llm_client is None:
+            return await run_blocking(self.generate_response, ctx)
+        print("🔄 Cache MISS - Calling Gemini with tool support...")
+        try:
+            response = await self.llm_limiter.async_call(
+                lambda **kwargs: async_guarded_call('gemini', self.async_llm_client.chat.completions.create, deadline=ctx['deadline'],
+                                                     not_failures=LLM_CLIENT_ERRORS, **kwargs),
+                **self.llm_request(ctx)
+            )
+            # Tool calls write to the database, so they run on the pool
+            await run_blocking(self.handle_llm_response, ctx, response)
+        except Exception as e:
+            self.handle_llm_error(ctx, e)
+
+    def translate_out(self, ctx):
+        ctx['final_response_text'] = ctx['llm_response_text']
+        if language_for_translate(ctx['target_polly_lang']) != TARGET_LLM_LANGUAGE:
+            print(f"Translating response from {TARGET_LLM_LANGUAGE} to {ctx['target_polly_lang']} for Polly.")
+            ctx['final_response_text'] = self.translate(ctx, ctx['llm_response_text'], TARGET_LLM_LANGUAGE, ctx['target_polly_lang'])
+            print(f"Translated Response for Farmer: {ctx['final_response_text']}")
+
+    def lookup_cached_speech(self, ctx):
+        """Runs alongside translate_out; speech is keyed on the untranslated response text."""
+        try:
+            ctx['cached_speech'] = self.cache.get_speech(ctx['llm_response_text'], ctx['target_polly_lang'], ctx['polly_voice_id'],
+                                                         ctx['audio_format'], ctx['sample_rate'])
+        except Exception as e:
+            print(f"Speech cache lookup error: {e}")
+
+    def use_cached_speech(self, ctx):
+        if not ctx.get('cached_speech'):
+            return False
+        print("⚡ Speech cache HIT!")
+        ctx['final_response_text'] = ctx['cached_speech']['final_text']
+        ctx['audio_stream'] = ctx['cached_speech']['audio']
+        return True
+
+    def store_cached_speech(self, ctx):
+        if ctx.get('degraded'):
+            return
+        try:
+            self.cache.set_speech(ctx['llm_response_text'], ctx['target_polly_lang'], ctx['polly_voice_id'], ctx['final_response_text'], ctx['audio_stream'],
+                                  audio_format=ctx['audio_format'], sample_rate=ctx['sample_rate'])
+        except Exception as e:
+            print(f"Speech cache store error: {e}")
+
+    def synthesize_speech(self, ctx, text):
+        """One Polly request; mulaw output is converted from Polly's 16-bit PCM."""
+        output_args = {'OutputFormat': AUDIO_OUTPUT_FORMATS[ctx['audio_format']][0]}
+        if ctx['sample_rate']:
+            output_args['SampleRate'] = ctx['sample_rate']
+
+        def synthesize_speech():
+            polly_response = self.polly_client.synthesize_speech(
+                Text=text, VoiceId=ctx['polly_voice_id'],
+                LanguageCode=ctx['target_polly_lang'], Engine=ctx['polly_engine'], **output_args
+            )
+            audio = polly_response['AudioStream'].read()
+            return pcm16_to_mulaw(audio) if ctx['audio_format'] == 'mulaw' else audio
+
+        return guarded_call('polly', synthesize_speech, deadline=ctx['deadline'], hedge=True)
+
+    def synthesize_chunk(self, ctx, text):
+        """Returns (audio, cached) for one chunk, keyed on its (already translated) text."""
+        speech_args = (ctx['target_polly_lang'], ctx['polly_voice_id'])
+        try:
+            cached = self.cache.get_speech(text, *speech_args, ctx['audio_format'], ctx['sample_rate'])
+            if cached:
+                return cached['audio'], True
+        except Exception as e:
+            print(f"Speech chunk cache lookup error: {e}")
+        audio = self.synthesize_speech(ctx, text)
+        if ctx.get('degraded'):
+            return audio, False
+        try:
+            self.cache.set_speech(text, *speech_args, text, audio, audio_format=ctx['audio_format'], sample_rate=ctx['sample_rate'])
+        except Exception as e:
+            print(f"Speech chunk cache store error: {e}")
+        return audio, False
+
+    def synthesize(self, ctx):
+        print(f"Using Polly voice '{ctx['polly_voice_id']}' ({ctx['polly_engine']}) for language '{ctx['target_polly_lang']}' as {ctx['audio_format']}.")
+        text = ctx['final_response_text']
+        max_chars = self.speech_chunk_chars if ctx['audio_format'] in CONCATENABLE_AUDIO_FORMATS else POLLY_MAX_CHARS
+        chunks = split_for_speech(text, max_chars) if len(text) > max_chars else [text]
+        futures = []
+        try:
+            if len(chunks) == 1:
+                ctx['audio_stream'] = self.synthesize_speech(ctx, text)
+                print("Speech synthesized with Polly.")
+                return
+            # The chunks run side by side, so a long answer takes about as long as its slowest chunk
+            futures = [self.polly_executor.submit(self.synthesize_chunk, ctx, chunk) for chunk in chunks]
+            results = [future.result() for future in futures]
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            print(f"Polly Synthesis Error: {e}")
+            raise StageError('Failed during speech synthesis.') from e
+        ctx['audio_stream'] = b''.join(audio for audio, _ in results)
+        ctx['speech_chunks'] = {'chunks': len(chunks), 'cached': sum(cached for _, cached in results)}
+        print(f"Speech synthesized with Polly in {len(chunks)} chunks ({ctx['speech_chunks']['cached']} from cache).")